@@ -13,15 +13,23 @@ from keyboards import (
     get_admin_promo_keyboard,
     get_admin_back_keyboard
 )
-from config import ADMIN_ID, HOSTING_PLANS
+from config import ADMIN_ID, HOSTING_PLANS, ZIP_SPOOL_MAX_SIZE, CRASH_REPORT_WINDOW
 from utils.script_runner import script_runner
 from datetime import datetime, timedelta
 import os
+import html
+import signal
+import asyncio
 import aiofiles
 import shutil
 import zipfile
-import base64
+import tempfile
 from utils.file_processing import file_processor
+from utils.notifier import notifier
+from utils.deployer import deployer
+from utils.supervisor import supervisor
+from utils.log_store import log_manager
+from utils.wheelhouse import wheelhouse
 
 router = Router()
 
@@ -247,23 +255,27 @@ async def handle_zip_file_for_connected_bot(message: Message, state: FSMContext)
         
         # Скачиваем файл
         file = await message.bot.get_file(document.file_id)
-        file_content = await message.bot.download_file(file.file_path)
-        file_bytes = file_content.read()
         
-        await processing_msg.edit_text("📦 Распаковываю архив...")
+        async def report_progress(done_bytes, total_bytes):
+            try:
+                await processing_msg.edit_text(f"📦 Распаковываю архив... {done_bytes * 100 // total_bytes}%")
+            except Exception:
+                pass
         
-        # Извлекаем ZIP для целевого пользователя
-        files = await file_processor.extract_zip(file_bytes, target_user_id)
+        # Скачиваем архив в буфер (большие архивы - во временный файл) и распаковываем потоково
+        with tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_MAX_SIZE) as zip_buffer:
+            await message.bot.download_file(file.file_path, destination=zip_buffer)
+            zip_buffer.seek(0)
+            
+            await processing_msg.edit_text("📦 Распаковываю архив...")
+            
+            # Распаковываем ZIP для целевого пользователя сразу в папку на диске
+            local_saved, total_files = await file_processor.save_zip_locally(zip_buffer, target_user_id, report_progress)
         
-        if not files:
+        if not total_files:
             await processing_msg.edit_text("❌ Не удалось извлечь файлы из архива")
             return
         
-        await processing_msg.edit_text("💾 Сохраняю файлы...")
-        
-        # Сохраняем файлы локально для целевого пользователя
-        local_saved = await file_processor.save_files_locally(files, target_user_id)
-        
         # Автоматически находим основной файл
         from handlers.files import get_correct_main_file_path
         main_file_path, main_file_name = get_correct_main_file_path(target_user_id)
@@ -282,7 +294,7 @@ async def handle_zip_file_for_connected_bot(message: Message, state: FSMContext)
         success_text = f"""✅ Файлы успешно загружены для пользователя {target_user_id}!
 
 📊 Статистика:
-• Файлов в архиве: {len(files)}
+• Файлов в архиве: {total_files}
 • Сохранено локально: {local_saved}"""
         
         if main_file_name and main_file_name != "Python файлы не найдены":
@@ -534,14 +546,103 @@ async def stop_user_bot_handler(message: Message):
             return
         
         user_id = parts[1]
-        await script_runner.stop_script(int(user_id))
-        firebase_db.stop_user_script(user_id)
+        await supervisor.stop(int(user_id))
         
         await message.answer(f"✅ Бот пользователя {user_id} остановлен")
     
     except Exception as e:
         await message.answer(f"❌ Ошибка: {str(e)}")
 
+@router.message(Command("rollback_files"))
+async def rollback_user_files_handler(message: Message):
+    if not check_admin_access(message.from_user.id):
+        return
+    
+    try:
+        parts = message.text.split()
+        if len(parts) != 2:
+            await message.answer("❌ Использование: /rollback_files <user_id>")
+            return
+        
+        user_id = parts[1]
+        if script_runner.is_script_running(int(user_id)):
+            await message.answer("❌ Сначала остановите бота пользователя")
+            return
+        
+        if not await asyncio.to_thread(deployer.rollback, user_id):
+            await message.answer(f"❌ У пользователя {user_id} нет сохраненных версий файлов")
+            return
+        
+        await message.answer(f"✅ Файлы пользователя {user_id} откатаны к предыдущей версии")
+    
+    except Exception as e:
+        await message.answer(f"❌ Ошибка: {str(e)}")
+
+@router.message(Command("crashing"))
+async def crashing_bots_handler(message: Message):
+    """Какие боты падают: по сводкам логов (без чтения самих логов)"""
+    if not check_admin_access(message.from_user.id):
+        return
+    
+    since = datetime.now().timestamp() - CRASH_REPORT_WINDOW
+    all_stats = await asyncio.to_thread(log_manager.get_all_stats)
+    
+    report = []
+    for user_id, stats in all_stats.items():
+        # Остановка пользователем (SIGTERM) падением не считается
+        crashes = [
+            exit_info for exit_info in stats['exits']
+            if exit_info['t'] >= since and exit_info['code'] not in (0, None, -signal.SIGTERM)
+        ]
+        if crashes or stats['generation_errors']:
+            report.append((len(crashes), stats['generation_errors'], user_id, stats))
+    
+    if not report:
+        await message.answer("✅ Падающих ботов нет")
+        return
+    
+    report.sort(key=lambda item: (item[0], item[1]), reverse=True)
+    text = f"💥 Падающие боты за {CRASH_REPORT_WINDOW // 3600} ч:\n\n"
+    for crashes, generation_errors, user_id, stats in report[:15]:
+        running = "🟢" if script_runner.is_script_running(user_id) else "🔴"
+        text += f"{running} <code>{user_id}</code>: падений {crashes}, ошибок в текущем запуске {generation_errors}\n"
+        if stats['last_error']:
+            text += f"   └ {html.escape(stats['last_error']['text'][:120])}\n"
+    
+    await message.answer(text, parse_mode="HTML")
+
+@router.message(Command("warm_wheels"))
+async def warm_wheels_handler(message: Message):
+    """Прогреть wheelhouse: популярные библиотеки пользователей или указанные пакеты"""
+    if not check_admin_access(message.from_user.id):
+        return
+    
+    packages = message.text.split()[1:]
+    if not packages:
+        popular = await asyncio.to_thread(wheelhouse.collect_popular)
+        packages = [name for name, users in popular]
+    if not packages:
+        await message.answer("ℹ️ Нет библиотек для прогрева - популярных пакетов у пользователей пока нет")
+        return
+    
+    await message.answer(
+        f"🛞 Собираю колеса для {len(packages)} пакетов "
+        f"(Python {', '.join(wheelhouse.python_versions())})...\n\n"
+        f"Отчет придет по завершении."
+    )
+    
+    async def warm():
+        try:
+            built, failed = await wheelhouse.warm(packages)
+            text = f"✅ Wheelhouse прогрет\n\nСобрано: {built}\nОшибок: {len(failed)}"
+            for package, error in list(failed.items())[:10]:
+                text += f"\n• {html.escape(package)}: {html.escape(error[:150])}"
+            await message.answer(text)
+        except Exception as e:
+            await message.answer(f"❌ Ошибка прогрева wheelhouse: {str(e)}")
+    
+    asyncio.create_task(warm())
+
 @router.message(F.text == "💰 Управление балансом")
 async def admin_balance_handler(message: Message, state: FSMContext):
     if not check_admin_access(message.from_user.id):
@@ -954,11 +1055,11 @@ async def stats_handler(message: Message):
     users = firebase_db.get_all_users()
     total_users = len(users)
     total_balance = sum(user.get('balance', 0) for user in users.values())
+    # Хостинг с тарифом, включая льготный период (файлы еще не удалены)
     active_hosting = sum(1 for user in users.values() if user.get('hosting_plan'))
     banned_users = sum(1 for user in users.values() if user.get('is_banned'))
     admin_users = sum(1 for user in users.values() if user.get('is_admin'))
     
-    from datetime import datetime, timedelta
     active_users_30_days = 0
     thirty_days_ago = datetime.now() - timedelta(days=30)
     
@@ -988,6 +1089,23 @@ async def stats_handler(message: Message):
 🚀 Хостинг:
 • Тарифы: 7д/60₽, 14д/100₽, 30д/150₽"""
 
+    notify_stats = notifier.get_metrics()
+    stats_text += f"""
+
+📨 Уведомления:
+• В очереди: {notify_stats['queue_depth']}
+• Отправлено: {notify_stats['sent']} ({notify_stats['sent_last_minute']} за минуту)
+• Повторов: {notify_stats['retried']} | Ошибок: {notify_stats['failed']}"""
+
+    cache_stats = firebase_db.get_cache_stats()
+    if cache_stats['enabled']:
+        stats_text += f"""
+
+🗄️ Кэш пользователей:
+• Записей: {cache_stats['size']}/{cache_stats['max_size']}
+• Попаданий: {cache_stats['hits']} ({cache_stats['hit_rate'] * 100:.1f}%)
+• Промахов: {cache_stats['misses']}"""
+
     await message.answer(stats_text)
 
 @router.message(F.text == "🔄 Принудительная проверка")
@@ -26,6 +26,9 @@ HOSTING_PLANS = {
         "price": 0,
         "storage": "2 GB",
         "ram": "250 MB",
+        "logs": "20 MB",
+        "cpu": "50%",
+        "open_files": 256,
         "duration_days": 1,
         "python_versions": ["3.8", "3.9", "3.10", "3.11"]
     },
@@ -35,6 +38,9 @@ HOSTING_PLANS = {
         "price": 60,
         "storage": "2 GB",
         "ram": "250 MB",
+        "logs": "20 MB",
+        "cpu": "50%",
+        "open_files": 256,
         "duration_days": 7,
         "python_versions": ["3.8", "3.9", "3.10", "3.11"]
     },
@@ -44,6 +50,9 @@ HOSTING_PLANS = {
         "price": 100,
         "storage": "2 GB", 
         "ram": "250 MB",
+        "logs": "20 MB",
+        "cpu": "50%",
+        "open_files": 256,
         "duration_days": 14,
         "python_versions": ["3.8", "3.9", "3.10", "3.11"]
     },
@@ -53,6 +62,9 @@ HOSTING_PLANS = {
         "price": 150,
         "storage": "2 GB",
         "ram": "250 MB",
+        "logs": "20 MB",
+        "cpu": "50%",
+        "open_files": 256,
         "duration_days": 30,
         "python_versions": ["3.8", "3.9", "3.10", "3.11"]
     }
@@ -89,4 +101,119 @@ BOT_TEMPLATES = {
             "👨‍💻 Админ-панель"
         ]
     }
-}
\ No newline at end of file
+}
+
+# Кэш пользователей в памяти (FirebaseDB.get_user)
+USER_CACHE_ENABLED = True
+USER_CACHE_TTL = 30          # секунд жизни записи
+USER_CACHE_MAX_SIZE = 5000   # максимум пользователей в кэше (LRU)
+
+# Асинхронный фасад FirebaseDB (AsyncFirebaseDB)
+FIREBASE_ASYNC_WORKERS = 8   # размер пула потоков для запросов к Firebase
+FIREBASE_COALESCE_WINDOW = 2  # окно склейки частых записей (script_status, files_count), секунд
+
+# Планировщик истечения хостинга
+HOSTING_WARNING_HOURS = 24        # за сколько часов предупреждать об окончании
+HOSTING_GRACE_PERIOD_HOURS = 24   # сколько ждать оплаты после блокировки до удаления файлов
+EXPIRY_MAX_SLEEP = 3600           # максимальный сон планировщика между проверками (секунд)
+EXPIRY_RETRY_DELAY = 60           # повтор события хостинга после ошибки обработки (секунд)
+
+# Диспетчер уведомлений Telegram (очередь с ограничением скорости)
+NOTIFY_WORKERS = 4           # количество воркеров отправки
+NOTIFY_GLOBAL_RATE = 25      # сообщений в секунду на весь бот
+NOTIFY_CHAT_RATE = 1         # сообщений в секунду в один чат
+NOTIFY_CHAT_BURST = 3        # допустимая пачка сообщений в один чат
+NOTIFY_MAX_RETRIES = 5       # повторов при RetryAfter / сетевых ошибках
+NOTIFY_DEDUP_TTL = 3600      # сколько секунд помнить ключи дедупликации
+
+# Загрузка ZIP-архивов
+ZIP_CHUNK_SIZE = 64 * 1024             # размер блока при распаковке файлов
+ZIP_SPOOL_MAX_SIZE = 8 * 1024 * 1024   # архив больше этого размера скачивается во временный файл
+ZIP_PROGRESS_INTERVAL = 2              # как часто обновлять прогресс распаковки (секунд)
+
+# Выкладка файлов пользователей
+DEPLOY_KEEP_VERSIONS = 2       # сколько прежних версий хранить для отката
+DEPLOY_REAPER_INTERVAL = 300   # интервал фоновой очистки старых версий (секунд)
+FILES_USAGE_TTL = 300          # через сколько секунд пересчитывать занятое место пользователя (в фоне)
+
+# Мониторинг ресурсов скриптов
+RESOURCE_SAMPLE_INTERVAL = 5    # как часто снимать показатели процессов (секунд)
+RESOURCE_HISTORY_SIZE = 60      # сколько последних замеров хранить (60 * 5 сек = 5 минут)
+RESOURCE_SPARKLINE_POINTS = 20  # точек в мини-графике
+
+# Логи скриптов
+LOG_QUEUE_SIZE = 10000          # строк в очереди между чтением и записью (дальше - ждем писателя)
+LOG_FLUSH_BYTES = 64 * 1024     # сбрасывать буфер в файл по достижении размера
+LOG_FLUSH_INTERVAL = 0.5        # или не реже чем раз в столько секунд
+LOG_SEGMENT_MAX_BYTES = 1024 * 1024  # размер сегмента лога до ротации
+LOG_SEGMENT_MAX_AGE = 3600           # или возраст сегмента (секунд)
+LOG_DEFAULT_QUOTA = "20 MB"          # квота на логи, если в тарифе не указана своя
+LOG_READ_MAX_BYTES = 1024 * 1024     # сколько последних логов отдавать пользователю
+LOG_ERROR_INDEX_MAX = 500            # сколько смещений строк с ошибками хранить на сегмент
+LOG_TAIL_LINES = 30                  # строк в быстром просмотре логов
+LOG_PAGE_BYTES = 3000                # размер страницы при листании логов
+LOG_ERROR_TAIL_LINES = 20            # последних ошибок в просмотре ошибок
+LOG_MESSAGE_MAX_CHARS = 3500         # лимит текста логов в одном сообщении
+LOG_STATS_SAVE_INTERVAL = 10         # как часто сохранять счетчики строк в index.json (секунд)
+LOG_EXIT_HISTORY = 20                # сколько последних завершений скрипта помнить
+CRASH_REPORT_WINDOW = 24 * 3600      # окно для /crashing (секунд)
+
+# Live-режим логов
+LIVE_TAIL_LINES = 40                 # строк в live-сообщении
+LIVE_TAIL_EDIT_INTERVAL = 3          # не чаще одной правки сообщения за столько секунд
+LIVE_TAIL_IDLE_TIMEOUT = 120         # остановка, если скрипт столько секунд ничего не выводит
+LIVE_TAIL_MAX_DURATION = 15 * 60     # максимальная длительность live-режима
+
+# Надзор за скриптами (автоперезапуск)
+SUPERVISOR_DEFAULT_POLICY = "on-failure"  # never / on-failure / always, если у пользователя не задана своя
+SUPERVISOR_BACKOFF_BASE = 1               # первая задержка перед перезапуском (секунд), дальше x2
+SUPERVISOR_BACKOFF_MAX = 60               # максимальная задержка перед перезапуском
+SUPERVISOR_STABLE_UPTIME = 60             # проработал столько секунд - задержка сбрасывается
+SUPERVISOR_MAX_RESTARTS = 5               # перезапусков в окне до карантина
+SUPERVISOR_CRASH_WINDOW = 300             # окно подсчета падений (секунд)
+
+# Реестр запущенных скриптов (переживают рестарт бота)
+PROCESS_REGISTRY_PATH = "logs/processes.json"  # pid, время создания и параметры запуска
+PROCESS_POLL_INTERVAL = 1                      # опрос завершения подключенных заново процессов (секунд)
+CAPTURE_READ_BYTES = 64 * 1024                 # блок чтения вывода скрипта из capture-файла
+CAPTURE_POLL_INTERVAL = 0.2                    # как часто проверять новый вывод (секунд)
+CAPTURE_RECLAIM_BYTES = 4 * 1024 * 1024        # место под дочитанный вывод освобождается такими порциями
+
+# Лимиты ресурсов скриптов
+LIMITS_ENABLED = True
+LIMITS_CGROUP_ROOT = "/sys/fs/cgroup/flixhost"  # делегированная ветка cgroup v2 (нет - лимиты через rlimit)
+LIMITS_DEFAULT_CPU = "50%"          # если в тарифе не указан cpu
+LIMITS_DEFAULT_OPEN_FILES = 256     # если в тарифе не указан open_files
+LIMITS_AS_MULTIPLIER = 4            # RLIMIT_AS = ram тарифа x множитель (виртуальная память больше RSS)
+LIMITS_WATCHDOG_INTERVAL = 5        # как часто проверять OOM и троттлинг (секунд)
+LIMITS_THROTTLE_REPORT_INTERVAL = 300  # не чаще одного сообщения о троттлинге CPU на пользователя (секунд)
+LIMITS_CPU_GRACE_SAMPLES = 3        # без cgroup: столько замеров подряд выше лимита CPU до понижения приоритета
+
+# Виртуальные окружения пользователей
+VENV_ROOT = "venvs"                     # venvs/<user_id>/py<версия>, базовые окружения в venvs/.base
+VENV_PIP_CACHE = "venvs/.cache/pip"     # общий кэш загрузок и колес pip для всех пользователей
+VENV_CREATE_TIMEOUT = 300               # максимальное время создания окружения (секунд)
+VENV_LEGACY_PYTHON = "python3"          # общий интерпретатор, в который библиотеки ставились до окружений
+VENV_MIGRATION_RETRY = 3600             # повтор переноса библиотек в окружение после неудачи (секунд)
+
+# Общие слои зависимостей (по хэшу requirements.txt)
+LAYERS_ROOT = "venvs/.layers"    # venvs/.layers/<ключ>/site-packages
+LAYER_BUILD_TIMEOUT = 900        # максимальное время сборки слоя (секунд)
+LAYER_GC_GRACE = 24 * 3600       # слой без ссылок хранится столько секунд (вдруг снова понадобится)
+LAYER_GC_INTERVAL = 3600         # как часто искать неиспользуемые слои (секунд)
+
+# Очередь задач pip (установка и удаление библиотек)
+PACKAGE_JOB_WORKERS = 3          # одновременно выполняемых задач на весь сервер
+PACKAGE_JOB_MAX_QUEUED = 5       # задач одного пользователя в очереди
+PACKAGE_JOB_TIMEOUT = 900        # максимальное время одной задачи (секунд)
+PACKAGE_JOB_OUTPUT_LINES = 25    # строк вывода pip в сообщении задачи
+PACKAGE_JOB_EDIT_INTERVAL = 3    # не чаще одной правки сообщения задачи за столько секунд
+
+# Локальное зеркало колес (wheelhouse)
+WHEELHOUSE_ROOT = "venvs/.wheelhouse"   # wheels/ - колеса, simple/ - индекс PEP 503
+WHEELHOUSE_BUILD_TIMEOUT = 600          # максимальное время сборки колес одного пакета (секунд)
+WHEELHOUSE_MIN_USERS = 2                # прогревать библиотеки, которые стоят хотя бы у стольких пользователей
+WHEELHOUSE_MAX_PACKAGES = 100           # не больше стольких самых популярных библиотек за прогрев
+
+# Библиотеки хоста при запуске
+REQUIREMENTS_STAMP_PATH = "logs/requirements.stamp"  # хэш requirements.txt и интерпретатора последней успешной установки
@@ -0,0 +1,278 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import shutil
+import signal
+import threading
+import time
+from collections import deque
+from config import LAYERS_ROOT, LAYER_BUILD_TIMEOUT, LAYER_GC_GRACE, LAYER_GC_INTERVAL
+from utils.venv_manager import venv_manager
+from utils.wheelhouse import wheelhouse, requirement_name, canonical_name
+
+_REQUIREMENT_RE = re.compile(r'^([A-Za-z0-9][A-Za-z0-9._-]*)\s*(\[[^\]]*\])?\s*(.*)$')
+
+# Имя .pth файла слоя в site-packages окружения пользователя
+LAYER_PTH_NAME = "flixhost_layer.pth"
+
+def normalize_requirements(content: str):
+    """Нормализованный список требований или None, если файл нельзя кэшировать.
+
+    Имена приводятся к каноническому виду (PEP 503), пробелы и комментарии убираются,
+    строки сортируются - одинаковые по смыслу файлы дают один хэш. Опции pip (-r, -e,
+    --index-url), ссылки и локальные пути не кэшируются."""
+    requirements = set()
+    for line in content.splitlines():
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        if line.startswith('-') or '://' in line or '/' in line or '@' in line:
+            return None
+        match = _REQUIREMENT_RE.match(line)
+        if not match:
+            return None
+        name = re.sub(r'[-_.]+', '-', match.group(1)).lower()
+        extras = (match.group(2) or '').replace(' ', '').lower()
+        spec = match.group(3).replace(' ', '')
+        requirements.add(f"{name}{extras}{spec}")
+    return sorted(requirements)
+
+def requirements_digest(content: str) -> str:
+    """sha256 requirements.txt: нормализованного списка, а если файл нельзя кэшировать - текста"""
+    requirements = normalize_requirements(content or "")
+    text = "\n".join(requirements) if requirements is not None else (content or "")
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class DependencyLayerCache:
+    """Общие слои зависимостей по хэшу requirements.txt.
+
+    venvs/.layers/<ключ>/site-packages собирается один раз (pip install --target)
+    для нормализованного списка требований и версии Python и больше не меняется.
+    К окружению пользователя слой подключается файлом flixhost_layer.pth, поэтому
+    пакеты, установленные пользователем вручную, имеют приоритет над слоем.
+    refs.json хранит, какие окружения используют слой; слои без ссылок старше
+    LAYER_GC_GRACE удаляются фоновой задачей.
+    """
+
+    def __init__(self, root=LAYERS_ROOT):
+        self.root = root
+        self.refs_path = os.path.join(root, 'refs.json')
+        self._refs_lock = threading.Lock()
+        self._build_locks = {}
+
+    @staticmethod
+    def layer_key(requirements, python_version: str) -> str:
+        digest = hashlib.sha256("\n".join(requirements).encode('utf-8')).hexdigest()
+        return f"py{python_version}-{digest[:32]}"
+
+    def get_layer_path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def _is_built(self, key: str) -> bool:
+        return os.path.exists(os.path.join(self.get_layer_path(key), '.complete'))
+
+    # ===== ССЫЛКИ =====
+
+    def _load_refs(self):
+        try:
+            with open(self.refs_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_refs(self, refs):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f"{self.refs_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(refs, f)
+        os.replace(tmp_path, self.refs_path)
+
+    def _set_ref(self, env_id: str, key):
+        """Окружение env_id использует слой key (None - никакой). Возвращает прежний слой"""
+        with self._refs_lock:
+            refs = self._load_refs()
+            previous = None
+            for layer_key, layer in refs.items():
+                if env_id in layer['envs']:
+                    layer['envs'].remove(env_id)
+                    layer['released_at'] = int(time.time())
+                    previous = layer_key
+            if key:
+                layer = refs.setdefault(key, {'envs': [], 'released_at': None})
+                layer['envs'].append(env_id)
+            self._save_refs(refs)
+            return previous
+
+    # ===== СБОРКА =====
+
+    async def _build(self, key: str, requirements, python_version: str, on_output=None):
+        layer_path = self.get_layer_path(key)
+        async with self._build_locks.setdefault(key, asyncio.Lock()):
+            if self._is_built(key):
+                return
+            print(f"📦 Собираю слой зависимостей {key} ({len(requirements)} пакетов)")
+            tmp_path = f"{layer_path}.tmp"
+            await asyncio.to_thread(shutil.rmtree, tmp_path, True)
+            os.makedirs(tmp_path)
+            requirements_path = os.path.join(tmp_path, 'requirements.txt')
+            with open(requirements_path, 'w', encoding='utf-8') as f:
+                f.write("\n".join(requirements) + "\n")
+
+            base_python = venv_manager.get_python(await venv_manager.ensure_base(python_version))
+            output = deque(maxlen=30)
+
+            async def install(*wheelhouse_args):
+                process = await asyncio.create_subprocess_exec(
+                    base_python, '-m', 'pip', 'install', '--no-warn-script-location',
+                    '--target', os.path.join(tmp_path, 'site-packages'), '--progress-bar', 'off',
+                    *wheelhouse_args, '-r', requirements_path,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.STDOUT,
+                    env=venv_manager.pip_env(),
+                    start_new_session=True
+                )
+                try:
+                    async for line in process.stdout:
+                        line = line.decode('utf-8', errors='ignore').rstrip()
+                        output.append(line)
+                        if on_output:
+                            on_output(line)
+                    return await process.wait()
+                except asyncio.CancelledError:
+                    # Превышено время или сборку отменили - процесс pip не должен остаться
+                    try:
+                        os.killpg(process.pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+                    await process.wait()
+                    raise
+
+            async def install_all():
+                # Сначала только из wheelhouse, если там есть все пакеты, при промахе - с PyPI
+                if wheelhouse.has_all(requirement_name(line) for line in requirements):
+                    if await install(*wheelhouse.install_args(offline=True)) == 0:
+                        return 0
+                return await install(*wheelhouse.install_args())
+
+            try:
+                returncode = await asyncio.wait_for(install_all(), timeout=LAYER_BUILD_TIMEOUT)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                await asyncio.to_thread(shutil.rmtree, tmp_path, True)
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                raise RuntimeError("Превышено время установки зависимостей")
+            if returncode != 0:
+                await asyncio.to_thread(shutil.rmtree, tmp_path, True)
+                raise RuntimeError("\n".join(output)[-1500:])
+
+            open(os.path.join(tmp_path, '.complete'), 'w').close()
+            await asyncio.to_thread(shutil.rmtree, layer_path, True)
+            os.replace(tmp_path, layer_path)
+            print(f"✅ Слой зависимостей {key} собран")
+
+    # ===== ПОДКЛЮЧЕНИЕ =====
+
+    async def attach(self, user_id, python_version: str, content: str, on_output=None):
+        """Подключить к окружению пользователя слой для requirements.txt.
+
+        on_output(строка) получает вывод pip, если слой собирается сейчас.
+        Возвращает (ключ слоя, был ли он уже собран) или None, если файл нельзя
+        кэшировать (тогда его нужно ставить в окружение пользователя напрямую)."""
+        requirements = normalize_requirements(content or "")
+        if not requirements:
+            return None
+
+        key = self.layer_key(requirements, python_version)
+        cached = self._is_built(key)
+        if not cached:
+            await self._build(key, requirements, python_version, on_output)
+
+        venv_path = await venv_manager.ensure(user_id, python_version)
+        site_packages = venv_manager.site_packages(venv_path)
+        with open(os.path.join(site_packages, LAYER_PTH_NAME), 'w', encoding='utf-8') as f:
+            f.write(os.path.abspath(os.path.join(self.get_layer_path(key), 'site-packages')) + "\n")
+
+        await asyncio.to_thread(self._set_ref, f"{user_id}:{python_version}", key)
+        return key, cached
+
+    @staticmethod
+    def has_distribution(site_packages, name: str) -> bool:
+        """Установлен ли пакет (каноническое имя) в site-packages - по каталогам *.dist-info"""
+        if not site_packages or not os.path.isdir(site_packages):
+            return False
+        for entry in os.listdir(site_packages):
+            if entry.endswith(('.dist-info', '.egg-info')) and canonical_name(entry.split('-', 1)[0]) == name:
+                return True
+        return False
+
+    @staticmethod
+    def attached_site_packages(venv_path: str):
+        """site-packages слоя, подключенного к окружению (None - слоя нет)"""
+        site_packages = venv_manager.site_packages(venv_path)
+        try:
+            with open(os.path.join(site_packages or '', LAYER_PTH_NAME), 'r', encoding='utf-8') as f:
+                return f.readline().strip() or None
+        except OSError:
+            return None
+
+    def provides(self, venv_path: str, name: str) -> bool:
+        """Пакет приходит из подключенного слоя (requirements.txt), а не из самого окружения.
+
+        pip uninstall в окружении такой пакет не удалит - он вне окружения."""
+        return self.has_distribution(self.attached_site_packages(venv_path), name)
+
+    async def detach_user(self, user_id):
+        """Снять ссылки всех окружений пользователя (окружения удаляются)"""
+        def detach():
+            with self._refs_lock:
+                refs = self._load_refs()
+                prefix = f"{user_id}:"
+                for layer in refs.values():
+                    kept = [env_id for env_id in layer['envs'] if not env_id.startswith(prefix)]
+                    if len(kept) != len(layer['envs']):
+                        layer['envs'] = kept
+                        layer['released_at'] = int(time.time())
+                self._save_refs(refs)
+        await asyncio.to_thread(detach)
+
+    # ===== ОЧИСТКА =====
+
+    def collect_garbage(self):
+        """Удалить слои без ссылок старше LAYER_GC_GRACE. Возвращает количество удаленных"""
+        if not os.path.isdir(self.root):
+            return 0
+        now = time.time()
+        removed = 0
+        with self._refs_lock:
+            refs = self._load_refs()
+            for name in os.listdir(self.root):
+                path = os.path.join(self.root, name)
+                if not os.path.isdir(path) or name.endswith('.tmp'):
+                    continue
+                layer = refs.get(name)
+                if layer and layer['envs']:
+                    continue
+                released_at = (layer or {}).get('released_at') or os.path.getmtime(path)
+                if now - released_at < LAYER_GC_GRACE:
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+                refs.pop(name, None)
+                removed += 1
+            if removed:
+                self._save_refs(refs)
+        return removed
+
+    async def start_gc(self):
+        """Фоновая очистка неиспользуемых слоев"""
+        while True:
+            await asyncio.sleep(LAYER_GC_INTERVAL)
+            try:
+                removed = await asyncio.to_thread(self.collect_garbage)
+                if removed:
+                    print(f"🧹 Удалено неиспользуемых слоев зависимостей: {removed}")
+            except Exception as e:
+                print(f"❌ Ошибка очистки слоев зависимостей: {e}")
+
+dependency_layers = DependencyLayerCache()
@@ -0,0 +1,173 @@
+import asyncio
+import os
+import shutil
+import threading
+import time
+from config import DEPLOY_KEEP_VERSIONS, DEPLOY_REAPER_INTERVAL
+from utils.file_manifest import file_manifest
+
+class ProjectDeployer:
+    """Атомарная выкладка файлов пользователя.
+
+    Новые файлы собираются в user_files/.staging, проверяются и подменяют живую
+    папку переименованием. Прежняя папка уходит в user_files/.versions/<user_id>
+    (последние DEPLOY_KEEP_VERSIONS версий для отката), а лишние версии и
+    неудачные сборки переносятся в user_files/.trash и удаляются фоновой задачей.
+    """
+
+    def __init__(self, base_dir='user_files', keep_versions=DEPLOY_KEEP_VERSIONS):
+        self.base_dir = base_dir
+        self.keep_versions = keep_versions
+        self.staging_dir = os.path.join(base_dir, '.staging')
+        self.versions_dir = os.path.join(base_dir, '.versions')
+        self.trash_dir = os.path.join(base_dir, '.trash')
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._reaper_wakeup = None
+        self._loop = None
+
+    def _user_lock(self, user_id):
+        with self._locks_lock:
+            return self._locks.setdefault(str(user_id), threading.Lock())
+
+    def _stamp(self):
+        return f"{time.time_ns()}"
+
+    def get_live_path(self, user_id):
+        return os.path.join(self.base_dir, str(user_id))
+
+    # ===== СБОРКА =====
+
+    def create_staging(self, user_id):
+        """Создать пустую папку для сборки новой версии"""
+        path = os.path.join(self.staging_dir, f"{user_id}-{self._stamp()}")
+        os.makedirs(path)
+        return path
+
+    def discard(self, path):
+        """Убрать папку в корзину (удалит фоновая задача)"""
+        if not path or not os.path.exists(path):
+            return
+        os.makedirs(self.trash_dir, exist_ok=True)
+        os.rename(path, os.path.join(self.trash_dir, f"{os.path.basename(path)}-{self._stamp()}"))
+        self._wake_reaper()
+
+    # ===== ВЫКЛАДКА =====
+
+    def commit(self, user_id, staging_path):
+        """Подменить живую папку сборкой. Прежняя версия сохраняется для отката"""
+        # Манифест сборки заодно служит проверкой: пустую сборку не выкладываем
+        manifest = file_manifest.scan(staging_path)
+        if not manifest['files_count']:
+            self.discard(staging_path)
+            raise ValueError("Сборка не содержит файлов")
+
+        live_path = self.get_live_path(user_id)
+        with self._user_lock(user_id):
+            previous_path = None
+            if os.path.exists(live_path):
+                user_versions = os.path.join(self.versions_dir, str(user_id))
+                os.makedirs(user_versions, exist_ok=True)
+                previous_path = os.path.join(user_versions, self._stamp())
+                os.rename(live_path, previous_path)
+
+            try:
+                os.rename(staging_path, live_path)
+            except Exception:
+                if previous_path:
+                    os.rename(previous_path, live_path)
+                raise
+
+            file_manifest.save(user_id, manifest)
+            self._prune_versions(user_id)
+        print(f"🚀 Новая версия файлов пользователя {user_id} выложена")
+
+    def list_versions(self, user_id):
+        """Сохраненные версии пользователя, от новой к старой"""
+        user_versions = os.path.join(self.versions_dir, str(user_id))
+        if not os.path.isdir(user_versions):
+            return []
+        return sorted(os.listdir(user_versions), key=int, reverse=True)
+
+    def _prune_versions(self, user_id):
+        for version in self.list_versions(user_id)[self.keep_versions:]:
+            self.discard(os.path.join(self.versions_dir, str(user_id), version))
+
+    def rollback(self, user_id):
+        """Вернуть предыдущую версию файлов. False если откатываться некуда"""
+        live_path = self.get_live_path(user_id)
+        with self._user_lock(user_id):
+            versions = self.list_versions(user_id)
+            if not versions:
+                return False
+
+            previous_path = os.path.join(self.versions_dir, str(user_id), versions[0])
+            current_path = None
+            if os.path.exists(live_path):
+                current_path = os.path.join(self.staging_dir, f"{user_id}-{self._stamp()}")
+                os.makedirs(self.staging_dir, exist_ok=True)
+                os.rename(live_path, current_path)
+
+            try:
+                os.rename(previous_path, live_path)
+            except Exception:
+                if current_path:
+                    os.rename(current_path, live_path)
+                raise
+
+            self.discard(current_path)
+            file_manifest.rebuild(user_id)
+        print(f"⏪ Файлы пользователя {user_id} откатаны к версии {versions[0]}")
+        return True
+
+    def remove(self, user_id):
+        """Убрать папку пользователя вместе с версиями (мгновенно, удаление в фоне)"""
+        with self._user_lock(user_id):
+            self.discard(self.get_live_path(user_id))
+            self.discard(os.path.join(self.versions_dir, str(user_id)))
+            file_manifest.remove(user_id)
+
+    # ===== ФОНОВАЯ ОЧИСТКА =====
+
+    def _wake_reaper(self):
+        if self._loop and self._reaper_wakeup:
+            self._loop.call_soon_threadsafe(self._reaper_wakeup.set)
+
+    def reap(self):
+        """Удалить содержимое корзины. Возвращает количество удаленных папок"""
+        if not os.path.isdir(self.trash_dir):
+            return 0
+        removed = 0
+        for name in os.listdir(self.trash_dir):
+            shutil.rmtree(os.path.join(self.trash_dir, name), ignore_errors=True)
+            removed += 1
+        return removed
+
+    def recover_staging(self):
+        """Сборки, оставшиеся после падения бота, отправляем в корзину"""
+        if not os.path.isdir(self.staging_dir):
+            return
+        for name in os.listdir(self.staging_dir):
+            self.discard(os.path.join(self.staging_dir, name))
+
+    async def start_reaper(self):
+        """Фоновая задача удаления старых версий и неудачных сборок"""
+        self._loop = asyncio.get_running_loop()
+        self._reaper_wakeup = asyncio.Event()
+        await asyncio.to_thread(self.recover_staging)
+
+        while True:
+            try:
+                removed = await asyncio.to_thread(self.reap)
+                if removed:
+                    print(f"🧹 Удалено старых версий файлов: {removed}")
+                try:
+                    await asyncio.wait_for(self._reaper_wakeup.wait(), timeout=DEPLOY_REAPER_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._reaper_wakeup.clear()
+            except Exception as e:
+                print(f"❌ Ошибка очистки старых версий: {e}")
+                await asyncio.sleep(DEPLOY_REAPER_INTERVAL)
+
+deployer = ProjectDeployer()
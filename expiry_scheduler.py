@@ -0,0 +1,88 @@
+import heapq
+import itertools
+import threading
+import time
+
+class ExpiryScheduler:
+    """Очередь дедлайнов хостинга на min-heap.
+
+    Для каждого пользователя хранится версия расписания: при перепланировании
+    старые записи в куче не удаляются, а просто игнорируются при извлечении.
+    """
+
+    WARN = 'warn'      # предупреждение до окончания хостинга
+    BLOCK = 'block'    # хостинг истек - блокировка и начало льготного периода
+    DELETE = 'delete'  # льготный период закончился - удаление файлов
+
+    def __init__(self):
+        self._heap = []  # (when, seq, user_id, kind, version)
+        self._versions = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def schedule(self, user_id, events):
+        """Заменить расписание пользователя списком событий [(when_timestamp, kind), ...]"""
+        user_id = str(user_id)
+        with self._lock:
+            version = self._versions.get(user_id, 0) + 1
+            self._versions[user_id] = version
+            for when, kind in events:
+                heapq.heappush(self._heap, (when, next(self._counter), user_id, kind, version))
+
+    def retry(self, user_id, kind, delay):
+        """Вернуть извлеченное событие в очередь через delay секунд (обработка не удалась).
+
+        Событие добавляется к текущей версии расписания: если пользователя
+        за это время перепланировали, повтор будет проигнорирован."""
+        user_id = str(user_id)
+        with self._lock:
+            version = self._versions.get(user_id)
+            if version is None:
+                return
+            heapq.heappush(self._heap, (time.time() + delay, next(self._counter), user_id, kind, version))
+
+    def cancel(self, user_id):
+        """Отменить все события пользователя"""
+        user_id = str(user_id)
+        with self._lock:
+            if user_id in self._versions:
+                self._versions[user_id] += 1
+
+    def clear(self):
+        """Очистить расписание полностью"""
+        with self._lock:
+            self._heap.clear()
+            for user_id in self._versions:
+                self._versions[user_id] += 1
+
+    def _drop_stale(self):
+        while self._heap and self._heap[0][4] != self._versions.get(self._heap[0][2]):
+            heapq.heappop(self._heap)
+
+    def seconds_until_next(self, now=None):
+        """Сколько секунд до ближайшего события (None если событий нет)"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._drop_stale()
+            if not self._heap:
+                return None
+            return max(0.0, self._heap[0][0] - now)
+
+    def pop_due(self, now=None):
+        """Извлечь все наступившие события: [(user_id, kind, when), ...]"""
+        now = time.time() if now is None else now
+        due = []
+        with self._lock:
+            while True:
+                self._drop_stale()
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                when, _, user_id, kind, _ = heapq.heappop(self._heap)
+                due.append((user_id, kind, when))
+        return due
+
+    def __len__(self):
+        with self._lock:
+            return sum(1 for entry in self._heap if entry[4] == self._versions.get(entry[2]))
+
+expiry_scheduler = ExpiryScheduler()
@@ -0,0 +1,292 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from config import FILES_USAGE_TTL
+
+# Имена файлов, которые считаются точками входа (в порядке приоритета)
+ENTRY_POINT_NAMES = ('main.py', 'bot.py', 'app.py', 'run.py', '__main__.py')
+
+class FileManifestStore:
+    """Манифест файлов пользователя: user_files/.manifests/<user_id>.json.
+
+    Строится при выкладке (пути, размеры, mtime, sha256, Python файлы, точки входа),
+    загружается лениво и кэшируется в памяти, поэтому меню не обходят папку заново.
+    Занятое место считается отдельно (disk_usage): манифест не знает о файлах,
+    которые создает сам скрипт пользователя.
+    """
+
+    def __init__(self, base_dir='user_files'):
+        self.base_dir = base_dir
+        self.manifests_dir = os.path.join(base_dir, '.manifests')
+        self._cache = {}
+        self._usage = {}       # user_id -> (байт, когда измерено)
+        self._refreshing = {}  # user_id -> задача фонового пересчета
+        self._rebuilding = {}  # user_id -> задача фонового построения манифеста
+        self._lock = threading.Lock()
+
+    def _manifest_path(self, user_id):
+        return os.path.join(self.manifests_dir, f"{user_id}.json")
+
+    def get_user_folder(self, user_id):
+        return os.path.join(self.base_dir, str(user_id))
+
+    # ===== ПОСТРОЕНИЕ =====
+
+    @staticmethod
+    def _describe_file(full_path):
+        """Размер, mtime, sha256 и признак точки входа одного файла"""
+        stat = os.stat(full_path)
+        sha256 = hashlib.sha256()
+        has_main_guard = False
+        with open(full_path, 'rb') as f:
+            while True:
+                chunk = f.read(64 * 1024)
+                if not chunk:
+                    break
+                sha256.update(chunk)
+                if full_path.endswith('.py') and b'__main__' in chunk:
+                    has_main_guard = True
+        return {
+            'size': stat.st_size,
+            'mtime': int(stat.st_mtime),
+            'sha256': sha256.hexdigest(),
+            'main_guard': has_main_guard
+        }
+
+    @staticmethod
+    def _stat_file(full_path):
+        """Только размер и mtime - для быстрого списка, пока манифест строится в фоне"""
+        stat = os.stat(full_path)
+        return {'size': stat.st_size, 'mtime': int(stat.st_mtime), 'sha256': None, 'main_guard': False}
+
+    @staticmethod
+    def _finalize(manifest):
+        """Пересчитать производные поля манифеста"""
+        files = manifest['files']
+        python_files = sorted(path for path in files if path.endswith('.py'))
+
+        def entry_priority(path):
+            name = os.path.basename(path)
+            rank = ENTRY_POINT_NAMES.index(name) if name in ENTRY_POINT_NAMES else len(ENTRY_POINT_NAMES)
+            return (rank, path.count('/'), path)
+
+        manifest['python_files'] = python_files
+        manifest['entry_points'] = sorted(
+            (path for path in python_files
+             if os.path.basename(path) in ENTRY_POINT_NAMES or files[path].get('main_guard')),
+            key=entry_priority
+        )
+        manifest['files_count'] = len(files)
+        manifest['total_size'] = sum(info['size'] for info in files.values())
+        manifest['updated_at'] = int(time.time())
+        return manifest
+
+    def scan(self, folder, hash_files=True):
+        """Построить манифест по папке (без сохранения). hash_files=False - только stat"""
+        describe = self._describe_file if hash_files else self._stat_file
+        files = {}
+        for root, dirs, filenames in os.walk(folder):
+            for filename in filenames:
+                full_path = os.path.join(root, filename)
+                rel_path = os.path.relpath(full_path, folder).replace(os.sep, '/')
+                try:
+                    files[rel_path] = describe(full_path)
+                except OSError as e:
+                    print(f"⚠️ Не удалось прочитать файл {full_path}: {e}")
+        return self._finalize({'files': files})
+
+    def save(self, user_id, manifest):
+        """Записать манифест на диск и в кэш"""
+        user_id = str(user_id)
+        os.makedirs(self.manifests_dir, exist_ok=True)
+        path = self._manifest_path(user_id)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._cache[user_id] = manifest
+            self._usage.pop(user_id, None)
+
+    def rebuild(self, user_id):
+        """Пересобрать манифест по живой папке пользователя"""
+        folder = self.get_user_folder(user_id)
+        if not os.path.exists(folder):
+            self.remove(user_id)
+            return None
+        manifest = self.scan(folder)
+        self.save(user_id, manifest)
+        return manifest
+
+    def remove(self, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            self._cache.pop(user_id, None)
+            self._usage.pop(user_id, None)
+        try:
+            os.remove(self._manifest_path(user_id))
+        except FileNotFoundError:
+            pass
+
+    def rebuild_missing(self):
+        """Построить манифесты для папок, выложенных до их появления. Возвращает количество"""
+        if not os.path.isdir(self.base_dir):
+            return 0
+        built = 0
+        for name in os.listdir(self.base_dir):
+            if name.startswith('.') or os.path.exists(self._manifest_path(name)):
+                continue
+            if os.path.isdir(self.get_user_folder(name)) and self.rebuild(name):
+                built += 1
+        if built:
+            print(f"📋 Построено манифестов для старых папок: {built}")
+        return built
+
+    # ===== ИНКРЕМЕНТАЛЬНЫЕ ИЗМЕНЕНИЯ =====
+
+    def update_file(self, user_id, rel_path):
+        """Обновить запись об одном файле после его изменения"""
+        manifest = self.get(user_id)
+        if manifest is None:
+            return
+        rel_path = rel_path.replace(os.sep, '/')
+        full_path = os.path.join(self.get_user_folder(user_id), rel_path)
+        files = dict(manifest['files'])
+        if os.path.isfile(full_path):
+            files[rel_path] = self._describe_file(full_path)
+        else:
+            files.pop(rel_path, None)
+        self.save(user_id, self._finalize({'files': files}))
+
+    # ===== ЧТЕНИЕ =====
+
+    def get(self, user_id):
+        """Манифест пользователя (None если файлов нет). Строится при первом обращении"""
+        user_id = str(user_id)
+        with self._lock:
+            manifest = self._cache.get(user_id)
+        if manifest is not None:
+            return manifest
+
+        try:
+            with open(self._manifest_path(user_id), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            # Манифеста нет (файлы выложены до манифестов) или он испорчен
+            return self._build_missing(user_id)
+
+        with self._lock:
+            self._cache[user_id] = manifest
+        return manifest
+
+    def _build_missing(self, user_id):
+        """Построить отсутствующий манифест.
+
+        Вне event loop (пул потоков, деплой) - сразу. В event loop хэширование всех
+        файлов остановило бы бота: отдаем список по stat (без sha256 и проверки
+        __main__), а полный манифест строится в фоне через asyncio.to_thread."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return self.rebuild(user_id)
+
+        folder = self.get_user_folder(user_id)
+        if not os.path.isdir(folder):
+            return None
+        if user_id not in self._rebuilding:
+            self._rebuilding[user_id] = loop.create_task(self._rebuild_in_background(user_id))
+        return self.scan(folder, hash_files=False)
+
+    async def _rebuild_in_background(self, user_id):
+        try:
+            await asyncio.to_thread(self.rebuild, user_id)
+        except Exception as e:
+            print(f"❌ Ошибка построения манифеста пользователя {user_id}: {e}")
+        finally:
+            self._rebuilding.pop(user_id, None)
+
+    def list_files(self, user_id):
+        manifest = self.get(user_id)
+        return sorted(manifest['files']) if manifest else []
+
+    def python_files(self, user_id):
+        manifest = self.get(user_id)
+        return manifest['python_files'] if manifest else []
+
+    def entry_points(self, user_id):
+        manifest = self.get(user_id)
+        return manifest['entry_points'] if manifest else []
+
+    def has_file(self, user_id, rel_path):
+        manifest = self.get(user_id)
+        if not manifest or not rel_path:
+            return False
+        return os.path.normpath(rel_path).replace(os.sep, '/') in manifest['files']
+
+    def files_count(self, user_id):
+        manifest = self.get(user_id)
+        return manifest['files_count'] if manifest else 0
+
+    def total_size(self, user_id):
+        """Размер выложенных файлов по манифесту (без файлов, созданных скриптом)"""
+        manifest = self.get(user_id)
+        return manifest['total_size'] if manifest else 0
+
+    # ===== ЗАНЯТОЕ МЕСТО =====
+
+    @staticmethod
+    def measure_folder(folder):
+        """Размер папки по stat файлов, без чтения содержимого (ссылки не учитываются)"""
+        total = 0
+        stack = [folder]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                            elif entry.is_file(follow_symlinks=False):
+                                total += entry.stat(follow_symlinks=False).st_size
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+        return total
+
+    def measure_usage(self, user_id):
+        """Измерить занятое место пользователя и запомнить результат"""
+        user_id = str(user_id)
+        size = self.measure_folder(self.get_user_folder(user_id))
+        with self._lock:
+            self._usage[user_id] = (size, time.monotonic())
+        return size
+
+    async def disk_usage(self, user_id):
+        """Место, занятое папкой пользователя вместе с файлами, созданными скриптом.
+
+        Первое измерение ждем в пуле потоков, дальше отдаем запомненное значение,
+        а устаревшее (старше FILES_USAGE_TTL) пересчитываем в фоне."""
+        user_id = str(user_id)
+        with self._lock:
+            cached = self._usage.get(user_id)
+        if cached is None:
+            return await asyncio.to_thread(self.measure_usage, user_id)
+
+        size, measured_at = cached
+        if time.monotonic() - measured_at >= FILES_USAGE_TTL and user_id not in self._refreshing:
+            self._refreshing[user_id] = asyncio.create_task(self._refresh_usage(user_id))
+        return size
+
+    async def _refresh_usage(self, user_id):
+        try:
+            await asyncio.to_thread(self.measure_usage, user_id)
+        except Exception as e:
+            print(f"⚠️ Не удалось пересчитать место пользователя {user_id}: {e}")
+        finally:
+            self._refreshing.pop(user_id, None)
+
+file_manifest = FileManifestStore()
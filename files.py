@@ -1,15 +1,21 @@
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, FSInputFile
+from aiogram.types import Message, CallbackQuery, FSInputFile, BufferedInputFile
 from aiogram.filters import Command
-from firebase_db import firebase_db
-from keyboards import get_files_keyboard, get_main_keyboard, get_back_to_files_keyboard
+from firebase_db import firebase_db, async_firebase_db
+from keyboards import (
+    get_files_keyboard, get_main_keyboard, get_back_to_files_keyboard,
+    get_logs_page_keyboard, get_live_tail_keyboard
+)
 from utils.file_processing import file_processor
 from utils.script_runner import script_runner
+from utils.deployer import deployer
+from utils.file_manifest import file_manifest
+from utils.live_tail import live_tail_manager
 import os
-import base64
-import aiofiles
+import html
 import asyncio
-import shutil
+import tempfile
+from config import ZIP_SPOOL_MAX_SIZE, LOG_MESSAGE_MAX_CHARS
 
 router = Router()
 
@@ -30,42 +36,20 @@ def get_correct_main_file_path(user_id: int) -> tuple:
     # Сначала пробуем найти файл по пути из базы
     potential_path = os.path.join(user_folder, main_file_from_db)
     
-    if os.path.exists(potential_path):
+    if file_manifest.has_file(user_id, main_file_from_db):
         return potential_path, main_file_from_db
     
-    # Если не нашли, ищем любой main.py в проекте
-    for root, dirs, files in os.walk(user_folder):
-        for file in files:
-            if file == 'main.py':
-                found_path = os.path.join(root, file)
-                rel_path = os.path.relpath(found_path, user_folder)
-                return found_path, rel_path
-    
-    # Если main.py не нашли, ищем любой Python файл
-    for root, dirs, files in os.walk(user_folder):
-        for file in files:
-            if file.endswith('.py'):
-                found_path = os.path.join(root, file)
-                rel_path = os.path.relpath(found_path, user_folder)
-                return found_path, rel_path
+    # Если не нашли, берем точку входа из манифеста (main.py в приоритете), иначе любой Python файл
+    candidates = file_manifest.entry_points(user_id) or file_manifest.python_files(user_id)
+    if candidates:
+        rel_path = candidates[0]
+        return os.path.join(user_folder, rel_path), rel_path
     
     return None, "Python файлы не найдены"
 
 def get_available_python_files(user_id: int) -> list:
     """Получить список всех Python файлов"""
-    user_folder = f"user_files/{user_id}"
-    python_files = []
-    
-    if not os.path.exists(user_folder):
-        return []
-    
-    for root, dirs, files in os.walk(user_folder):
-        for file in files:
-            if file.endswith('.py'):
-                rel_path = os.path.relpath(os.path.join(root, file), user_folder)
-                python_files.append(rel_path)
-    
-    return sorted(python_files)
+    return list(file_manifest.python_files(user_id))
 
 @router.message(F.text == "📁 Файлы")
 async def files_handler(message: Message):
@@ -141,18 +125,24 @@ async def delete_files_callback(callback: CallbackQuery):
         await callback.answer("❌ Нельзя удалять файлы пока скрипт запущен", show_alert=True)
         return
     
-    # Удаляем локальные файлы
-    user_folder = f"user_files/{user_id}"
-    if os.path.exists(user_folder):
-        shutil.rmtree(user_folder)
+    # Удаляем локальные файлы (папка уходит в корзину, удаление в фоне)
+    await asyncio.to_thread(deployer.remove, user_id)
     
-    # Обновляем статус в Firebase
-    firebase_db.update_user(str(user_id), {
+    # Обновляем статус в Firebase сразу, а не отложенно: видимые пользователю
+    # поля не должны потеряться при рестарте бота в окне склейки
+    batch = firebase_db.batch()
+    batch.update_user(str(user_id), {
         'has_files': False,
         'files_count': 0,
         'is_template': False,  # Сбрасываем флаг шаблона
         'template_type': None  # Сбрасываем тип шаблона
     })
+    if not await async_firebase_db.commit(batch):
+        await callback.message.edit_text(
+            "⚠️ Файлы удалены, но статус не сохранился - обновите меню позже",
+            reply_markup=get_back_to_files_keyboard()
+        )
+        return
     
     await callback.message.edit_text("✅ Все файлы удалены", reply_markup=get_back_to_files_keyboard())
 
@@ -253,23 +243,27 @@ async def handle_zip_file(message: Message):
         
         # Скачиваем файл
         file = await message.bot.get_file(document.file_id)
-        file_content = await message.bot.download_file(file.file_path)
-        file_bytes = file_content.read()
         
-        await processing_msg.edit_text("📦 Распаковываю архив...")
+        async def report_progress(done_bytes, total_bytes):
+            try:
+                await processing_msg.edit_text(f"📦 Распаковываю архив... {done_bytes * 100 // total_bytes}%")
+            except Exception:
+                pass
         
-        # Извлекаем ZIP
-        files = await file_processor.extract_zip(file_bytes, user_id)
+        # Скачиваем архив в буфер (большие архивы - во временный файл) и распаковываем потоково
+        with tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_MAX_SIZE) as zip_buffer:
+            await message.bot.download_file(file.file_path, destination=zip_buffer)
+            zip_buffer.seek(0)
+            
+            await processing_msg.edit_text("📦 Распаковываю архив...")
+            
+            # Распаковываем ZIP сразу в папку на диске
+            local_saved, total_files = await file_processor.save_zip_locally(zip_buffer, user_id, report_progress)
         
-        if not files:
+        if not total_files:
             await processing_msg.edit_text("❌ Не удалось извлечь файлы из архива")
             return
         
-        await processing_msg.edit_text("💾 Сохраняю файлы...")
-        
-        # Сохраняем файлы локально
-        local_saved = await file_processor.save_files_locally(files, user_id)
-        
         # Автоматически находим основной файл
         main_file_path, main_file_name = get_correct_main_file_path(user_id)
         
@@ -284,12 +278,18 @@ async def handle_zip_file(message: Message):
         if main_file_name and main_file_name != "Python файлы не найдены":
             updates['main_file'] = main_file_name
         
-        firebase_db.update_user(str(user_id), updates)
+        # Сразу, а не отложенно: после успешной загрузки база не должна
+        # остаться без has_files и main_file, если бот перезапустится
+        batch = firebase_db.batch()
+        batch.update_user(str(user_id), updates)
+        if not await async_firebase_db.commit(batch):
+            await processing_msg.edit_text("❌ Файлы сохранены, но не удалось обновить данные - попробуйте еще раз")
+            return
         
         success_text = f"""✅ Файлы успешно загружены!
 
 📊 Статистика:
-• Файлов в архиве: {len(files)}
+• Файлов в архиве: {total_files}
 • Сохранено локально: {local_saved}"""
         
         if main_file_name and main_file_name != "Python файлы не найдены":
@@ -313,6 +313,14 @@ async def handle_zip_file(message: Message):
         except:
             await message.answer(error_text)
 
+def format_log_text(text: str, title: str) -> str:
+    """Текст логов для сообщения: экранируем HTML и укладываемся в лимит Telegram"""
+    body = html.escape(text.strip()) or "(пусто)"
+    if len(body) > LOG_MESSAGE_MAX_CHARS:
+        body = body[-LOG_MESSAGE_MAX_CHARS:]
+        body = body[body.find("\n") + 1:]
+    return f"{title}\n\n<pre>{body}</pre>"
+
 @router.message(F.text == "📋 Логи")
 async def logs_handler(message: Message):
     user_id = message.from_user.id
@@ -322,23 +330,78 @@ async def logs_handler(message: Message):
         await message.answer("❌ У вас нет активного хостинга")
         return
     
-    # Получаем все логи
-    logs = await script_runner.get_logs(user_id)
+    # Быстрый просмотр последних строк, старые страницы - по кнопке
+    tail, cursor = await script_runner.get_log_tail(user_id)
     
-    if not logs:
+    if not tail.strip():
         await message.answer("📋 Логи не найдены (скрипт еще не запускался или не вывел данные)")
         return
     
-    # Сохраняем логи во временный файл для отправки
-    log_file = f"logs/user_{user_id}/current_logs.txt"
-    async with aiofiles.open(log_file, 'w', encoding='utf-8') as f:
-        await f.write(logs)
+    await message.answer(
+        format_log_text(tail, "📋 Последние строки логов:"),
+        reply_markup=get_logs_page_keyboard(cursor),
+        parse_mode="HTML"
+    )
+
+@router.callback_query(F.data.startswith("logs_page:"))
+async def logs_page_callback(callback: CallbackQuery):
+    user_id = callback.from_user.id
+    value = callback.data.split(":", 1)[1]
+    cursor = None if value == "end" else int(value)
+    
+    page, next_cursor = await script_runner.get_log_page(user_id, cursor)
+    if not page.strip():
+        await callback.answer("📋 Более старых логов нет", show_alert=True)
+        return
+    
+    title = "📋 Последние логи:" if cursor is None else "📋 Более ранние логи:"
+    try:
+        await callback.message.edit_text(
+            format_log_text(page, title),
+            reply_markup=get_logs_page_keyboard(next_cursor),
+            parse_mode="HTML"
+        )
+    except Exception:
+        pass
+    await callback.answer()
+
+@router.callback_query(F.data == "logs_live")
+async def logs_live_callback(callback: CallbackQuery):
+    user_id = callback.from_user.id
+    
+    if not script_runner.is_script_running(user_id):
+        await callback.answer("❌ Скрипт не запущен", show_alert=True)
+        return
+    
+    # Новое сообщение, которое будет редактироваться по мере вывода скрипта
+    live_msg = await callback.message.answer(
+        "📡 <b>Live-логи</b>\n\nОжидание вывода...",
+        reply_markup=get_live_tail_keyboard(),
+        parse_mode="HTML"
+    )
+    live_tail_manager.start(callback.bot, callback.message.chat.id, live_msg.message_id, user_id, get_live_tail_keyboard())
+    await callback.answer("📡 Live-режим включен")
+
+@router.callback_query(F.data == "logs_live_stop")
+async def logs_live_stop_callback(callback: CallbackQuery):
+    live_tail_manager.stop(callback.message.chat.id)
+    await callback.answer("⏹️ Live-режим остановлен")
+
+@router.callback_query(F.data == "logs_download")
+async def logs_download_callback(callback: CallbackQuery):
+    user_id = callback.from_user.id
+    logs = await script_runner.get_logs(user_id)
+    
+    if not logs:
+        await callback.answer("📋 Логи не найдены", show_alert=True)
+        return
     
     try:
-        document = FSInputFile(log_file)
-        await message.answer_document(document, caption="📋 Полные логи выполнения скрипта")
+        document = BufferedInputFile(logs.encode('utf-8'), filename="logs.txt")
+        await callback.message.answer_document(document, caption="📋 Последние логи выполнения скрипта")
+        await callback.answer()
     except Exception as e:
-        await message.answer(f"❌ Ошибка при чтении логов: {str(e)}")
+        await callback.answer(f"❌ Ошибка при чтении логов: {str(e)}", show_alert=True)
 
 @router.message(F.text == "❌ Ошибки")
 async def errors_handler(message: Message):
@@ -349,24 +412,18 @@ async def errors_handler(message: Message):
         await message.answer("❌ У вас нет активного хостинга")
         return
     
-    # Получаем только ошибки
+    # Последние ошибки из индекса, без сканирования логов
     errors = await script_runner.get_errors(user_id)
     
     if not errors:
         await message.answer("✅ Ошибок не обнаружено")
         return
     
-    # Сохраняем ошибки во временный файл для отправки
-    error_file = f"logs/user_{user_id}/current_errors.txt"
-    async with aiofiles.open(error_file, 'w', encoding='utf-8') as f:
-        await f.write("=== ОШИБКИ ВЫПОЛНЕНИЯ СКРИПТА ===\n\n")
-        await f.write(errors)
-    
-    try:
-        document = FSInputFile(error_file)
-        await message.answer_document(document, caption="❌ Ошибки выполнения скрипта")
-    except Exception as e:
-        await message.answer(f"❌ Ошибка при чтении ошибок: {str(e)}")
+    error_count = await script_runner.get_error_count(user_id)
+    await message.answer(
+        format_log_text(errors, f"❌ Последние ошибки выполнения скрипта (всего: {error_count}):"),
+        parse_mode="HTML"
+    )
 
 @router.message(F.text == "⚙️ Основной файл")
 async def main_file_handler(message: Message):
@@ -403,19 +460,23 @@ async def debug_files_handler(message: Message):
         await message.answer("❌ Папка не существует")
         return
     
-    # Показываем реальную структуру файлов
+    # Показываем структуру файлов из манифеста
     file_list = "📁 РЕАЛЬНАЯ СТРУКТУРА ФАЙЛОВ:\n\n"
     
-    for root, dirs, files in os.walk(user_folder):
-        level = root.replace(user_folder, '').count(os.sep)
-        indent = '  ' * level
-        file_list += f"{indent}📁 {os.path.basename(root)}/\n"
-        
-        subindent = '  ' * (level + 1)
-        for file in files:
-            full_path = os.path.join(root, file)
-            rel_path = os.path.relpath(full_path, user_folder)
-            file_list += f"{subindent}📄 {file} (относительный путь: {rel_path})\n"
+    manifest = file_manifest.get(user_id) or {'files': {}, 'entry_points': []}
+    file_list += f"📁 {user_id}/\n"
+    shown_dirs = set()
+    for rel_path in sorted(manifest['files']):
+        parts = rel_path.split('/')
+        for level in range(len(parts) - 1):
+            folder = '/'.join(parts[:level + 1])
+            if folder not in shown_dirs:
+                shown_dirs.add(folder)
+                file_list += f"{'  ' * (level + 1)}📁 {parts[level]}/\n"
+        file_list += f"{'  ' * len(parts)}📄 {parts[-1]} (относительный путь: {rel_path})\n"
+    
+    if manifest['entry_points']:
+        file_list += f"\n🎯 Точки входа: {', '.join(manifest['entry_points'])}\n"
     
     # Показываем что в базе данных
     user_data = firebase_db.get_user(str(user_id))
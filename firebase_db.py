@@ -1,18 +1,223 @@
-import firebase_admin
-from firebase_admin import credentials, db
+import asyncio
+import copy
+import functools
 import json
-from config import FIREBASE_CONFIG, ADMIN_LEVELS
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    FIREBASE_CONFIG, ADMIN_LEVELS, USER_CACHE_ENABLED, USER_CACHE_TTL, USER_CACHE_MAX_SIZE,
+    FIREBASE_ASYNC_WORKERS, FIREBASE_COALESCE_WINDOW
+)
 from datetime import datetime, timedelta
 
-class FirebaseDB:
-    def __init__(self):
+HOSTING_EXPIRY_FORMATS = ("%d.%m.%Y %H:%M", "%d.%m.%Y")
+EXPIRY_INDEX_MAX_TS = 9999999999  # верхняя граница для запросов по индексу (10 цифр)
+HOSTING_EXPIRY_INDEX_VERSION = 2  # версия миграции индекса (2 - с удалением устаревших записей)
+
+def parse_hosting_expiry(hosting_expiry):
+    """Разобрать дату окончания хостинга ("%d.%m.%Y %H:%M" или "%d.%m.%Y")"""
+    if not hosting_expiry:
+        return None
+    for date_format in HOSTING_EXPIRY_FORMATS:
         try:
-            cred = credentials.Certificate('service_account.json')
-            firebase_admin.initialize_app(cred, FIREBASE_CONFIG)
-            self.root = db.reference('/')
-            print("✅ Firebase initialized successfully")
+            return datetime.strptime(hosting_expiry, date_format)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+def hosting_expiry_to_ts(hosting_expiry):
+    """Дата окончания хостинга в виде epoch-секунд (None если даты нет)"""
+    expiry_date = parse_hosting_expiry(hosting_expiry)
+    return int(expiry_date.timestamp()) if expiry_date else None
+
+class UserCache:
+    """In-memory кэш записей пользователей с TTL и LRU-вытеснением"""
+
+    def __init__(self, ttl=USER_CACHE_TTL, max_size=USER_CACHE_MAX_SIZE, enabled=USER_CACHE_ENABLED):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()  # user_id -> (expires_at, user_data)
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """Вернуть копию записи или None если ее нет / истек TTL"""
+        if not self.enabled:
+            return None
+        key = str(user_id)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+
+    def set(self, user_id, user_data):
+        """Положить запись в кэш"""
+        if not self.enabled or not isinstance(user_data, dict):
+            return
+        key = str(user_id)
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, copy.deepcopy(user_data))
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def update(self, user_id, updates):
+        """Write-through: применить обновления к закэшированной записи (если она есть)"""
+        if not self.enabled:
+            return
+        key = str(user_id)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return
+            user_data = entry[1]
+            for field, value in updates.items():
+                if value is None:
+                    user_data.pop(field, None)
+                else:
+                    user_data[field] = copy.deepcopy(value)
+
+    def invalidate(self, user_id=None):
+        """Сбросить запись пользователя или весь кэш"""
+        with self._lock:
+            if user_id is None:
+                self._data.clear()
+            else:
+                self._data.pop(str(user_id), None)
+
+    def set_enabled(self, enabled):
+        """Включить/выключить кэш (при выключении кэш очищается)"""
+        self.enabled = enabled
+        if not enabled:
+            self.invalidate()
+
+    def get_stats(self):
+        """Статистика кэша"""
+        total = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+class WriteBatch:
+    """Единица работы: записи нескольких путей одним root-level multi-location update.
+
+        batch = firebase_db.batch()
+        new_balance = batch.add_balance(user_id, -price)
+        batch.update_user(user_id, {'hosting_plan': plan_name, 'hosting_expiry': expiry})
+        batch.set(f'promo_codes/{code}/used_count', used_count)
+        batch.commit()
+
+    Запись атомарная: либо применяются все пути, либо ни один. Отложенные записи
+    (stage_user_update) тех же пользователей уходят вместе с пачкой, значения
+    пачки важнее. Кэш и слушатели обновляются только после успешной записи.
+    """
+
+    def __init__(self, db):
+        self._db = db
+        self._users = {}  # user_id -> поля
+        self._paths = {}  # прочие пути
+
+    def update_user(self, user_id, updates):
+        """Обновить поля пользователя (hosting_expiry - вместе с индексом)"""
+        self._users.setdefault(str(user_id), {}).update(updates)
+        return self
+
+    def add_balance(self, user_id, amount):
+        """Изменить баланс на amount (не ниже нуля). Возвращает новый баланс"""
+        user_id = str(user_id)
+        staged = self._users.get(user_id, {})
+        if 'balance' in staged:
+            current_balance = staged['balance']
+        else:
+            current_balance = self._db.root.child('users').child(user_id).child('balance').get() or 0
+        new_balance = max(0, current_balance + amount)
+        self.update_user(user_id, {'balance': new_balance})
+        return new_balance
+
+    def set(self, path, value):
+        """Записать произвольный путь (None - удалить)"""
+        self._paths[path] = value
+        return self
+
+    def commit(self):
+        """Записать пачку одним запросом. Возвращает True при успехе"""
+        taken = self._db._take_staged(self._users)
+        users = {
+            user_id: {**taken.get(user_id, {}), **updates}
+            for user_id, updates in self._users.items()
+        }
+        paths = dict(self._paths)
+        try:
+            for user_id, updates in users.items():
+                users[user_id], user_paths = self._db._user_update_paths(user_id, updates)
+                paths.update(user_paths)
+            self._db.update_paths(paths)
         except Exception as e:
-            print(f"❌ Firebase initialization error: {e}")
+            for user_id in users:
+                self._db.user_cache.invalidate(user_id)
+            self._db._restage(taken)
+            print(f"❌ Error committing write batch: {e}")
+            return False
+
+        for user_id, updates in users.items():
+            self._db.user_cache.update(user_id, updates)
+            self._db._notify_update_listeners(user_id, updates)
+        self._users, self._paths = {}, {}
+        return True
+
+class FirebaseDB:
+    def __init__(self):
+        self.user_cache = UserCache()
+        self._update_listeners = []
+        self._staged = {}  # user_id -> поля, ожидающие записи (stage_user_update)
+        self._staged_lock = threading.Lock()
+        self._root = None
+        self._init_error = None
+        self._init_lock = threading.Lock()
+    
+    def initialize(self):
+        """Подключиться к Firebase (один раз). Импорт firebase_admin и загрузка ключа
+        тяжелые, поэтому выполняются не при импорте модуля, а при первом обращении
+        к базе или заранее из main в фоне. Возвращает True при успехе"""
+        with self._init_lock:
+            if self._root is not None or self._init_error is not None:
+                return self._root is not None
+            try:
+                import firebase_admin
+                from firebase_admin import credentials, db
+                cred = credentials.Certificate('service_account.json')
+                firebase_admin.initialize_app(cred, FIREBASE_CONFIG)
+                self._root = db.reference('/')
+                print("✅ Firebase initialized successfully")
+            except Exception as e:
+                self._init_error = e
+                print(f"❌ Firebase initialization error: {e}")
+            return self._root is not None
+    
+    @property
+    def root(self):
+        if self._root is None and not self.initialize():
+            raise RuntimeError(f"Firebase не инициализирован: {self._init_error}")
+        return self._root
     
     def create_user(self, user_id, first_name, username):
         user_ref = self.root.child('users').child(str(user_id))
@@ -38,6 +243,7 @@ class FirebaseDB:
                 'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             }
             user_ref.set(user_data)
+            self.user_cache.set(user_id, user_data)
             print(f"✅ Пользователь {user_id} создан в Firebase")
             return True
         else:
@@ -45,23 +251,217 @@ class FirebaseDB:
             return False
     
     def get_user(self, user_id):
+        cached = self.user_cache.get(user_id)
+        if cached is not None:
+            return cached
+        
         user_data = self.root.child('users').child(str(user_id)).get()
         if user_data and isinstance(user_data, dict):
+            self.user_cache.set(user_id, user_data)
             return user_data
         return None
     
     def update_user(self, user_id, updates):
         try:
-            self.root.child('users').child(str(user_id)).update(updates)
+            if 'hosting_expiry' in updates:
+                updates = self._update_user_with_expiry_index(user_id, updates)
+            else:
+                self.root.child('users').child(str(user_id)).update(updates)
+            self.user_cache.update(user_id, updates)
+            self._notify_update_listeners(user_id, updates)
             return True
         except Exception as e:
+            self.user_cache.invalidate(user_id)
             print(f"❌ Error updating user: {e}")
             return False
     
+    def _update_user_with_expiry_index(self, user_id, updates):
+        """Обновить пользователя и индекс hosting_expiry_index одним multi-path update"""
+        updates, paths = self._user_update_paths(user_id, updates)
+        self.update_paths(paths)
+        return updates
+    
+    def _user_update_paths(self, user_id, updates):
+        """Пути multi-path update для полей пользователя: (поля, {путь: значение}).
+        
+        Для hosting_expiry добавляются hosting_expiry_ts и правка индекса"""
+        user_id = str(user_id)
+        if 'hosting_expiry' not in updates:
+            return updates, {f'users/{user_id}/{field}': value for field, value in updates.items()}
+        
+        updates = dict(updates)
+        new_ts = hosting_expiry_to_ts(updates['hosting_expiry'])
+        updates['hosting_expiry_ts'] = new_ts
+        
+        # Запись в кэше может быть старше миграции индекса (hosting_expiry без
+        # hosting_expiry_ts) - тогда прежнюю метку берем из базы, иначе старая
+        # запись индекса осталась бы навсегда
+        cached = self.user_cache.get(user_id)
+        if cached is not None and ('hosting_expiry_ts' in cached or not cached.get('hosting_expiry')):
+            old_ts = cached.get('hosting_expiry_ts')
+        else:
+            old_ts = self.root.child('users').child(user_id).child('hosting_expiry_ts').get()
+        
+        paths = {f'users/{user_id}/{field}': value for field, value in updates.items()}
+        if old_ts and old_ts != new_ts:
+            paths[f'hosting_expiry_index/{old_ts}/{user_id}'] = None
+        if new_ts:
+            paths[f'hosting_expiry_index/{new_ts}/{user_id}'] = True
+        return updates, paths
+    
+    def update_paths(self, paths):
+        """Атомарная запись нескольких путей одним запросом (root-level multi-location update)"""
+        if paths:
+            self.root.update(paths)
+
+    def update_users(self, users_updates):
+        """Обновить поля нескольких пользователей одним запросом: {user_id: updates}.
+
+        В отличие от update_paths обновляет кэш и оповещает слушателей."""
+        batch = self.batch()
+        for user_id, updates in users_updates.items():
+            batch.update_user(user_id, updates)
+        return batch.commit()
+
+    def batch(self):
+        """Новая пачка записей (WriteBatch)"""
+        return WriteBatch(self)
+
+    # ===== ОТЛОЖЕННЫЕ ЗАПИСИ =====
+
+    def stage_user_update(self, user_id, updates):
+        """Отложенная запись частых полей (script_status, files_count).
+
+        Записи за окно FIREBASE_COALESCE_WINDOW склеиваются и уходят одним запросом
+        (flush_staged), повторные записи одного поля - только последним значением.
+        Кэш обновляется сразу, поэтому чтение через get_user видит новое значение."""
+        with self._staged_lock:
+            self._staged.setdefault(str(user_id), {}).update(updates)
+        self.user_cache.update(user_id, updates)
+
+    def _take_staged(self, user_ids=None):
+        """Забрать отложенные записи (всех или указанных пользователей)"""
+        with self._staged_lock:
+            if user_ids is None:
+                taken, self._staged = self._staged, {}
+                return taken
+            return {
+                str(user_id): self._staged.pop(str(user_id))
+                for user_id in user_ids if str(user_id) in self._staged
+            }
+
+    def _restage(self, taken):
+        """Вернуть незаписанные значения в очередь, не затирая более свежие"""
+        with self._staged_lock:
+            for user_id, updates in taken.items():
+                self._staged[user_id] = {**updates, **self._staged.get(user_id, {})}
+
+    def flush_staged(self):
+        """Записать отложенные записи одним запросом. Возвращает True при успехе"""
+        taken = self._take_staged()
+        if not taken:
+            return True
+        batch = self.batch()
+        for user_id, updates in taken.items():
+            batch.update_user(user_id, updates)
+        if batch.commit():
+            return True
+        self._restage(taken)
+        return False
+
+    def get_expiry_index_between(self, t0, t1):
+        """Пользователи с окончанием хостинга в [t0, t1] по индексу: [(epoch, user_id), ...]"""
+        index = self.root.child('hosting_expiry_index').order_by_key() \
+            .start_at(str(int(t0))).end_at(str(int(t1))).get() or {}
+        
+        result = []
+        for ts, user_ids in index.items():
+            for user_id in (user_ids or {}):
+                result.append((int(ts), str(user_id)))
+        result.sort()
+        return result
+    
+    def get_users_expiring_between(self, t0, t1):
+        """Данные пользователей, чей хостинг истекает в [t0, t1] (читаются только нужные записи)"""
+        users = {}
+        for _, user_id in self.get_expiry_index_between(t0, t1):
+            user_data = self.get_user(user_id)
+            if user_data:
+                users[user_id] = user_data
+        return users
+    
+    def migrate_hosting_expiry_index(self, force=False):
+        """Миграция индекса: проставить hosting_expiry_ts старым записям, дописать
+        недостающие записи индекса и удалить устаревшие (версия 2)"""
+        meta_ref = self.root.child('meta').child('hosting_expiry_index_version')
+        if not force and (meta_ref.get() or 0) >= HOSTING_EXPIRY_INDEX_VERSION:
+            return 0
+        
+        users = self.get_all_users()
+        paths = {}
+        migrated = {}
+        expected = {}
+        for user_id, user_data in users.items():
+            if not isinstance(user_data, dict):
+                continue
+            ts = hosting_expiry_to_ts(user_data.get('hosting_expiry'))
+            if not ts:
+                continue
+            expected[str(user_id)] = ts
+            paths[f'hosting_expiry_index/{ts}/{user_id}'] = True
+            if user_data.get('hosting_expiry_ts') != ts:
+                paths[f'users/{user_id}/hosting_expiry_ts'] = ts
+                migrated[str(user_id)] = ts
+        
+        # Записи индекса, не совпадающие с hosting_expiry_ts пользователя
+        stale = 0
+        index = self.root.child('hosting_expiry_index').get() or {}
+        for ts, user_ids in index.items():
+            for user_id in (user_ids or {}):
+                if expected.get(str(user_id)) != int(ts):
+                    paths[f'hosting_expiry_index/{ts}/{user_id}'] = None
+                    stale += 1
+        
+        paths['meta/hosting_expiry_index_version'] = HOSTING_EXPIRY_INDEX_VERSION
+        try:
+            self.update_paths(paths)
+        except Exception:
+            for user_id in migrated:
+                self.user_cache.invalidate(user_id)
+            raise
+        # Кэш обновляем только после успешной записи
+        for user_id, ts in migrated.items():
+            self.user_cache.update(user_id, {'hosting_expiry_ts': ts})
+        print(f"✅ Миграция индекса окончания хостинга: обновлено {len(migrated)} пользователей, "
+              f"удалено устаревших записей: {stale}")
+        return len(migrated)
+    
+    def get_hosting_state(self):
+        """Сохраненное состояние предупреждений и льготных периодов (узел hosting_state)"""
+        state = self.root.child('hosting_state').get()
+        return state or {}
+    
+    def add_update_listener(self, listener):
+        """Подписаться на изменения пользователей: listener(user_id, updates).
+        
+        Может вызываться из потока пула AsyncFirebaseDB."""
+        self._update_listeners.append(listener)
+    
+    def _notify_update_listeners(self, user_id, updates):
+        for listener in self._update_listeners:
+            try:
+                listener(str(user_id), updates)
+            except Exception as e:
+                print(f"❌ Error in update listener: {e}")
+    
     def get_all_users(self):
         users = self.root.child('users').get()
         return users or {}
     
+    def get_cache_stats(self):
+        """Статистика кэша пользователей"""
+        return self.user_cache.get_stats()
+    
     def set_user_has_files(self, user_id, has_files=True, files_count=0):
         """Устанавливаем флаг что у пользователя есть файлы"""
         return self.update_user(user_id, {
@@ -82,6 +482,7 @@ class FirebaseDB:
             current_balance = user_ref.child('balance').get() or 0
             new_balance = max(0, current_balance + amount)
             user_ref.update({'balance': new_balance})
+            self.user_cache.update(user_id, {'balance': new_balance})
             return new_balance
         except Exception as e:
             print(f"❌ Error updating balance: {e}")
@@ -94,6 +495,7 @@ class FirebaseDB:
             if library not in current_libraries:
                 current_libraries.append(library)
                 user_ref.update({'libraries': current_libraries})
+                self.user_cache.update(user_id, {'libraries': current_libraries})
             return True
         except Exception as e:
             print(f"❌ Error adding library: {e}")
@@ -106,6 +508,7 @@ class FirebaseDB:
             if library in current_libraries:
                 current_libraries.remove(library)
                 user_ref.update({'libraries': current_libraries})
+                self.user_cache.update(user_id, {'libraries': current_libraries})
             return True
         except Exception as e:
             print(f"❌ Error removing library: {e}")
@@ -193,17 +596,18 @@ class FirebaseDB:
             if promo_data.get('used_count', 0) >= promo_data.get('uses_limit', 1):
                 return False, "Лимит использований промокода исчерпан"
             
-            # Применяем награду
+            # Награда и счетчик промокода записываются одной пачкой
+            batch = self.batch()
             reward_type = promo_data.get('reward_type')
             reward_value = promo_data.get('reward_value')
             
             if reward_type == 'balance':
-                self.update_balance(user_id, reward_value)
+                batch.add_balance(user_id, reward_value)
                 message = f"Баланс пополнен на {reward_value}₽"
             elif reward_type == 'hosting':
                 # Активируем хостинг
                 expiry_date = (datetime.now() + timedelta(days=reward_value)).strftime("%d.%m.%Y %H:%M")
-                self.update_user(user_id, {
+                batch.update_user(user_id, {
                     'hosting_plan': f'FlixHost {reward_value} дней',
                     'hosting_expiry': expiry_date
                 })
@@ -212,11 +616,12 @@ class FirebaseDB:
                 return False, "Неизвестный тип награды"
             
             # Обновляем данные промокода
-            promo_ref.update({
-                'used_count': promo_data.get('used_count', 0) + 1,
-                'used_by': promo_data.get('used_by', []) + [user_id]
-            })
+            promo_path = f'promo_codes/{code.upper()}'
+            batch.set(f'{promo_path}/used_count', promo_data.get('used_count', 0) + 1)
+            batch.set(f'{promo_path}/used_by', promo_data.get('used_by', []) + [user_id])
             
+            if not batch.commit():
+                return False, "Ошибка при активации промокода"
             return True, message
             
         except Exception as e:
@@ -269,4 +674,92 @@ class FirebaseDB:
         
         return False
 
-firebase_db = FirebaseDB()
\ No newline at end of file
+firebase_db = FirebaseDB()
+
+class AsyncFirebaseDB:
+    """Неблокирующий фасад над FirebaseDB.
+
+    Каждый публичный метод FirebaseDB доступен как корутина: синхронный вызов
+    firebase_admin выполняется в ограниченном пуле потоков, event loop не блокируется.
+    Хендлеры переводятся на него по одному: ``await async_firebase_db.get_user(user_id)``.
+    """
+
+    def __init__(self, sync_db, max_workers=FIREBASE_ASYNC_WORKERS):
+        self._db = sync_db
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='firebase')
+        self._metrics = {}
+        self._metrics_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        
+        attr = getattr(self._db, name)
+        if not callable(attr):
+            return attr
+        
+        @functools.wraps(attr)
+        async def method(*args, **kwargs):
+            return await self._run(name, attr, *args, **kwargs)
+        
+        setattr(self, name, method)
+        return method
+
+    async def get_user(self, user_id):
+        # Попадание в кэш отдаем сразу, без похода в пул потоков
+        cached = self._db.user_cache.get(user_id)
+        if cached is not None:
+            self._record('get_user', 0.0)
+            return cached
+        return await self._run('get_user', self._db.get_user, user_id)
+
+    async def _run(self, name, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+        finally:
+            self._record(name, time.perf_counter() - started)
+
+    def _record(self, name, elapsed):
+        with self._metrics_lock:
+            stats = self._metrics.setdefault(name, {'calls': 0, 'total': 0.0, 'max': 0.0})
+            stats['calls'] += 1
+            stats['total'] += elapsed
+            stats['max'] = max(stats['max'], elapsed)
+
+    async def batch_add_balance(self, batch, user_id, amount):
+        """WriteBatch.add_balance в пуле потоков (текущий баланс читается из базы)"""
+        return await self._run('batch_add_balance', batch.add_balance, user_id, amount)
+
+    async def commit(self, batch):
+        """Записать WriteBatch в пуле потоков"""
+        return await self._run('commit', batch.commit)
+
+    async def start_flusher(self, interval=FIREBASE_COALESCE_WINDOW):
+        """Фоновая запись отложенных полей пользователей раз в окно склейки"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush_staged()
+            except Exception as e:
+                print(f"❌ Ошибка записи отложенных полей: {e}")
+
+    def get_metrics(self):
+        """Задержки по методам: количество вызовов, среднее и максимум в миллисекундах"""
+        with self._metrics_lock:
+            return {
+                name: {
+                    'calls': stats['calls'],
+                    'avg_ms': stats['total'] / stats['calls'] * 1000,
+                    'max_ms': stats['max'] * 1000
+                }
+                for name, stats in self._metrics.items()
+            }
+
+    def shutdown(self):
+        """Остановить пул потоков"""
+        self._executor.shutdown(wait=False)
+
+async_firebase_db = AsyncFirebaseDB(firebase_db)
@@ -1,13 +1,16 @@
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, FSInputFile
+from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
-from firebase_db import firebase_db
+from firebase_db import firebase_db, async_firebase_db
 from keyboards import get_hosting_plans_keyboard, get_buy_hosting_keyboard, get_main_keyboard, get_replenish_keyboard
 from config import HOSTING_PLANS
 from datetime import datetime, timedelta
 import os
 import psutil
 from utils.script_runner import script_runner
+from utils.supervisor import supervisor
+from utils.file_manifest import file_manifest
+from utils.plans import get_plan_by_name, get_plan_limits, parse_size
 from utils.file_processing import file_processor
 
 router = Router()
@@ -57,14 +60,16 @@ async def buy_hosting_callback(callback: CallbackQuery):
         return
     
     plan = HOSTING_PLANS[plan_key]
-    user_data = firebase_db.get_user(user_id) or {}
+    user_data = await async_firebase_db.get_user(user_id) or {}
     balance = user_data.get('balance', 0)
     
     if balance < plan['price']:
         await callback.answer(f"❌ Недостаточно средств. Нужно еще {plan['price'] - balance}₽", show_alert=True)
         return
     
-    new_balance = firebase_db.update_balance(user_id, -plan['price'])
+    # Списание и активация - одной записью: не бывает списания без хостинга
+    batch = firebase_db.batch()
+    new_balance = await async_firebase_db.batch_add_balance(batch, user_id, -plan['price'])
     expiry_date = (datetime.now() + timedelta(days=plan['duration_days'])).strftime("%d.%m.%Y %H:%M")
     
     updates = {
@@ -72,7 +77,10 @@ async def buy_hosting_callback(callback: CallbackQuery):
         'hosting_expiry': expiry_date,
         'balance': new_balance
     }
-    firebase_db.update_user(user_id, updates)
+    batch.update_user(user_id, updates)
+    if not await async_firebase_db.commit(batch):
+        await callback.answer("❌ Ошибка при покупке хостинга, попробуйте еще раз", show_alert=True)
+        return
     
     await callback.message.edit_text(
         f"✅ Хостинг успешно активирован!\n\n"
@@ -127,15 +135,14 @@ def get_simple_main_file_path(user_id: int):
         print(f"🎯 Используем путь 2: {path2}")
         return path2, 'main.py'
     
-    print("🔍 Ищем любой .py файл...")
-    for root, dirs, files in os.walk(user_folder):
-        for file in files:
-            if file.endswith('.py'):
-                found_path = os.path.join(root, file)
-                rel_path = os.path.relpath(found_path, user_folder)
-                print(f"🎯 Найден файл: {found_path}")
-                print(f"📝 Относительный путь: {rel_path}")
-                return found_path, rel_path
+    print("🔍 Ищем точку входа в манифесте...")
+    candidates = file_manifest.entry_points(user_id) or file_manifest.python_files(user_id)
+    if candidates:
+        rel_path = candidates[0]
+        found_path = os.path.join(user_folder, rel_path)
+        print(f"🎯 Найден файл: {found_path}")
+        print(f"📝 Относительный путь: {rel_path}")
+        return found_path, rel_path
     
     print("❌ Python файлы не найдены")
     return None, "Python файлы не найдены"
@@ -182,11 +189,11 @@ async def start_script_handler(message: Message):
     print(f"📁 Директория: {os.path.dirname(absolute_path)}")
     print(f"✅ Существует: {os.path.exists(absolute_path)}")
     
-    success, result = await script_runner.start_script(user_id, absolute_path, python_version)
+    plan = get_plan_by_name(user_data.get('hosting_plan'))
+    success, result = await supervisor.start(user_id, absolute_path, python_version,
+                                             log_quota=plan.get('logs'), limits=get_plan_limits(plan))
     
     if success:
-        firebase_db.update_user(user_id, {'script_status': 'running'})
-        
         success_text = f"""✅ Скрипт запущен!
 
 📁 Файл: {main_file_name}
@@ -207,15 +214,14 @@ async def start_script_handler(message: Message):
 async def stop_script_handler(message: Message):
     user_id = message.from_user.id
     
-    if not script_runner.is_script_running(user_id):
+    if not script_runner.is_script_running(user_id) and not supervisor.is_restart_pending(user_id):
         await message.answer("ℹ️ Скрипт не запущен")
         return
     
     stopping_msg = await message.answer("🔄 Останавливаю скрипт...")
-    success = await script_runner.stop_script(user_id)
+    success = await supervisor.stop(user_id)
     
     if success:
-        firebase_db.update_user(user_id, {'script_status': 'stopped'})
         await stopping_msg.edit_text("✅ Скрипт остановлен")
     else:
         await stopping_msg.edit_text("❌ Не удалось остановить скрипт")
@@ -229,33 +235,43 @@ async def resources_handler(message: Message):
         await message.answer("❌ У вас нет активного хостинга")
         return
     
-    user_folder = f"user_files/{user_id}"
-    total_size = 0
-    if os.path.exists(user_folder):
-        for root, dirs, files in os.walk(user_folder):
-            for file in files:
-                file_path = os.path.join(root, file)
-                total_size += os.path.getsize(file_path)
-    
-    size_mb = total_size / (1024 * 1024)
+    plan = get_plan_by_name(user_data.get('hosting_plan'))
+    storage_limit = parse_size(plan['storage'])
+    size_mb = await file_manifest.disk_usage(user_id) / (1024 * 1024)
     
     script_status = "остановлен"
     if script_runner.is_script_running(user_id):
         script_status = "запущен"
+    elif supervisor.is_restart_pending(user_id):
+        script_status = "перезапускается"
     
-    resources = script_runner.get_resource_usage(user_id)
+    resources = script_runner.get_resource_usage(user_id, ram_limit=parse_size(plan['ram']))
+    limits = get_plan_limits(plan)
+    limit_stats = (await script_runner.get_log_stats(user_id))['limits']
     
     resources_text = f"""📊 Ресурсы:
 
-🖥️ CPU: {resources['cpu']}
+🖥️ CPU: {resources['cpu']} / {limits['cpu']}%
 💾 ОЗУ: {resources['ram_used']} / {resources['ram_total']}
-📁 Файлы: {size_mb:.2f} MB / 2000 MB
+📁 Файлы: {size_mb:.2f} MB / {storage_limit / (1024 * 1024):.0f} MB
+🧵 Потоки: {resources['threads']} | 📂 Дескрипторы: {resources['fds']} / {limits['open_files']}
 🚀 Скрипт: {script_status}"""
 
+    if limit_stats.get('oom') or limit_stats.get('throttled'):
+        resources_text += f"""
+🧱 Превышения лимитов: память {limit_stats.get('oom', 0)}, CPU {limit_stats.get('throttled', 0)}"""
+
+    if resources['cpu_history']:
+        resources_text += f"""
+
+📈 За последние минуты:
+CPU {resources['cpu_history']}
+ОЗУ {resources['ram_history']}"""
+
     await message.answer(resources_text)
 
-@router.message(F.text == "📋 Логи")
-async def logs_handler(message: Message):
+@router.message(Command("restart_policy"))
+async def restart_policy_handler(message: Message):
     user_id = message.from_user.id
     user_data = firebase_db.get_user(user_id)
     
@@ -263,29 +279,18 @@ async def logs_handler(message: Message):
         await message.answer("❌ У вас нет активного хостинга")
         return
     
-    # Проверяем локальные логи
-    log_file = f"logs/user_{user_id}/script.log"
-    error_file = f"logs/user_{user_id}/error.log"
-    
-    has_logs = os.path.exists(log_file) and os.path.getsize(log_file) > 0
-    has_errors = os.path.exists(error_file) and os.path.getsize(error_file) > 0
-    
-    if not has_logs and not has_errors:
-        await message.answer("📋 Логи не найдены (скрипт еще не запускался или не вывел данные)")
+    parts = message.text.split()
+    current = supervisor.normalize_policy(user_data.get('restart_policy'))
+    if len(parts) != 2 or parts[1] not in supervisor.POLICIES:
+        await message.answer(
+            f"🔁 Автоперезапуск: <code>{current}</code>\n\n"
+            f"<code>/restart_policy never</code> - не перезапускать\n"
+            f"<code>/restart_policy on-failure</code> - только при ошибке\n"
+            f"<code>/restart_policy always</code> - всегда\n\n"
+            f"💡 Новая политика применяется при следующем запуске скрипта",
+            parse_mode="HTML"
+        )
         return
     
-    # Отправляем логи
-    if has_logs:
-        try:
-            document = FSInputFile(log_file)
-            await message.answer_document(document, caption="📋 Логи выполнения скрипта")
-        except Exception as e:
-            await message.answer(f"❌ Ошибка при чтении логов: {str(e)}")
-    
-    # Отправляем ошибки если есть
-    if has_errors:
-        try:
-            document = FSInputFile(error_file)
-            await message.answer_document(document, caption="❌ Ошибки выполнения скрипта")
-        except Exception as e:
-            await message.answer(f"❌ Ошибка при чтении ошибок: {str(e)}")
\ No newline at end of file
+    firebase_db.update_user(user_id, {'restart_policy': parts[1]})
+    await message.answer(f"✅ Автоперезапуск: <code>{parts[1]}</code>\n💡 Применится при следующем запуске скрипта", parse_mode="HTML")
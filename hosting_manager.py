@@ -1,188 +1,263 @@
 import asyncio
-import os
-import shutil
 from datetime import datetime, timedelta
-from firebase_db import firebase_db
-from config import BOT_TOKEN
+from firebase_db import firebase_db, async_firebase_db, parse_hosting_expiry, EXPIRY_INDEX_MAX_TS
+from config import HOSTING_WARNING_HOURS, HOSTING_GRACE_PERIOD_HOURS, EXPIRY_MAX_SLEEP, EXPIRY_RETRY_DELAY
 from utils.script_runner import script_runner
-from aiogram import Bot
+from utils.expiry_scheduler import expiry_scheduler, ExpiryScheduler
+from utils.hosting_state import HostingStateStore
+from utils.notifier import notifier
+from utils.deployer import deployer
+from utils.supervisor import supervisor
+from utils.venv_manager import venv_manager
+from utils.dependency_layers import dependency_layers
 from keyboards import get_replenish_keyboard, get_blocked_keyboard
 
 class HostingManager:
     def __init__(self):
         self.active_hostings = {}
-        self.bot = Bot(token=BOT_TOKEN)
-        self.notified_users = set()
-        self.grace_period_users = {}
-    
-    async def check_hosting_expiry(self):
-        """Check and update expired hostings"""
-        users = firebase_db.get_all_users()
-        current_date = datetime.now()
-        
-        print(f"🔍 Проверка истечения хостингов... Текущее время: {current_date}")
-        
-        expired_count = 0
-        warned_count = 0
-        deleted_count = 0
-        
-        for user_id, user_data in users.items():
-            hosting_expiry = user_data.get('hosting_expiry')
-            hosting_plan = user_data.get('hosting_plan')
-            
-            if hosting_plan and hosting_expiry:
-                try:
-                    expiry_date = datetime.strptime(hosting_expiry, "%d.%m.%Y %H:%M")
-                    
-                    time_left = expiry_date - current_date
-                    time_left_hours = time_left.total_seconds() / 1
-                    
-                    print(f"🔍 Пользователь {user_id}:")
-                    print(f"   Хостинг: {hosting_plan}")
-                    print(f"   Истекает: {expiry_date}")
-                    print(f"   Осталось часов: {time_left_hours:.1f}")
-                    
-                    # Предупреждение за 24 часа до истечения
-                    if 0 < time_left_hours <= 24 and user_id not in self.notified_users:
-                        try:
-                            await self.bot.send_message(
-                                user_id,
-                                f"⚠️ ВНИМАНИЕ!\n\n"
-                                f"До отключения хостинга осталось менее 24 часов!\n"
-                                f"⏰ Истекает: {expiry_date.strftime('%d.%m.%Y в %H:%M')}\n\n"
-                                f"Пополните баланс чтобы продлить хостинг.",
-                                reply_markup=get_replenish_keyboard()
-                            )
-                            self.notified_users.add(user_id)
-                            warned_count += 1
-                            print(f"⚠️ Пользователь {user_id} предупрежден об окончании хостинга")
-                        except Exception as e:
-                            print(f"❌ Ошибка отправки предупреждения пользователю {user_id}: {e}")
-                    
-                    # Если хостинг истек
-                    if current_date > expiry_date:
-                        if user_id not in self.grace_period_users:
-                            grace_period_end = current_date + timedelta(days=1)
-                            self.grace_period_users[user_id] = grace_period_end
-                            
-                            try:
-                                await self.bot.send_message(
-                                    user_id,
-                                    f"❌ Ваш хостинг не оплачен\nи поэтому был заблокирован\n\n"
-                                    f"⚠️ У вас есть 24 часа чтобы оплатить хостинг.\n"
-                                    f"⏰ После {grace_period_end.strftime('%d.%m.%Y в %H:%M')}\n"
-                                    f"все файлы будут удалены без возможности восстановления!",
-                                    reply_markup=get_blocked_keyboard()
-                                )
-                                print(f"📧 Пользователь {user_id} уведомлен о блокировке хостинга")
-                            except Exception as e:
-                                print(f"❌ Ошибка отправки уведомления о блокировке пользователю {user_id}: {e}")
-                        
-                        elif current_date > self.grace_period_users[user_id]:
-                            user_folder = f"user_files/{user_id}"
-                            if os.path.exists(user_folder):
-                                shutil.rmtree(user_folder)
-                                print(f"🗑️ Файлы пользователя {user_id} удалены")
-                            
-                            firebase_db.update_user(user_id, {
-                                'hosting_plan': None,
-                                'hosting_expiry': None,
-                                'script_status': 'deleted',
-                                'has_files': False,
-                                'files_count': 0,
-                                'main_file': 'main.py'
-                            })
-                            
-                            del self.grace_period_users[user_id]
-                            
-                            try:
-                                await self.bot.send_message(
-                                    user_id,
-                                    "💀 Все ваши файлы были удалены из-за неуплаты хостинга.\n\n"
-                                    "Для восстановления доступа приобретите новый хостинг.",
-                                    reply_markup=get_replenish_keyboard()
-                                )
-                                print(f"💀 Пользователь {user_id} уведомлен об удалении файлов")
-                            except Exception as e:
-                                print(f"❌ Ошибка отправки финального уведомления пользователю {user_id}: {e}")
-                            
-                            deleted_count += 1
-                        
-                        print(f"❌ Хостинг истек для пользователя {user_id}")
-                        expired_count += 1
-                        
-                        if user_id in self.notified_users:
-                            self.notified_users.remove(user_id)
-                        
-                except ValueError:
-                    try:
-                        expiry_date = datetime.strptime(hosting_expiry, "%d.%m.%Y")
-                        if current_date > expiry_date:
-                            if user_id not in self.grace_period_users:
-                                grace_period_end = current_date + timedelta(days=1)
-                                self.grace_period_users[user_id] = grace_period_end
-                                
-                                try:
-                                    await self.bot.send_message(
-                                        user_id,
-                                        f"❌ Ваш хостинг не оплачен\nи поэтому был заблокирован\n\n"
-                                        f"⚠️ У вас есть 24 часа чтобы оплатить хостинг.\n"
-                                        f"⏰ После {grace_period_end.strftime('%d.%m.%Y в %H:%M')}\n"
-                                        f"все файлы будут удалены без возможности восстановления!",
-                                        reply_markup=get_blocked_keyboard()
-                                    )
-                                except Exception as e:
-                                    print(f"❌ Ошибка отправки уведомления о блокировке пользователю {user_id}: {e}")
-                            
-                            elif current_date > self.grace_period_users[user_id]:
-                                user_folder = f"user_files/{user_id}"
-                                if os.path.exists(user_folder):
-                                    shutil.rmtree(user_folder)
-                                    print(f"🗑️ Файлы пользователя {user_id} удалены")
-                                
-                                firebase_db.update_user(user_id, {
-                                    'hosting_plan': None,
-                                    'hosting_expiry': None,
-                                    'script_status': 'deleted',
-                                    'has_files': False,
-                                    'files_count': 0,
-                                    'main_file': 'main.py'
-                                })
-                                
-                                del self.grace_period_users[user_id]
-                                
-                                try:
-                                    await self.bot.send_message(
-                                        user_id,
-                                        "💀 Все ваши файлы были удалены из-за неуплаты хостинга.\n\n"
-                                        "Для восстановления доступа приобретите новый хостинг.",
-                                        reply_markup=get_replenish_keyboard()
-                                    )
-                                except Exception as e:
-                                    print(f"❌ Ошибка отправки финального уведомления пользователю {user_id}: {e}")
-                                
-                                deleted_count += 1
-                            
-                            print(f"❌ Хостинг истек для пользователя {user_id}")
-                            expired_count += 1
-                    except:
-                        continue
+        self.state = HostingStateStore(firebase_db)
+        self.scheduler = expiry_scheduler
+        self.warning_period = timedelta(hours=HOSTING_WARNING_HOURS)
+        self.grace_period = timedelta(hours=HOSTING_GRACE_PERIOD_HOURS)
+        self._loop = None
+        self._wakeup = None
+        firebase_db.add_update_listener(self._on_user_updated)
+
+    # ===== РАСПИСАНИЕ =====
+
+    def schedule_user(self, user_id, expiry_date):
+        """Пересчитать события пользователя по дате окончания хостинга (datetime или None)"""
+        user_id = str(user_id)
+
+        if not expiry_date:
+            self.scheduler.cancel(user_id)
+            return
+
+        grace_period_end = self.state.get_grace_end(user_id)
+        if grace_period_end:
+            self.scheduler.schedule(user_id, [(grace_period_end.timestamp(), ExpiryScheduler.DELETE)])
+            return
+
+        events = [(expiry_date.timestamp(), ExpiryScheduler.BLOCK)]
+        if not self.state.is_notified(user_id, int(expiry_date.timestamp())):
+            warn_at = expiry_date - self.warning_period
+            events.append((warn_at.timestamp(), ExpiryScheduler.WARN))
+        self.scheduler.schedule(user_id, events)
+
+    def _on_user_updated(self, user_id, updates):
+        """Слушатель FirebaseDB: инкрементально обновляем расписание при смене даты окончания"""
+        if 'hosting_expiry' not in updates:
+            return
+
+        expiry_date = parse_hosting_expiry(updates['hosting_expiry'])
+
+        # Хостинг продлен или снят - сбрасываем предупреждения и льготный период
+        if not expiry_date or expiry_date > datetime.now():
+            self.state.clear(user_id)
+
+        self.schedule_user(user_id, expiry_date)
+        self._wake()
+
+    def _wake(self):
+        if self._loop and self._wakeup:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def load_schedule(self):
+        """Построить расписание по индексу hosting_expiry_index (без выгрузки всех пользователей)"""
+        await asyncio.to_thread(self.state.load)
+        await async_firebase_db.migrate_hosting_expiry_index()
+        expiring = await async_firebase_db.get_expiry_index_between(0, EXPIRY_INDEX_MAX_TS)
+        self.scheduler.clear()
+
+        for expiry_ts, user_id in expiring:
+            self.schedule_user(user_id, datetime.fromtimestamp(expiry_ts))
+
+        print(f"📅 Расписание хостингов загружено: {len(self.scheduler)} событий")
+
+    # ===== ОБРАБОТКА СОБЫТИЙ =====
+
+    async def process_due_events(self):
+        """Обработать все наступившие события расписания.
+
+        Сначала меняется состояние и сохраняется одной пачкой, затем отправляются
+        уведомления - после рестарта повторных сообщений не будет.
+        """
+        counters = {ExpiryScheduler.WARN: 0, ExpiryScheduler.BLOCK: 0, ExpiryScheduler.DELETE: 0}
+        notifications = []
+        deletions = []
+
+        # События уже извлечены из очереди: при любой ошибке событие возвращается
+        # в нее с задержкой, иначе оно потерялось бы до следующего рестарта
+        for user_id, kind, _ in self.scheduler.pop_due():
+            try:
+                user_data = await async_firebase_db.get_user(user_id) or {}
+                expiry_date = parse_hosting_expiry(user_data.get('hosting_expiry'))
+
+                # Данные изменились после планирования - событие больше не актуально
+                if not user_data.get('hosting_plan') or not expiry_date:
+                    self.scheduler.cancel(user_id)
+                    continue
+
+                if kind == ExpiryScheduler.WARN:
+                    notification = self._warn_user(user_id, expiry_date)
+                elif kind == ExpiryScheduler.BLOCK:
+                    notification = self._block_user(user_id, expiry_date)
+                else:
+                    notification = None
+                    if self._is_deletion_due(user_id, expiry_date):
+                        deletions.append(user_id)
+                        counters[kind] += 1
+
+                if notification:
+                    notifications.append(notification)
+                    counters[kind] += 1
+            except Exception as e:
+                print(f"❌ Ошибка обработки события {kind} для пользователя {user_id}: {e}, "
+                      f"повтор через {EXPIRY_RETRY_DELAY} сек")
+                self.scheduler.retry(user_id, kind, EXPIRY_RETRY_DELAY)
+
+        if self.state.has_pending_writes():
+            await asyncio.to_thread(self.state.flush)
+
+        for user_id in deletions:
+            try:
+                notifications.append(await self._delete_user_files(user_id))
+            except Exception as e:
+                print(f"❌ Ошибка удаления файлов пользователя {user_id}: {e}, "
+                      f"повтор через {EXPIRY_RETRY_DELAY} сек")
+                self.scheduler.retry(user_id, ExpiryScheduler.DELETE, EXPIRY_RETRY_DELAY)
+
+        for user_id, text, reply_markup, dedup_key in notifications:
+            notifier.send_message(user_id, text, reply_markup=reply_markup, dedup_key=dedup_key)
+
+        if counters[ExpiryScheduler.BLOCK] > 0:
+            print(f"🎯 Истекло хостингов: {counters[ExpiryScheduler.BLOCK]}")
+        if counters[ExpiryScheduler.WARN] > 0:
+            print(f"⚠️ Предупреждено пользователей: {counters[ExpiryScheduler.WARN]}")
+        if counters[ExpiryScheduler.DELETE] > 0:
+            print(f"💀 Удалено файлов пользователей: {counters[ExpiryScheduler.DELETE]}")
+
+        return counters
+
+    def _warn_user(self, user_id, expiry_date):
+        now = datetime.now()
+        expiry_ts = int(expiry_date.timestamp())
+        if self.state.is_notified(user_id, expiry_ts) or not (now < expiry_date <= now + self.warning_period):
+            return None
+
+        self.state.mark_notified(user_id, expiry_ts)
+        print(f"⚠️ Пользователь {user_id} предупрежден об окончании хостинга")
+        return (
+            user_id,
+            f"⚠️ ВНИМАНИЕ!\n\n"
+            f"До отключения хостинга осталось менее 24 часов!\n"
+            f"⏰ Истекает: {expiry_date.strftime('%d.%m.%Y в %H:%M')}\n\n"
+            f"Пополните баланс чтобы продлить хостинг.",
+            get_replenish_keyboard(),
+            f"hosting_warn:{user_id}:{expiry_ts}"
+        )
+
+    def _block_user(self, user_id, expiry_date):
+        now = datetime.now()
+        if now <= expiry_date:
+            self.schedule_user(user_id, expiry_date)
+            return None
+
+        grace_period_end = self.state.get_grace_end(user_id)
+        notification = None
+        if not grace_period_end:
+            grace_period_end = now + self.grace_period
+            self.state.set_grace_end(user_id, grace_period_end)
+            notification = (
+                user_id,
+                f"❌ Ваш хостинг не оплачен\nи поэтому был заблокирован\n\n"
+                f"⚠️ У вас есть 24 часа чтобы оплатить хостинг.\n"
+                f"⏰ После {grace_period_end.strftime('%d.%m.%Y в %H:%M')}\n"
+                f"все файлы будут удалены без возможности восстановления!",
+                get_blocked_keyboard(),
+                f"hosting_block:{user_id}:{int(expiry_date.timestamp())}"
+            )
+            print(f"📧 Пользователь {user_id} уведомлен о блокировке хостинга")
+
+        self.state.clear_warning(user_id)
+        self.scheduler.schedule(user_id, [(grace_period_end.timestamp(), ExpiryScheduler.DELETE)])
+        print(f"❌ Хостинг истек для пользователя {user_id}")
+        return notification
+
+    def _is_deletion_due(self, user_id, expiry_date):
+        now = datetime.now()
+        grace_period_end = self.state.get_grace_end(user_id)
+        if now <= expiry_date or not grace_period_end or now <= grace_period_end:
+            self.schedule_user(user_id, expiry_date)
+            return False
+        return True
+
+    async def _delete_user_files(self, user_id):
+        # Скрипт без файлов перезапускать некуда - снимаем с надзора
+        await supervisor.stop(int(user_id), status='deleted')
         
-        if expired_count > 0:
-            print(f"🎯 Истекло хостингов: {expired_count}")
-        if warned_count > 0:
-            print(f"⚠️ Предупреждено пользователей: {warned_count}")
-        if deleted_count > 0:
-            print(f"💀 Удалено файлов пользователей: {deleted_count}")
-        if expired_count == 0 and warned_count == 0 and deleted_count == 0:
+        # Удаляем и сохраненные версии - восстановить файлы будет нельзя
+        await asyncio.to_thread(deployer.remove, user_id)
+        await venv_manager.remove(user_id)
+        await dependency_layers.detach_user(user_id)
+        print(f"🗑️ Файлы пользователя {user_id} удалены")
+
+        # Сброс hosting_expiry очистит и сохраненное состояние (слушатель). Статус
+        # 'deleted', отложенный supervisor.stop, уходит в той же записи
+        batch = firebase_db.batch()
+        batch.update_user(user_id, {
+            'hosting_plan': None,
+            'hosting_expiry': None,
+            'has_files': False,
+            'files_count': 0,
+            'main_file': 'main.py'
+        })
+        await async_firebase_db.commit(batch)
+
+        print(f"💀 Пользователь {user_id} уведомлен об удалении файлов")
+        return (
+            user_id,
+            "💀 Все ваши файлы были удалены из-за неуплаты хостинга.\n\n"
+            "Для восстановления доступа приобретите новый хостинг.",
+            get_replenish_keyboard(),
+            f"hosting_delete:{user_id}"
+        )
+
+    async def check_hosting_expiry(self):
+        """Полная сверка: перестроить расписание и обработать наступившие события"""
+        print(f"🔍 Проверка истечения хостингов... Текущее время: {datetime.now()}")
+        await self.load_schedule()
+        counters = await self.process_due_events()
+        if not any(counters.values()):
             print("✅ Активных хостингов не истекло")
-    
+        self._wake()
+
     async def start_expiry_checker(self):
-        """Start periodic expiry checking"""
-        print("🔄 Запуск проверки истечения хостингов (каждый час)")
-        
+        """Start event-driven expiry scheduler"""
+        print("🔄 Запуск планировщика истечения хостингов")
+
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        await self.load_schedule()
+
         while True:
-            await self.check_hosting_expiry()
-            await asyncio.sleep(1)
+            try:
+                delay = self.scheduler.seconds_until_next()
+                if delay is None or delay > 0:
+                    timeout = EXPIRY_MAX_SLEEP if delay is None else min(delay, EXPIRY_MAX_SLEEP)
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                    self._wakeup.clear()
+
+                await self.process_due_events()
+
+                # Сбросы состояния из слушателя (продления) пишем пачкой
+                if self.state.has_pending_writes():
+                    await asyncio.to_thread(self.state.flush)
+            except Exception as e:
+                print(f"❌ Ошибка планировщика хостингов: {e}")
+                await asyncio.sleep(5)
 
-hosting_manager = HostingManager()
\ No newline at end of file
+hosting_manager = HostingManager()
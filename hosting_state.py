@@ -0,0 +1,94 @@
+import threading
+from datetime import datetime
+
+class HostingStateStore:
+    """Состояние предупреждений и льготного периода хостинга.
+
+    Хранится в RTDB в узле hosting_state/<user_id> = {'warned_for': epoch, 'grace_end': epoch},
+    загружается лениво одним запросом и записывается пачками через multi-path update,
+    поэтому рестарт не требует сканирования пользователей и не дублирует уведомления.
+    """
+
+    def __init__(self, db):
+        self._db = db
+        self._warned_for = {}  # user_id -> epoch окончания хостинга, о котором уже предупредили
+        self._grace_end = {}   # user_id -> epoch окончания льготного периода
+        self._dirty = {}       # путь в RTDB -> значение
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Загрузить состояние из базы (один раз)"""
+        if self._loaded:
+            return
+        state = self._db.get_hosting_state()
+        with self._lock:
+            for user_id, user_state in state.items():
+                if not isinstance(user_state, dict):
+                    continue
+                if user_state.get('warned_for'):
+                    self._warned_for[str(user_id)] = user_state['warned_for']
+                if user_state.get('grace_end'):
+                    self._grace_end[str(user_id)] = user_state['grace_end']
+            self._loaded = True
+        print(f"✅ Состояние хостингов загружено: {len(self._warned_for)} предупреждений, "
+              f"{len(self._grace_end)} в льготном периоде")
+
+    def _set(self, user_id, field, value):
+        self._dirty[f'hosting_state/{user_id}/{field}'] = value
+
+    def is_notified(self, user_id, expiry_ts):
+        """Было ли предупреждение об окончании именно этого срока"""
+        return self._warned_for.get(str(user_id)) == expiry_ts
+
+    def mark_notified(self, user_id, expiry_ts):
+        user_id = str(user_id)
+        with self._lock:
+            self._warned_for[user_id] = expiry_ts
+            self._set(user_id, 'warned_for', expiry_ts)
+
+    def get_grace_end(self, user_id):
+        """Окончание льготного периода (datetime) или None"""
+        grace_end = self._grace_end.get(str(user_id))
+        return datetime.fromtimestamp(grace_end) if grace_end else None
+
+    def set_grace_end(self, user_id, grace_end):
+        user_id = str(user_id)
+        grace_end_ts = int(grace_end.timestamp())
+        with self._lock:
+            self._grace_end[user_id] = grace_end_ts
+            self._set(user_id, 'grace_end', grace_end_ts)
+
+    def clear_warning(self, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            if self._warned_for.pop(user_id, None) is not None:
+                self._set(user_id, 'warned_for', None)
+
+    def clear(self, user_id):
+        """Сбросить все состояние пользователя (продление или удаление хостинга)"""
+        user_id = str(user_id)
+        with self._lock:
+            if self._warned_for.pop(user_id, None) is not None:
+                self._set(user_id, 'warned_for', None)
+            if self._grace_end.pop(user_id, None) is not None:
+                self._set(user_id, 'grace_end', None)
+
+    def has_pending_writes(self):
+        return bool(self._dirty)
+
+    def flush(self):
+        """Записать накопленные изменения одним запросом"""
+        with self._lock:
+            if not self._dirty:
+                return 0
+            paths, self._dirty = self._dirty, {}
+        try:
+            self._db.update_paths(paths)
+        except Exception as e:
+            print(f"❌ Ошибка сохранения состояния хостингов: {e}")
+            with self._lock:
+                for path, value in paths.items():
+                    self._dirty.setdefault(path, value)
+            return 0
+        return len(paths)
@@ -297,6 +297,29 @@ def get_back_to_files_keyboard():
     builder.button(text="🔙 Назад к файлам", callback_data="back_to_files")
     return builder.as_markup()
 
+def get_logs_page_keyboard(cursor=None):
+    """Клавиатура листания логов"""
+    builder = InlineKeyboardBuilder()
+    if cursor is not None:
+        builder.button(text="⬅️ Раньше", callback_data=f"logs_page:{cursor}")
+    builder.button(text="🔄 Свежие", callback_data="logs_page:end")
+    builder.button(text="📡 Live", callback_data="logs_live")
+    builder.button(text="📥 Скачать логи", callback_data="logs_download")
+    builder.adjust(2)
+    return builder.as_markup()
+
+def get_live_tail_keyboard():
+    """Клавиатура live-режима логов"""
+    builder = InlineKeyboardBuilder()
+    builder.button(text="⏹️ Остановить live", callback_data="logs_live_stop")
+    return builder.as_markup()
+
+def get_package_job_keyboard(job_id):
+    """Клавиатура задачи установки/удаления библиотек"""
+    builder = InlineKeyboardBuilder()
+    builder.button(text="❌ Отменить", callback_data=f"pkg_cancel_{job_id}")
+    return builder.as_markup()
+
 def get_cancel_keyboard():
     """Клавиатура для отмены действий"""
     builder = InlineKeyboardBuilder()
@@ -11,6 +11,13 @@ import json
 from firebase_db import firebase_db
 from keyboards import get_libraries_main_keyboard, get_libraries_back_keyboard, get_back_to_files_keyboard
 from utils.script_runner import script_runner
+from utils.file_manifest import file_manifest
+from utils.venv_manager import venv_manager
+from utils.dependency_layers import dependency_layers, requirements_digest
+from utils.file_processing import file_processor
+from utils.package_jobs import package_jobs
+from utils.wheelhouse import wheelhouse, requirement_name
+from utils.notifier import notifier
 
 router = Router()
 
@@ -45,6 +52,7 @@ def save_libraries(user_id: int, libraries: list):
     lib_file = get_libraries_file(user_id)
     with open(lib_file, 'w', encoding='utf-8') as f:
         json.dump(libraries, f, ensure_ascii=False, indent=2)
+    file_manifest.update_file(user_id, "libraries.json")
 
 def add_library(user_id: int, library: str):
     """Добавить библиотеку"""
@@ -99,6 +107,110 @@ def has_active_hosting(user_id: int) -> bool:
             print(f"❌ Ошибка парсинга даты 2: {e2}")
             return False
 
+def get_user_python_version(user_id: int) -> str:
+    """Версия Python пользователя (окружение для pip выбирается по ней)"""
+    user_data = firebase_db.get_user(str(user_id)) or {}
+    return user_data.get('python_version', '3.9')
+
+async def run_user_pip(user_id: int, *args, python_version=None):
+    """Запустить pip в окружении пользователя (stderr объединен с stdout, своя группа процессов)"""
+    command = await venv_manager.pip_command(user_id, python_version or get_user_python_version(user_id), *args)
+    return await asyncio.create_subprocess_exec(
+        *command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        env=venv_manager.pip_env(),
+        start_new_session=True
+    )
+
+async def run_user_pip_install(job, user_id: int, names, *args, python_version=None):
+    """pip install в задаче: сначала только из wheelhouse, если там есть все пакеты, иначе с PyPI.
+
+    Возвращает код завершения pip."""
+    offline = wheelhouse.has_all(names)
+    process = await run_user_pip(
+        user_id, 'install', '--progress-bar', 'off', *wheelhouse.install_args(offline=offline), *args,
+        python_version=python_version
+    )
+    returncode = await job.follow(process)
+    if returncode != 0 and offline:
+        job.add_line("ℹ️ В локальном кэше не хватает пакетов - устанавливаю с PyPI")
+        process = await run_user_pip(
+            user_id, 'install', '--progress-bar', 'off', *wheelhouse.install_args(), *args,
+            python_version=python_version
+        )
+        returncode = await job.follow(process)
+    return returncode
+
+async def migrate_user_environment(user_id, python_version: str):
+    """Перенести библиотеки, установленные до отдельных окружений, в окружение пользователя.
+
+    requirements.txt подключается слоем (или ставится pip, если его нельзя кэшировать),
+    остальные библиотеки из libraries.json - pip. Пока перенос не завершен,
+    скрипт пользователя запускается в общем интерпретаторе."""
+    if notifier.bot is None:
+        return
+    req_file = os.path.join(get_user_folder(user_id), "requirements.txt")
+    
+    async def migrate(job):
+        covered = set()
+        if os.path.exists(req_file):
+            content = file_processor.get_requirements_content(user_id)
+            layer = await dependency_layers.attach(user_id, python_version, content, on_output=job.add_line)
+            if layer is None and await run_user_pip_install(
+                job, user_id, None, '-r', req_file, python_version=python_version
+            ) != 0:
+                raise RuntimeError("pip завершился с ошибкой - подробности в выводе выше")
+            covered = {requirement_name(lib_name) for lib_name in get_requirements_libraries(req_file)}
+        
+        libraries = [lib for lib in load_libraries(user_id) if requirement_name(lib) not in covered]
+        if libraries and await run_user_pip_install(
+            job, user_id, [requirement_name(lib) for lib in libraries], *libraries, python_version=python_version
+        ) != 0:
+            raise RuntimeError("pip завершился с ошибкой - подробности в выводе выше")
+        
+        venv_manager.mark_migrated(user_id, python_version)
+        return "✅ Библиотеки перенесены, при следующем запуске бот будет работать в своем окружении"
+    
+    await package_jobs.submit(
+        notifier.bot, int(user_id), int(user_id),
+        key=('migrate', python_version),
+        title=f"📦 <b>Перенос библиотек в отдельное окружение Python {python_version}</b>",
+        run=migrate
+    )
+
+venv_manager.add_migration_listener(migrate_user_environment)
+
+def get_uninstall_keyboard(user_id: int):
+    """Клавиатура выбора библиотеки для удаления"""
+    builder = InlineKeyboardBuilder()
+    for lib in load_libraries(user_id):
+        builder.button(text=f"🗑️ {lib}", callback_data=f"uninstall_{lib}")
+    builder.button(text="🔙 Назад", callback_data="libraries_back")
+    builder.adjust(1)
+    return builder.as_markup()
+
+def get_requirements_libraries(req_file: str) -> list:
+    """Имена библиотек из requirements.txt"""
+    libraries = []
+    with open(req_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                lib_name = line.split('==')[0].split('>=')[0].split('<=')[0].strip()
+                if lib_name:
+                    libraries.append(lib_name)
+    return libraries
+
+async def answer_job_submitted(callback: CallbackQuery, job, created: bool):
+    """Ответ на нажатие кнопки после постановки задачи в очередь"""
+    if job is None:
+        await callback.answer("❌ Слишком много задач в очереди, дождитесь их завершения", show_alert=True)
+    elif not created:
+        await callback.answer("⏳ Такая задача уже выполняется", show_alert=True)
+    else:
+        await callback.answer()
+
 def has_requirements_file(user_id: int) -> bool:
     """Проверить наличие requirements.txt"""
     requirements_path = os.path.join(get_user_folder(user_id), "requirements.txt")
@@ -237,27 +349,24 @@ async def process_install_library(message: Message, state: FSMContext):
         await message.answer("❌ Недопустимые символы в названии")
         return
     
-    # Установка
-    msg = await message.answer(f"🔄 Устанавливаю <b>{library_name}</b>...", parse_mode="HTML")
-    
-    try:
-        process = await asyncio.create_subprocess_exec(
-            'pip', 'install', library_name,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        
-        stdout, stderr = await process.communicate()
-        
-        if process.returncode == 0:
-            add_library(user_id, library_name)
-            await msg.edit_text(f"✅ Библиотека <b>{library_name}</b> установлена!", parse_mode="HTML")
-        else:
-            error = stderr.decode().strip()
-            await msg.edit_text(f"❌ Ошибка установки:\n<code>{error}</code>", parse_mode="HTML")
-            
-    except Exception as e:
-        await msg.edit_text(f"❌ Ошибка: {str(e)}")
+    async def install(job):
+        if await run_user_pip_install(job, user_id, [requirement_name(library_name)], library_name) != 0:
+            raise RuntimeError("pip завершился с ошибкой - подробности в выводе выше")
+        add_library(user_id, library_name)
+        return f"✅ Библиотека <b>{library_name}</b> установлена!"
+    
+    # Установка выполняется в общей очереди, вывод pip обновляется в одном сообщении
+    job, created = await package_jobs.submit(
+        message.bot, message.chat.id, user_id,
+        key=('install', library_name.lower()),
+        title=f"📥 <b>Установка {library_name}</b>",
+        run=install,
+        done_markup=get_libraries_back_keyboard()
+    )
+    if job is None:
+        await message.answer("❌ Слишком много задач в очереди, дождитесь их завершения")
+    elif not created:
+        await message.answer(f"⏳ Установка <b>{library_name}</b> уже выполняется", parse_mode="HTML")
     
     await state.clear()
 
@@ -281,46 +390,37 @@ async def install_requirements_handler(callback: CallbackQuery):
         await callback.answer("❌ Файл requirements.txt не найден", show_alert=True)
         return
     
-    await callback.message.edit_text("🔄 Устанавливаю библиотеки из requirements.txt...")
+    content = file_processor.get_requirements_content(user_id)
     
-    try:
-        process = await asyncio.create_subprocess_exec(
-            'pip', 'install', '-r', req_file,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
+    async def install(job):
+        # Одинаковые requirements.txt собираются один раз и подключаются готовым слоем
+        layer = await dependency_layers.attach(
+            user_id, get_user_python_version(user_id), content, on_output=job.add_line
         )
         
-        stdout, stderr = await process.communicate()
+        if layer is None:
+            # Файл с опциями pip или ссылками - только с локальными колесами в дополнение к PyPI
+            if await run_user_pip_install(job, user_id, None, '-r', req_file) != 0:
+                raise RuntimeError("pip завершился с ошибкой - подробности в выводе выше")
         
-        if process.returncode == 0:
-            # Добавляем библиотеки в список
-            with open(req_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    if line and not line.startswith('#'):
-                        lib_name = line.split('==')[0].split('>=')[0].split('<=')[0].strip()
-                        if lib_name:
-                            add_library(user_id, lib_name)
-            
-            await callback.message.edit_text(
-                "✅ Библиотеки из requirements.txt установлены!",
-                reply_markup=get_libraries_back_keyboard()
-            )
-        else:
-            error = stderr.decode().strip()
-            await callback.message.edit_text(
-                f"❌ Ошибка установки:\n<code>{error}</code>",
-                reply_markup=get_libraries_back_keyboard(),
-                parse_mode="HTML"
-            )
-            
-    except Exception as e:
-        await callback.message.edit_text(
-            f"❌ Ошибка: {str(e)}",
-            reply_markup=get_libraries_back_keyboard()
-        )
-    
-    await callback.answer()
+        # Добавляем библиотеки в список
+        for lib_name in get_requirements_libraries(req_file):
+            add_library(user_id, lib_name)
+        
+        text = "✅ Библиотеки из requirements.txt установлены!"
+        if layer and layer[1]:
+            text += "\n⚡ Готовый набор зависимостей взят из кэша"
+        return text
+    
+    job, created = await package_jobs.submit(
+        callback.bot, callback.message.chat.id, user_id,
+        key=('requirements', requirements_digest(content)),
+        title="📁 <b>Установка из requirements.txt</b>",
+        run=install,
+        message_id=callback.message.message_id,
+        done_markup=get_libraries_back_keyboard()
+    )
+    await answer_job_submitted(callback, job, created)
 
 @router.callback_query(F.data == "libraries_uninstall")
 async def uninstall_library_handler(callback: CallbackQuery):
@@ -345,17 +445,9 @@ async def uninstall_library_handler(callback: CallbackQuery):
         )
         return
     
-    builder = InlineKeyboardBuilder()
-    
-    for lib in libraries:
-        builder.button(text=f"🗑️ {lib}", callback_data=f"uninstall_{lib}")
-    
-    builder.button(text="🔙 Назад", callback_data="libraries_back")
-    builder.adjust(1)
-    
     await callback.message.edit_text(
         "🗑️ <b>Выберите библиотеку для удаления:</b>",
-        reply_markup=builder.as_markup(),
+        reply_markup=get_uninstall_keyboard(user_id),
         parse_mode="HTML"
     )
     await callback.answer()
@@ -375,48 +467,47 @@ async def process_uninstall_handler(callback: CallbackQuery):
         await callback.answer("❌ Нельзя удалять библиотеки пока скрипт запущен", show_alert=True)
         return
     
-    await callback.message.edit_text(f"🔄 Удаляю <b>{library_name}</b>...", parse_mode="HTML")
-    
-    try:
-        process = await asyncio.create_subprocess_exec(
-            'pip', 'uninstall', '-y', library_name,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        
-        stdout, stderr = await process.communicate()
+    async def uninstall(job):
+        # Пакеты из requirements.txt лежат в общем слое: pip uninstall в окружении
+        # их не удалит, и библиотека осталась бы доступна
+        name = requirement_name(library_name)
+        venv_path = await venv_manager.ensure(user_id, get_user_python_version(user_id))
+        if name and dependency_layers.provides(venv_path, name) and \
+                not dependency_layers.has_distribution(venv_manager.site_packages(venv_path), name):
+            return (
+                f"⚠️ Библиотека <b>{library_name}</b> установлена из requirements.txt\n\n"
+                "Уберите ее из requirements.txt, загрузите файлы заново и установите зависимости из requirements.txt"
+            )
         
-        if process.returncode == 0:
-            remove_library(user_id, library_name)
-            await callback.message.edit_text(f"✅ Библиотека <b>{library_name}</b> удалена!", parse_mode="HTML")
-        else:
-            error = stderr.decode().strip()
-            await callback.message.edit_text(f"❌ Ошибка удаления:\n<code>{error}</code>", parse_mode="HTML")
-            
-    except Exception as e:
-        await callback.message.edit_text(f"❌ Ошибка: {str(e)}")
+        process = await run_user_pip(user_id, 'uninstall', '-y', library_name)
+        if await job.follow(process) != 0:
+            raise RuntimeError("pip завершился с ошибкой - подробности в выводе выше")
+        remove_library(user_id, library_name)
+        # Возвращаем к списку библиотек
+        if load_libraries(user_id):
+            job.done_markup = get_uninstall_keyboard(user_id)
+            return f"✅ Библиотека <b>{library_name}</b> удалена!\n\n🗑️ <b>Выберите библиотеку для удаления:</b>"
+        return f"✅ Библиотека <b>{library_name}</b> удалена!\n\n📦 Больше нет установленных библиотек"
+    
+    job, created = await package_jobs.submit(
+        callback.bot, callback.message.chat.id, user_id,
+        key=('uninstall', library_name.lower()),
+        title=f"🗑️ <b>Удаление {library_name}</b>",
+        run=uninstall,
+        message_id=callback.message.message_id,
+        done_markup=get_libraries_back_keyboard()
+    )
+    await answer_job_submitted(callback, job, created)
+
+@router.callback_query(F.data.startswith("pkg_cancel_"))
+async def cancel_package_job_handler(callback: CallbackQuery):
+    """Отмена задачи установки/удаления библиотек"""
+    job_id = int(callback.data.replace("pkg_cancel_", ""))
     
-    # Возвращаем к списку библиотек
-    libraries = load_libraries(user_id)
-    if libraries:
-        builder = InlineKeyboardBuilder()
-        for lib in libraries:
-            builder.button(text=f"🗑️ {lib}", callback_data=f"uninstall_{lib}")
-        builder.button(text="🔙 Назад", callback_data="libraries_back")
-        builder.adjust(1)
-        
-        await callback.message.answer(
-            "🗑️ <b>Выберите библиотеку для удаления:</b>",
-            reply_markup=builder.as_markup(),
-            parse_mode="HTML"
-        )
+    if await package_jobs.cancel(job_id, callback.from_user.id):
+        await callback.answer("🚫 Задача отменена")
     else:
-        await callback.message.answer(
-            "📦 Больше нет установленных библиотек",
-            reply_markup=get_libraries_back_keyboard()
-        )
-    
-    await callback.answer()
+        await callback.answer("❌ Задача уже завершена", show_alert=True)
 
 @router.callback_query(F.data == "libraries_help")
 async def libraries_help_handler(callback: CallbackQuery):
@@ -0,0 +1,108 @@
+import asyncio
+import html
+import time
+from collections import deque
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from config import (
+    LIVE_TAIL_LINES, LIVE_TAIL_EDIT_INTERVAL, LIVE_TAIL_IDLE_TIMEOUT,
+    LIVE_TAIL_MAX_DURATION, LOG_MESSAGE_MAX_CHARS
+)
+from utils.script_runner import script_runner
+
+class LiveTailSession:
+    """Live-просмотр логов в одном сообщении Telegram"""
+
+    def __init__(self, bot, chat_id, message_id, user_id, reply_markup=None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.user_id = user_id
+        self.reply_markup = reply_markup
+        self.lines = deque(maxlen=LIVE_TAIL_LINES)
+        self.dirty = False
+        self.finished = False
+        self.started_at = time.monotonic()
+        self.last_line_at = self.started_at
+        self.task = None
+
+    def on_lines(self, lines, finished=False):
+        """Подписчик ScriptRunner: только складывает строки, редактирует сообщение задача"""
+        self.lines.extend(line.rstrip("\n") for line in lines)
+        self.dirty = True
+        self.last_line_at = time.monotonic()
+        if finished:
+            self.finished = True
+
+    def render(self, footer):
+        body = html.escape("\n".join(self.lines)) or "(ожидание вывода...)"
+        if len(body) > LOG_MESSAGE_MAX_CHARS:
+            body = body[-LOG_MESSAGE_MAX_CHARS:]
+            body = body[body.find("\n") + 1:]
+        return f"📡 <b>Live-логи</b>\n\n<pre>{body}</pre>\n\n{footer}"
+
+class LiveTailManager:
+    """Live-режим логов: одно сообщение на чат, правки не чаще раза в LIVE_TAIL_EDIT_INTERVAL"""
+
+    def __init__(self):
+        self._sessions = {}  # chat_id -> LiveTailSession
+
+    def is_active(self, chat_id):
+        return chat_id in self._sessions
+
+    def start(self, bot, chat_id, message_id, user_id, reply_markup=None):
+        self.stop(chat_id)
+        session = LiveTailSession(bot, chat_id, message_id, user_id, reply_markup)
+        self._sessions[chat_id] = session
+        script_runner.subscribe(user_id, session.on_lines)
+        session.task = asyncio.create_task(self._run(session))
+        return session
+
+    def stop(self, chat_id):
+        """Остановить live-режим в чате (итоговая правка сообщения выполнится в задаче)"""
+        session = self._sessions.get(chat_id)
+        if session:
+            session.finished = True
+            session.dirty = True
+
+    async def _edit(self, session, text, reply_markup=None):
+        try:
+            await session.bot.edit_message_text(
+                text,
+                chat_id=session.chat_id,
+                message_id=session.message_id,
+                reply_markup=reply_markup,
+                parse_mode="HTML"
+            )
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+        except TelegramBadRequest as e:
+            # "message is not modified" и удаленное сообщение - не ошибка
+            if "not modified" not in str(e):
+                session.finished = True
+
+    async def _run(self, session):
+        try:
+            while not session.finished:
+                await asyncio.sleep(LIVE_TAIL_EDIT_INTERVAL)
+                now = time.monotonic()
+
+                if now - session.last_line_at >= LIVE_TAIL_IDLE_TIMEOUT:
+                    break
+                if now - session.started_at >= LIVE_TAIL_MAX_DURATION:
+                    break
+                if not script_runner.is_script_running(session.user_id):
+                    break
+
+                if session.dirty:
+                    session.dirty = False
+                    await self._edit(session, session.render("🔴 Обновляется..."), session.reply_markup)
+
+            await self._edit(session, session.render("⏹️ Live-режим остановлен"))
+        except Exception as e:
+            print(f"❌ Ошибка live-логов для чата {session.chat_id}: {e}")
+        finally:
+            script_runner.unsubscribe(session.user_id, session.on_lines)
+            if self._sessions.get(session.chat_id) is session:
+                del self._sessions[session.chat_id]
+
+live_tail_manager = LiveTailManager()
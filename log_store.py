@@ -0,0 +1,474 @@
+import gzip
+import json
+import os
+import shutil
+import threading
+import time
+from config import (
+    LOG_SEGMENT_MAX_BYTES, LOG_SEGMENT_MAX_AGE, LOG_DEFAULT_QUOTA, LOG_ERROR_INDEX_MAX,
+    LOG_STATS_SAVE_INTERVAL, LOG_EXIT_HISTORY
+)
+from utils.plans import parse_size
+
+ERROR_MARKER = b"[ERROR]"
+SEVERITIES = ('info', 'warning', 'error')
+
+class UserLogStore:
+    """Логи скрипта одного пользователя с ротацией.
+
+    logs/user_<id>/script.log - текущий сегмент (обычный текст);
+    logs/user_<id>/segments/*.log.gz - закрытые сегменты, сжатые gzip;
+    logs/user_<id>/events.jsonl - структурная запись на каждую строку лога
+        {"t": время, "s": поток, "v": важность, "g": номер запуска, "o": смещение строки};
+    logs/user_<id>/index.json - временные диапазоны, размеры, смещения строк с ошибками
+        и счетчики по важности (stats), поэтому сводки не требуют чтения логов;
+    logs/user_<id>/stdout.capture, stderr.capture - сырой вывод процесса, который
+        ScriptRunner дочитывает в лог (позиции чтения хранятся в index.json).
+
+    Все сегменты образуют один сквозной поток байт: у каждого сегмента есть смещение
+    в этом потоке, поэтому курсор страницы остается верным после ротаций.
+    Сегмент закрывается по размеру (LOG_SEGMENT_MAX_BYTES) или возрасту
+    (LOG_SEGMENT_MAX_AGE), старые сегменты удаляются при превышении квоты тарифа.
+    Запись идет только между open()/resume() и close(): запись в закрытое хранилище
+    отбрасывается. Писатель передает номер своего запуска (generation), поэтому
+    запоздалые записи и close() прошлого запуска не трогают сегмент нового.
+    Все методы синхронные - вызывать через asyncio.to_thread.
+    """
+
+    def __init__(self, user_id, quota=None):
+        self.user_id = user_id
+        self.logs_dir = f"logs/user_{user_id}"
+        self.segments_dir = os.path.join(self.logs_dir, "segments")
+        self.active_path = os.path.join(self.logs_dir, "script.log")
+        self.index_path = os.path.join(self.logs_dir, "index.json")
+        self.events_path = os.path.join(self.logs_dir, "events.jsonl")
+        self.capture_paths = {
+            'stdout': os.path.join(self.logs_dir, "stdout.capture"),
+            'stderr': os.path.join(self.logs_dir, "stderr.capture")
+        }
+        self.quota = parse_size(quota or LOG_DEFAULT_QUOTA)
+        self._lock = threading.RLock()
+        self._file = None
+        self._events_file = None
+        self._active_size = 0
+        self._stats_saved_at = 0.0
+        self._active_errors = None  # смещения строк [ERROR] в текущем сегменте (None - еще не считаны)
+        self._segment_cache = (None, b"")
+        self._index = self._load_index()
+
+    # ===== ИНДЕКС =====
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            index = {}
+        index.setdefault('segments', [])
+        index.setdefault('active_start', None)
+        index.setdefault('active_offset', 0)
+        index.setdefault('capture', {})
+        stats = index.setdefault('stats', {})
+        stats.setdefault('generation', 0)
+        stats.setdefault('lines', {severity: 0 for severity in SEVERITIES})
+        stats.setdefault('generation_errors', 0)
+        stats.setdefault('last_error', None)
+        stats.setdefault('exits', [])
+        stats.setdefault('limits', {'oom': 0, 'throttled': 0})
+        return index
+
+    def _save_index(self):
+        self._stats_saved_at = time.time()
+        os.makedirs(self.logs_dir, exist_ok=True)
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self.index_path)
+
+    @property
+    def generation(self):
+        """Номер текущего запуска"""
+        with self._lock:
+            return self._index['stats']['generation']
+
+    def get_segments(self):
+        """Закрытые сегменты: [{'file', 'start', 'end', 'size', 'stored', 'offset', ...}, ...] от старых к новым"""
+        with self._lock:
+            return list(self._index['segments'])
+
+    # ===== ЗАПИСЬ =====
+
+    def open(self):
+        """Начать новый запуск: старый текущий сегмент уходит в архив. Возвращает номер запуска"""
+        with self._lock:
+            self.close()
+            if os.path.exists(self.active_path) and os.path.getsize(self.active_path) > 0:
+                self._rotate_file()
+            stats = self._index['stats']
+            stats['generation'] += 1
+            stats['generation_errors'] = 0
+            self._index['capture'] = {}
+            self._start_active()
+            self._save_index()
+            return stats['generation']
+
+    def resume(self):
+        """Продолжить текущий запуск после рестарта бота (без ротации и нового номера запуска).
+
+        Возвращает сохраненные позиции чтения capture-файлов {'stdout': n, 'stderr': n}"""
+        with self._lock:
+            self.close()
+            os.makedirs(self.logs_dir, exist_ok=True)
+            self._file = open(self.active_path, 'ab')
+            self._events_file = open(self.events_path, 'ab')
+            self._active_size = self._file.tell()
+            self._active_errors = None
+            self._load_active_errors()
+            if self._index['active_start'] is None:
+                self._index['active_start'] = int(time.time())
+            return dict(self._index['capture'])
+
+    def _start_active(self):
+        os.makedirs(self.logs_dir, exist_ok=True)
+        self._file = open(self.active_path, 'ab')
+        self._events_file = open(self.events_path, 'ab')
+        self._active_size = 0
+        self._active_errors = []
+        self._index['active_start'] = int(time.time())
+
+    def write(self, data: bytes, records=(), capture_offsets=None, generation=None):
+        """Дописать данные в текущий сегмент.
+
+        records - [(смещение строки внутри data, время, поток, важность, текст), ...]
+        для структурного лога, индекса ошибок и счетчиков;
+        capture_offsets - до каких позиций capture-файлов дочитан вывод (для resume);
+        generation - номер запуска писателя: записи чужого запуска и записи после
+        close() отбрасываются (новый сегмент открывает только open())."""
+        with self._lock:
+            if self._file is None or not self._is_current(generation):
+                return
+            base = self._active_size
+            virtual_base = self._index['active_offset'] + base
+            self._file.write(data)
+            self._file.flush()
+            self._active_size += len(data)
+            if capture_offsets:
+                self._index['capture'].update(capture_offsets)
+
+            if records:
+                stats = self._index['stats']
+                generation = stats['generation']
+                events = []
+                for position, timestamp, stream_name, severity, text in records:
+                    stats['lines'][severity] = stats['lines'].get(severity, 0) + 1
+                    if severity == 'error':
+                        self._active_errors.append(base + position)
+                        stats['generation_errors'] += 1
+                        stats['last_error'] = {'t': timestamp, 'g': generation, 'text': text[:300]}
+                    events.append(json.dumps(
+                        {'t': round(timestamp, 3), 's': stream_name, 'v': severity, 'g': generation,
+                         'o': virtual_base + position},
+                        separators=(',', ':')
+                    ))
+                self._events_file.write(("\n".join(events) + "\n").encode('utf-8'))
+                self._events_file.flush()
+                if time.time() - self._stats_saved_at >= LOG_STATS_SAVE_INTERVAL:
+                    self._save_index()
+
+            active_start = self._index['active_start'] or int(time.time())
+            if self._active_size >= LOG_SEGMENT_MAX_BYTES or time.time() - active_start >= LOG_SEGMENT_MAX_AGE:
+                self.close()
+                self._rotate_file()
+                self._start_active()
+                self._save_index()
+
+    def record_exit(self, code, generation=None):
+        """Запомнить завершение процесса (для сводки падающих ботов)"""
+        with self._lock:
+            stats = self._index['stats']
+            if generation is None:
+                generation = stats['generation']
+            stats['exits'] = (stats['exits'] + [{'t': int(time.time()), 'code': code, 'g': generation}])[-LOG_EXIT_HISTORY:]
+            self._save_index()
+
+    def record_limit(self, kind):
+        """Учесть событие лимита ресурсов: oom или throttled"""
+        with self._lock:
+            limits = self._index['stats']['limits']
+            limits[kind] = limits.get(kind, 0) + 1
+            self._save_index()
+
+    def get_stats(self):
+        """Счетчики строк по важности, последняя ошибка, история завершений и события лимитов"""
+        with self._lock:
+            return json.loads(json.dumps(self._index['stats']))
+
+    def _is_current(self, generation):
+        return generation is None or generation == self._index['stats']['generation']
+
+    def close(self, generation=None):
+        """Закрыть текущий сегмент (generation - только если это все еще тот запуск)"""
+        with self._lock:
+            if not self._is_current(generation):
+                return
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if self._events_file is not None:
+                self._events_file.close()
+                self._events_file = None
+                self._save_index()
+
+    def _rotate_file(self):
+        """Сжать текущий сегмент в segments/, запомнить строки с ошибками и применить квоту"""
+        start = self._index['active_start'] or int(os.path.getmtime(self.active_path))
+        end = int(time.time())
+        os.makedirs(self.segments_dir, exist_ok=True)
+
+        name = f"{start}-{end}-{time.time_ns() % 1000000}.log.gz"
+        segment_path = os.path.join(self.segments_dir, name)
+        errors = []
+        error_count = 0
+        size = 0
+        with open(self.active_path, 'rb') as src, gzip.open(segment_path, 'wb', compresslevel=6) as dst:
+            for line in src:
+                if ERROR_MARKER in line:
+                    error_count += 1
+                    errors.append(size)
+                dst.write(line)
+                size += len(line)
+        os.remove(self.active_path)
+
+        events_name = None
+        stored = os.path.getsize(segment_path)
+        if os.path.exists(self.events_path):
+            events_name = name.replace('.log.gz', '.events.jsonl.gz')
+            events_path = os.path.join(self.segments_dir, events_name)
+            with open(self.events_path, 'rb') as src, gzip.open(events_path, 'wb', compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(self.events_path)
+            stored += os.path.getsize(events_path)
+
+        self._index['segments'].append({
+            'file': name,
+            'start': start,
+            'end': end,
+            'size': size,
+            'stored': stored,
+            'offset': self._index['active_offset'],
+            'events': events_name,
+            'errors': errors[-LOG_ERROR_INDEX_MAX:],
+            'error_count': error_count
+        })
+        self._index['active_offset'] += size
+        self._index['active_start'] = None
+        self._active_size = 0
+        self._active_errors = []
+        self._enforce_quota()
+        self._save_index()
+
+    def _enforce_quota(self):
+        segments = self._index['segments']
+        used = sum(segment['stored'] for segment in segments) + self._active_size
+        while segments and used > self.quota:
+            oldest = segments.pop(0)
+            used -= oldest['stored']
+            for name in (oldest['file'], oldest.get('events')):
+                if not name:
+                    continue
+                try:
+                    os.remove(os.path.join(self.segments_dir, name))
+                except FileNotFoundError:
+                    pass
+
+    # ===== ЧТЕНИЕ =====
+
+    def _active_length(self):
+        if self._file is not None:
+            return self._active_size
+        try:
+            return os.path.getsize(self.active_path)
+        except FileNotFoundError:
+            return 0
+
+    def _read_segment(self, segment):
+        """Распакованный сегмент (последний прочитанный кэшируется для листания)"""
+        cached_name, cached_data = self._segment_cache
+        if cached_name == segment['file']:
+            return cached_data
+        try:
+            with gzip.open(os.path.join(self.segments_dir, segment['file']), 'rb') as f:
+                data = f.read()
+        except (FileNotFoundError, OSError):
+            data = b""
+        self._segment_cache = (segment['file'], data)
+        return data
+
+    def bounds(self):
+        """Начало и конец доступного потока логов (сквозные смещения)"""
+        with self._lock:
+            segments = self._index['segments']
+            first = segments[0]['offset'] if segments else self._index['active_offset']
+            return first, self._index['active_offset'] + self._active_length()
+
+    def _read_between(self, start, end):
+        """Байты сквозного потока в диапазоне [start, end)"""
+        chunks = []
+        for segment in self._index['segments']:
+            seg_start = segment['offset']
+            seg_end = seg_start + segment['size']
+            if seg_end > start and seg_start < end:
+                data = self._read_segment(segment)
+                chunks.append(data[max(0, start - seg_start):end - seg_start])
+
+        active_offset = self._index['active_offset']
+        if end > active_offset and os.path.exists(self.active_path):
+            with open(self.active_path, 'rb') as f:
+                f.seek(max(0, start - active_offset))
+                chunks.append(f.read(end - max(start, active_offset)))
+        return b"".join(chunks)
+
+    def read_before(self, cursor=None, max_bytes=4096):
+        """Страница логов, заканчивающаяся на cursor (None - самые свежие).
+
+        Возвращает (текст, курсор следующей, более старой страницы или None)."""
+        with self._lock:
+            first, end = self.bounds()
+            if cursor is None or cursor > end:
+                cursor = end
+            start = max(first, cursor - max_bytes)
+            data = self._read_between(start, cursor)
+
+        if start > first:
+            # Первая строка страницы может быть неполной - она попадет в следующую страницу
+            cut = data.find(b"\n") + 1
+            if 0 < cut < len(data):
+                data = data[cut:]
+                start += cut
+        return data.decode('utf-8', errors='ignore'), (start if start > first else None)
+
+    def read_tail(self, max_bytes):
+        """Последние max_bytes логов (текущий сегмент и при необходимости архив)"""
+        text, _ = self.read_before(None, max_bytes)
+        return text
+
+    def read_tail_lines(self, lines, max_bytes):
+        """Последние lines строк: читаем с конца блоками, пока не наберется нужное количество"""
+        with self._lock:
+            first, end = self.bounds()
+            block = 4096
+            start = end
+            data = b""
+            while start > first and data.count(b"\n") <= lines and end - start < max_bytes:
+                new_start = max(first, start - block, end - max_bytes)
+                data = self._read_between(new_start, start) + data
+                start = new_start
+                block *= 2
+
+        stripped = data.rstrip(b"\n")
+        tail = b"\n".join(stripped.split(b"\n")[-lines:])
+        # Следующая страница заканчивается там, где начинается показанный хвост
+        cursor = start + len(stripped) - len(tail)
+        return tail.decode('utf-8', errors='ignore'), (cursor if cursor > first else None)
+
+    def _load_active_errors(self):
+        if self._active_errors is None:
+            self._active_errors = []
+            if os.path.exists(self.active_path):
+                position = 0
+                with open(self.active_path, 'rb') as f:
+                    for line in f:
+                        if ERROR_MARKER in line:
+                            self._active_errors.append(position)
+                        position += len(line)
+        return self._active_errors
+
+    def error_count(self):
+        """Количество строк с ошибками в хранимых логах (без чтения файлов)"""
+        with self._lock:
+            active = len(self._load_active_errors())
+            return active + sum(segment.get('error_count', 0) for segment in self._index['segments'])
+
+    def read_errors(self, limit):
+        """Последние limit строк с ошибками - по индексу смещений, без сканирования логов"""
+        found = []
+        with self._lock:
+            active_errors = self._load_active_errors()
+            if active_errors and os.path.exists(self.active_path):
+                with open(self.active_path, 'rb') as f:
+                    for position in reversed(active_errors[-limit:]):
+                        f.seek(position)
+                        found.append(f.readline())
+
+            for segment in reversed(self._index['segments']):
+                if len(found) >= limit:
+                    break
+                offsets = segment.get('errors') or []
+                if not offsets:
+                    continue
+                data = self._read_segment(segment)
+                for position in reversed(offsets[-(limit - len(found)):]):
+                    line_end = data.find(b"\n", position)
+                    found.append(data[position:line_end if line_end != -1 else len(data)])
+
+        return [line.decode('utf-8', errors='ignore').rstrip("\n") for line in reversed(found)]
+
+    def read_range(self, start_ts, end_ts, max_bytes):
+        """Логи сегментов, пересекающихся с интервалом [start_ts, end_ts]"""
+        with self._lock:
+            chunks = []
+            for segment in self._index['segments']:
+                if segment['end'] >= start_ts and segment['start'] <= end_ts:
+                    chunks.append(self._read_segment(segment))
+            active_start = self._index['active_start']
+            if active_start is not None and active_start <= end_ts and os.path.exists(self.active_path):
+                with open(self.active_path, 'rb') as f:
+                    chunks.append(f.read())
+
+        data = b"".join(chunks)
+        if len(data) > max_bytes:
+            data = data[-max_bytes:]
+            data = data[data.find(b"\n") + 1:]
+        return data.decode('utf-8', errors='ignore')
+
+    def total_size(self):
+        """Место на диске, занятое логами пользователя"""
+        with self._lock:
+            events = os.path.getsize(self.events_path) if os.path.exists(self.events_path) else 0
+            return self._active_length() + events + sum(segment['stored'] for segment in self._index['segments'])
+
+    def has_logs(self):
+        with self._lock:
+            return self._active_length() > 0 or bool(self._index['segments'])
+
+class LogManager:
+    """Реестр хранилищ логов пользователей"""
+
+    def __init__(self):
+        self._stores = {}
+        self._lock = threading.Lock()
+
+    def get_store(self, user_id, quota=None) -> UserLogStore:
+        with self._lock:
+            store = self._stores.get(user_id)
+            if store is None:
+                store = UserLogStore(user_id, quota)
+                self._stores[user_id] = store
+            elif quota:
+                store.quota = parse_size(quota)
+            return store
+
+    def get_all_stats(self, logs_root="logs"):
+        """Сводки всех пользователей с логами: {user_id: stats} (только index.json, без чтения логов)"""
+        result = {}
+        if not os.path.isdir(logs_root):
+            return result
+        for name in os.listdir(logs_root):
+            if not name.startswith("user_"):
+                continue
+            user_id = name[len("user_"):]
+            user_id = int(user_id) if user_id.isdigit() else user_id
+            result[user_id] = self.get_store(user_id).get_stats()
+        return result
+
+log_manager = LogManager()
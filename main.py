@@ -1,6 +1,12 @@
+import time
+STARTED_AT = time.perf_counter()  # до импортов: холодный старт считаем с начала процесса
+
 import asyncio
+import hashlib
+import importlib
 import logging
 import os
+import sys
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
@@ -10,17 +16,22 @@ from aiogram.types import Message
 from typing import Callable, Dict, Any, Awaitable
 import subprocess
 
-from config import BOT_TOKEN, BOT_TEMPLATES  # Добавьте импорт BOT_TEMPLATES
-from handlers.start import router as start_router
-from handlers.profile import router as profile_router
-from handlers.hosting import router as hosting_router
-from handlers.files import router as files_router
-from handlers.admin import router as admin_router
-from handlers.payment import router as payment_router
-from handlers.libraries import router as libraries_router
-from handlers.promo import router as promo_router
-from handlers.templates import router as templates_router
-from utils.hosting_manager import hosting_manager
+from config import BOT_TOKEN, BOT_TEMPLATES, REQUIREMENTS_STAMP_PATH
+from firebase_db import firebase_db, async_firebase_db
+
+# Роутеры в порядке подключения. Модули импортируются в main с замером времени,
+# параллельно с подключением к Firebase
+ROUTER_MODULES = [
+    'handlers.start',
+    'handlers.profile',
+    'handlers.hosting',
+    'handlers.files',
+    'handlers.libraries',
+    'handlers.payment',
+    'handlers.promo',
+    'handlers.admin',
+    'handlers.templates',
+]
 
 logging.basicConfig(
     level=logging.INFO, 
@@ -33,23 +44,50 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-# ДОБАВЬТЕ ЭТУ ПРОВЕРКУ ПЕРЕД ОСНОВНОЙ ФУНКЦИЕЙ
-print("=" * 50)
-print("🔍 ПРОВЕРКА ШАБЛОНОВ ПРИ ЗАПУСКЕ")
-print("=" * 50)
-print(f"Доступные шаблоны: {list(BOT_TEMPLATES.keys())}")
-for key, value in BOT_TEMPLATES.items():
-    print(f"Шаблон '{key}': {value['name']}")
-    
-    # Проверяем существование папки
-    template_folder = f"templates/{key}"
-    exists = os.path.exists(template_folder)
-    print(f"  Папка {template_folder}: {'✅ СУЩЕСТВУЕТ' if exists else '❌ НЕ СУЩЕСТВУЕТ'}")
-    
-    if exists:
-        files = os.listdir(template_folder)
-        print(f"  Файлы: {files}")
-print("=" * 50)
+# Ссылки на фоновые задачи: event loop хранит только слабые ссылки,
+# и задача без ссылки может быть собрана сборщиком мусора до завершения
+_background_tasks = set()
+
+def start_background(coro):
+    """Запустить фоновую задачу, сохранив ссылку на нее до завершения"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+def log_phase(name):
+    """Записать в лог время от запуска процесса до фазы"""
+    logger.info(f"⏱️ {name}: {time.perf_counter() - STARTED_AT:.2f} сек от запуска")
+
+def import_routers():
+    """Импортировать модули роутеров. Возвращает (роутеры, [(модуль, секунд), ...])"""
+    routers = []
+    timings = []
+    for module_name in ROUTER_MODULES:
+        started = time.perf_counter()
+        module = importlib.import_module(module_name)
+        timings.append((module_name, time.perf_counter() - started))
+        routers.append(module.router)
+    return routers, timings
+
+def check_templates():
+    """Проверка папок шаблонов (вызывается из main, а не при импорте)"""
+    print("=" * 50)
+    print("🔍 ПРОВЕРКА ШАБЛОНОВ ПРИ ЗАПУСКЕ")
+    print("=" * 50)
+    print(f"Доступные шаблоны: {list(BOT_TEMPLATES.keys())}")
+    for key, value in BOT_TEMPLATES.items():
+        print(f"Шаблон '{key}': {value['name']}")
+        
+        # Проверяем существование папки
+        template_folder = f"templates/{key}"
+        exists = os.path.exists(template_folder)
+        print(f"  Папка {template_folder}: {'✅ СУЩЕСТВУЕТ' if exists else '❌ НЕ СУЩЕСТВУЕТ'}")
+        
+        if exists:
+            files = os.listdir(template_folder)
+            print(f"  Файлы: {files}")
+    print("=" * 50)
 
 class CommandMiddleware(BaseMiddleware):
     async def __call__(
@@ -76,20 +114,57 @@ def create_directories():
         os.makedirs(directory, exist_ok=True)
         logger.info(f"✅ Создана директория: {directory}")
 
+def get_requirements_stamp(content: bytes) -> str:
+    """Хэш requirements.txt вместе с версией и путем интерпретатора"""
+    digest = hashlib.sha256(content)
+    digest.update(f"\n{sys.version}\n{sys.executable}".encode('utf-8'))
+    return digest.hexdigest()
+
+def read_requirements_stamp() -> str:
+    try:
+        with open(REQUIREMENTS_STAMP_PATH, 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
 async def install_requirements():
-    """Установка библиотек из requirements.txt при запуске"""
+    """Установка библиотек из requirements.txt (пропускается, если файл и интерпретатор не менялись)"""
+    from utils.wheelhouse import wheelhouse, requirement_name
     try:
         if os.path.exists('requirements.txt'):
-            logger.info("📦 Обнаружен requirements.txt, устанавливаю библиотеки...")
-            process = await asyncio.create_subprocess_exec(
-                'pip', 'install', '-r', 'requirements.txt',
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
+            with open('requirements.txt', 'rb') as f:
+                content = f.read()
+            stamp = get_requirements_stamp(content)
+            if stamp == read_requirements_stamp():
+                logger.info("✅ requirements.txt не изменился - установка библиотек пропущена")
+                return
             
-            stdout, stderr = await process.communicate()
+            logger.info("📦 requirements.txt изменился, устанавливаю библиотеки в фоне...")
+            names = [
+                requirement_name(line) for line in content.decode('utf-8', errors='ignore').splitlines()
+                if line.strip() and not line.strip().startswith('#')
+            ]
+            
+            # Сначала только из локального wheelhouse, при промахе - с PyPI
+            attempts = [wheelhouse.install_args()]
+            if wheelhouse.has_all(names):
+                attempts.insert(0, wheelhouse.install_args(offline=True))
+            
+            for wheelhouse_args in attempts:
+                process = await asyncio.create_subprocess_exec(
+                    sys.executable, '-m', 'pip', 'install', *wheelhouse_args, '-r', 'requirements.txt',
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE
+                )
+                
+                stdout, stderr = await process.communicate()
+                if process.returncode == 0:
+                    break
             
             if process.returncode == 0:
+                os.makedirs(os.path.dirname(REQUIREMENTS_STAMP_PATH) or '.', exist_ok=True)
+                with open(REQUIREMENTS_STAMP_PATH, 'w', encoding='utf-8') as f:
+                    f.write(stamp)
                 logger.info("✅ Все библиотеки из requirements.txt успешно установлены")
             else:
                 error = stderr.decode().strip()
@@ -99,11 +174,46 @@ async def install_requirements():
     except Exception as e:
         logger.error(f"❌ Ошибка при установке библиотек: {e}")
 
-async def main():
-    create_directories()
+async def warm_up():
+    """Фаза прогрева после начала опроса: то, без чего бот уже может отвечать"""
+    from utils.file_manifest import file_manifest
     
-    # Устанавливаем библиотеки при запуске
+    # Манифесты папок, выложенных до их появления, строим заранее в пуле потоков -
+    # иначе первый хендлер получил бы упрощенный список и ждал фонового построения
+    try:
+        await asyncio.to_thread(file_manifest.rebuild_missing)
+    except Exception as e:
+        logger.error(f"❌ Ошибка построения манифестов файлов: {e}")
+    # Библиотеки хоста ставятся в фоне и не задерживают запуск
     await install_requirements()
+    log_phase("Полностью прогрет")
+
+async def on_startup():
+    """Бот начинает опрос: отчет о холодном старте, прогрев в фоне"""
+    log_phase("Готов к опросу (холодный старт)")
+    start_background(warm_up())
+
+async def main():
+    log_phase("Импорт main")
+    
+    # Независимая инициализация параллельно: ключ Firebase, директории, шаблоны, импорт роутеров
+    _, _, _, (routers, import_timings) = await asyncio.gather(
+        asyncio.to_thread(firebase_db.initialize),
+        asyncio.to_thread(create_directories),
+        asyncio.to_thread(check_templates),
+        asyncio.to_thread(import_routers)
+    )
+    for module_name, elapsed in sorted(import_timings, key=lambda item: item[1], reverse=True):
+        logger.info(f"📥 Импорт {module_name}: {elapsed * 1000:.0f} мс")
+    log_phase("Инициализация и импорт модулей")
+    
+    # Уже импортированы роутерами
+    from utils.hosting_manager import hosting_manager
+    from utils.script_runner import script_runner
+    from utils.notifier import notifier
+    from utils.deployer import deployer
+    from utils.supervisor import supervisor
+    from utils.dependency_layers import dependency_layers
     
     storage = MemoryStorage()
     bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
@@ -112,23 +222,22 @@ async def main():
     # ДОБАВЛЯЕМ MIDDLEWARE ПЕРВЫМ
     dp.message.middleware(CommandMiddleware())
     
-    routers = [
-        start_router,
-        profile_router, 
-        hosting_router,
-        files_router,
-        libraries_router,
-        payment_router,
-        promo_router,
-        admin_router,
-        templates_router,
-    ]
-    
     for router in routers:
         dp.include_router(router)
         logger.info(f"✅ Router {router.name} loaded")
+    
+    dp.startup.register(on_startup)
 
-    asyncio.create_task(hosting_manager.start_expiry_checker())
+    notifier.start(bot)
+    start_background(hosting_manager.start_expiry_checker())
+    start_background(deployer.start_reaper())
+    start_background(dependency_layers.start_gc())
+    start_background(script_runner.resource_monitor.start_sampler())
+    start_background(script_runner.start_limits_watchdog())
+    # До начала опроса: иначе запуск скрипта пользователем мог бы обогнать переподключение
+    await supervisor.recover()
+    start_background(async_firebase_db.start_flusher())
+    log_phase("Восстановление скриптов")
 
     logger.info("🤖 Бот запускается...")
     logger.info("✅ Все системы готовы к работе!")
@@ -0,0 +1,222 @@
+import asyncio
+import random
+import time
+from collections import deque
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError, TelegramServerError
+from config import (
+    NOTIFY_WORKERS, NOTIFY_GLOBAL_RATE, NOTIFY_CHAT_RATE, NOTIFY_CHAT_BURST,
+    NOTIFY_MAX_RETRIES, NOTIFY_DEDUP_TTL
+)
+
+class TokenBucket:
+    """Простой token bucket: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now=None):
+        """Сколько ждать до появления токена (0 - можно отправлять сейчас)"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now=None):
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        self.tokens -= 1
+
+class NotificationJob:
+    __slots__ = ('method', 'chat_id', 'kwargs', 'dedup_key', 'attempt')
+
+    def __init__(self, method, chat_id, kwargs, dedup_key=None):
+        self.method = method
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.dedup_key = dedup_key
+        self.attempt = 0
+
+class NotificationDispatcher:
+    """Очередь исходящих сообщений Telegram.
+
+    Хендлеры ставят сообщение в очередь и сразу возвращаются; воркеры отправляют
+    с ограничением скорости (глобально и на чат), повторяют при RetryAfter/сетевых
+    ошибках с экспоненциальной задержкой и отбрасывают дубликаты по ключу.
+    """
+
+    def __init__(self, workers=NOTIFY_WORKERS, global_rate=NOTIFY_GLOBAL_RATE,
+                 chat_rate=NOTIFY_CHAT_RATE, chat_burst=NOTIFY_CHAT_BURST,
+                 max_retries=NOTIFY_MAX_RETRIES, dedup_ttl=NOTIFY_DEDUP_TTL):
+        self.bot = None
+        self.workers = workers
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.dedup_ttl = dedup_ttl
+        self._queue = None
+        self._pending = deque()  # задания, поставленные до запуска
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = {}
+        self._paused_until = 0.0
+        self._dedup = {}
+        self._delayed = 0
+        self._tasks = []
+        self._sent_times = deque(maxlen=5000)
+        self.metrics = {
+            'enqueued': 0,
+            'sent': 0,
+            'failed': 0,
+            'retried': 0,
+            'deduplicated': 0,
+            'rate_limited': 0
+        }
+
+    def start(self, bot):
+        """Запустить воркеры (вызывается из main после создания Bot)"""
+        self.bot = bot
+        self._queue = asyncio.Queue()
+        while self._pending:
+            self._queue.put_nowait(self._pending.popleft())
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        print(f"📨 Диспетчер уведомлений запущен ({self.workers} воркеров)")
+
+    # ===== ПОСТАНОВКА В ОЧЕРЕДЬ =====
+
+    def _is_duplicate(self, dedup_key):
+        if not dedup_key:
+            return False
+        now = time.monotonic()
+        if len(self._dedup) > 10000:
+            self._dedup = {key: expires for key, expires in self._dedup.items() if expires > now}
+        expires = self._dedup.get(dedup_key)
+        if expires and expires > now:
+            return True
+        self._dedup[dedup_key] = now + self.dedup_ttl
+        return False
+
+    def _put(self, job):
+        if self._queue is None:
+            self._pending.append(job)
+        else:
+            self._queue.put_nowait(job)
+
+    def enqueue(self, method, chat_id, dedup_key=None, **kwargs):
+        """Поставить вызов Bot.<method>(chat_id, **kwargs) в очередь. False - дубликат"""
+        if self._is_duplicate(dedup_key):
+            self.metrics['deduplicated'] += 1
+            return False
+        self.metrics['enqueued'] += 1
+        self._put(NotificationJob(method, chat_id, kwargs, dedup_key))
+        return True
+
+    def send_message(self, chat_id, text, dedup_key=None, **kwargs):
+        return self.enqueue('send_message', chat_id, dedup_key=dedup_key, text=text, **kwargs)
+
+    def send_photo(self, chat_id, photo, dedup_key=None, **kwargs):
+        return self.enqueue('send_photo', chat_id, dedup_key=dedup_key, photo=photo, **kwargs)
+
+    # ===== ОТПРАВКА =====
+
+    def _requeue_later(self, job, delay):
+        self._delayed += 1
+
+        def put_back():
+            self._delayed -= 1
+            self._put(job)
+
+        asyncio.get_running_loop().call_later(delay, put_back)
+
+    def _chat_bucket(self, chat_id):
+        chat_id = str(chat_id)
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                self._chat_buckets.clear()
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._process(job)
+            except Exception as e:
+                self.metrics['failed'] += 1
+                print(f"❌ Ошибка диспетчера уведомлений: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, job):
+        now = time.monotonic()
+
+        # Flood control от Telegram - ждем всеми воркерами
+        if self._paused_until > now:
+            await asyncio.sleep(self._paused_until - now)
+            now = time.monotonic()
+
+        # Лимит на чат: не блокируем воркер, а откладываем задание
+        chat_bucket = self._chat_bucket(job.chat_id)
+        chat_delay = chat_bucket.delay(now)
+        if chat_delay > 0:
+            self.metrics['rate_limited'] += 1
+            self._requeue_later(job, chat_delay)
+            return
+
+        global_delay = self._global_bucket.delay(now)
+        while global_delay > 0:
+            await asyncio.sleep(global_delay)
+            global_delay = self._global_bucket.delay()
+
+        self._global_bucket.consume()
+        chat_bucket.consume()
+
+        try:
+            await getattr(self.bot, job.method)(job.chat_id, **job.kwargs)
+            self.metrics['sent'] += 1
+            self._sent_times.append(time.monotonic())
+        except TelegramRetryAfter as e:
+            self._paused_until = time.monotonic() + e.retry_after
+            self._retry(job, e.retry_after)
+        except (TelegramNetworkError, TelegramServerError):
+            self._retry(job, min(60, 2 ** job.attempt) + random.random())
+        except Exception as e:
+            self.metrics['failed'] += 1
+            print(f"❌ Не удалось отправить уведомление в чат {job.chat_id}: {e}")
+
+    def _retry(self, job, delay):
+        job.attempt += 1
+        if job.attempt > self.max_retries:
+            self.metrics['failed'] += 1
+            print(f"❌ Уведомление в чат {job.chat_id} отброшено после {self.max_retries} попыток")
+            return
+        self.metrics['retried'] += 1
+        self._requeue_later(job, delay)
+
+    # ===== МЕТРИКИ =====
+
+    def queue_depth(self):
+        queued = self._queue.qsize() if self._queue else len(self._pending)
+        return queued + self._delayed
+
+    def get_metrics(self):
+        """Счетчики, глубина очереди и пропускная способность за последнюю минуту"""
+        now = time.monotonic()
+        while self._sent_times and self._sent_times[0] < now - 60:
+            self._sent_times.popleft()
+        return {
+            **self.metrics,
+            'queue_depth': self.queue_depth(),
+            'sent_last_minute': len(self._sent_times),
+            'throughput_per_sec': len(self._sent_times) / 60
+        }
+
+notifier = NotificationDispatcher()
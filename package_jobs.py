@@ -0,0 +1,248 @@
+import asyncio
+import html
+import itertools
+import os
+import signal
+import time
+from collections import deque
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from config import (
+    PACKAGE_JOB_WORKERS, PACKAGE_JOB_MAX_QUEUED, PACKAGE_JOB_TIMEOUT,
+    PACKAGE_JOB_OUTPUT_LINES, PACKAGE_JOB_EDIT_INTERVAL, LOG_MESSAGE_MAX_CHARS
+)
+from keyboards import get_package_job_keyboard
+
+def kill_process_group(process):
+    """Убить процесс и его потомков (процесс должен быть лидером своей группы)"""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+class PackageJob:
+    """Задача pip пользователя: вывод копится в памяти и показывается в одном сообщении"""
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    def __init__(self, job_id, user_id, key, title, run, bot, chat_id, done_markup=None):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.key = key
+        self.title = title
+        self.run = run
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = None
+        self.done_markup = done_markup
+        self.lines = deque(maxlen=PACKAGE_JOB_OUTPUT_LINES)
+        self.status = self.QUEUED
+        self.result = None
+        self.dirty = False
+        self.started_at = None
+        self.task = None
+
+    @property
+    def finished(self):
+        return self.status in (self.DONE, self.FAILED, self.CANCELLED)
+
+    def add_line(self, line):
+        line = line.rstrip()
+        if line:
+            self.lines.append(line)
+            self.dirty = True
+
+    async def follow(self, process):
+        """Читать объединенный вывод процесса в сообщение задачи. Возвращает код завершения.
+
+        При отмене задачи убивается вся группа процесса (процесс запускается
+        с start_new_session=True): дочерние процессы сборки пакетов держат
+        stdout открытым и иначе не дали бы задаче завершиться."""
+        try:
+            async for line in process.stdout:
+                self.add_line(line.decode('utf-8', errors='ignore'))
+            return await process.wait()
+        except asyncio.CancelledError:
+            kill_process_group(process)
+            await process.wait()
+            raise
+
+    def render(self):
+        if self.status == self.QUEUED:
+            footer = "⏳ В очереди - начнется, как только освободится место"
+        elif self.status == self.RUNNING:
+            footer = f"🔄 Выполняется... {int(time.monotonic() - self.started_at)} сек"
+        else:
+            footer = self.result
+
+        text = f"{self.title}\n\n"
+        if self.lines and self.status != self.QUEUED:
+            body = html.escape("\n".join(self.lines))
+            limit = LOG_MESSAGE_MAX_CHARS - len(text) - len(footer)
+            if len(body) > limit:
+                body = body[-limit:]
+                body = body[body.find("\n") + 1:]
+            text += f"<pre>{body}</pre>\n\n"
+        return text + footer
+
+class PackageJobQueue:
+    """Очередь задач pip (установка и удаление библиотек).
+
+    Одновременно выполняется не больше PACKAGE_JOB_WORKERS задач, у одного
+    пользователя - не больше одной (pip в одном окружении параллельно не запускается).
+    Пользователи обслуживаются по кругу: после своей задачи пользователь встает
+    в конец очереди, поэтому длинная очередь одного не задерживает остальных.
+    Повторная такая же задача (тот же ключ), пока первая не завершилась,
+    не создается - возвращается уже существующая.
+    """
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self._jobs = {}       # job_id -> задача (в очереди или выполняется)
+        self._by_key = {}     # (user_id, ключ) -> задача
+        self._queues = {}     # user_id -> deque(задачи в очереди)
+        self._ready = deque() # пользователи с задачами в очереди, по кругу
+        self._running = {}    # user_id -> выполняющаяся задача
+
+    # ===== ПОСТАНОВКА В ОЧЕРЕДЬ =====
+
+    async def submit(self, bot, chat_id, user_id, key, title, run, message_id=None, done_markup=None):
+        """Поставить задачу в очередь.
+
+        run(job) - корутина, которая выполняет работу (вывод процессов передается через
+        job.follow) и возвращает текст результата; RuntimeError - ошибка с текстом.
+        Сообщение задачи отправляется заново или правится message_id.
+        Возвращает (задача, создана ли новая) или (None, False), если очередь
+        пользователя заполнена."""
+        existing = self._by_key.get((user_id, key))
+        if existing:
+            return existing, False
+        if len(self._queues.get(user_id, ())) >= PACKAGE_JOB_MAX_QUEUED:
+            return None, False
+
+        job = PackageJob(next(self._ids), user_id, key, title, run, bot, chat_id, done_markup)
+        self._jobs[job.job_id] = job
+        self._by_key[(user_id, key)] = job
+        try:
+            if message_id is None:
+                message = await bot.send_message(
+                    chat_id, job.render(),
+                    reply_markup=get_package_job_keyboard(job.job_id),
+                    parse_mode="HTML"
+                )
+                job.message_id = message.message_id
+            else:
+                job.message_id = message_id
+                await self._edit(job, get_package_job_keyboard(job.job_id))
+        except Exception:
+            self._forget(job)
+            raise
+
+        self._queues.setdefault(user_id, deque()).append(job)
+        if user_id not in self._running and user_id not in self._ready:
+            self._ready.append(user_id)
+        self._dispatch()
+        return job, True
+
+    async def cancel(self, job_id, user_id):
+        """Отменить задачу пользователя (в очереди или выполняющуюся)"""
+        job = self._jobs.get(job_id)
+        if job is None or job.user_id != user_id or job.finished:
+            return False
+
+        if job.status == PackageJob.RUNNING:
+            job.task.cancel()
+            return True
+
+        queue = self._queues.get(user_id)
+        if queue and job in queue:
+            queue.remove(job)
+            if not queue:
+                del self._queues[user_id]
+                if user_id in self._ready:
+                    self._ready.remove(user_id)
+        job.status = PackageJob.CANCELLED
+        job.result = "🚫 Отменено"
+        self._forget(job)
+        await self._edit(job, job.done_markup)
+        return True
+
+    def _forget(self, job):
+        self._jobs.pop(job.job_id, None)
+        if self._by_key.get((job.user_id, job.key)) is job:
+            del self._by_key[(job.user_id, job.key)]
+
+    # ===== ВЫПОЛНЕНИЕ =====
+
+    def _dispatch(self):
+        """Запустить задачи следующих по кругу пользователей, пока есть свободные места"""
+        while self._ready and len(self._running) < PACKAGE_JOB_WORKERS:
+            user_id = self._ready.popleft()
+            queue = self._queues[user_id]
+            job = queue.popleft()
+            if not queue:
+                del self._queues[user_id]
+            self._running[user_id] = job
+            job.status = PackageJob.RUNNING
+            job.task = asyncio.create_task(self._execute(job))
+
+    async def _execute(self, job):
+        job.started_at = time.monotonic()
+        job.dirty = True
+        updater = asyncio.create_task(self._update_loop(job))
+        try:
+            job.result = await asyncio.wait_for(job.run(job), timeout=PACKAGE_JOB_TIMEOUT)
+            job.status = PackageJob.DONE
+        except asyncio.TimeoutError:
+            job.status = PackageJob.FAILED
+            job.result = f"❌ Превышено время выполнения ({PACKAGE_JOB_TIMEOUT // 60} мин)"
+        except asyncio.CancelledError:
+            job.status = PackageJob.CANCELLED
+            job.result = "🚫 Отменено"
+        except RuntimeError as e:
+            job.status = PackageJob.FAILED
+            job.result = f"❌ Ошибка:\n<code>{html.escape(str(e)[-1000:])}</code>"
+        except Exception as e:
+            print(f"❌ Ошибка задачи pip #{job.job_id} пользователя {job.user_id}: {e}")
+            job.status = PackageJob.FAILED
+            job.result = f"❌ Ошибка: {html.escape(str(e))}"
+        finally:
+            updater.cancel()
+            self._forget(job)
+            del self._running[job.user_id]
+            if job.user_id in self._queues:
+                self._ready.append(job.user_id)
+            self._dispatch()
+        await self._edit(job, job.done_markup)
+
+    # ===== СООБЩЕНИЕ =====
+
+    async def _edit(self, job, reply_markup=None):
+        try:
+            await job.bot.edit_message_text(
+                job.render(),
+                chat_id=job.chat_id,
+                message_id=job.message_id,
+                reply_markup=reply_markup,
+                parse_mode="HTML"
+            )
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+        except TelegramBadRequest as e:
+            # "message is not modified" и удаленное сообщение - не ошибка
+            if "not modified" not in str(e):
+                print(f"⚠️ Не удалось обновить сообщение задачи pip #{job.job_id}: {e}")
+
+    async def _update_loop(self, job):
+        """Правки сообщения выполняющейся задачи не чаще раза в PACKAGE_JOB_EDIT_INTERVAL"""
+        markup = get_package_job_keyboard(job.job_id)
+        while True:
+            if job.dirty:
+                job.dirty = False
+                await self._edit(job, markup)
+            await asyncio.sleep(PACKAGE_JOB_EDIT_INTERVAL)
+
+package_jobs = PackageJobQueue()
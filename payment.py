@@ -6,6 +6,7 @@ from aiogram.fsm.state import State, StatesGroup
 from firebase_db import firebase_db
 from keyboards import get_payment_keyboard, get_admin_payment_keyboard, get_cancel_keyboard, get_back_to_main_keyboard
 from config import ADMIN_ID
+from utils.notifier import notifier
 
 router = Router()
 
@@ -76,33 +77,30 @@ async def process_payment_photo(message: Message, state: FSMContext):
     # Получаем всех администраторов
     admins = firebase_db.get_all_admins()
     
-    # Отправляем всем админам
-    for admin_id, admin_data in admins.items():
-        try:
-            admin_text = (
-                "🎯 <b>Новый запрос на пополнение</b>\n\n"
-                f"👤 <b>Пользователь:</b> {user_data.get('first_name', 'Неизвестно')}\n"
-                f"🆔 <b>ID:</b> {user_id}\n"
-                f"💰 <b>Сумма:</b> {amount}₽\n"
-                f"📅 <b>Время:</b> {message.date.strftime('%d.%m.%Y %H:%M')}\n"
-            )
-            
-            if user_data.get('username'):
-                admin_text += f"📱 <b>Username:</b> @{user_data.get('username')}\n"
-                
-            admin_text += f"\n💳 <b>Текущий баланс:</b> {user_data.get('balance', 0)}₽"
-            
-            photo = message.photo[-1]
-            await message.bot.send_photo(
-                chat_id=int(admin_id),
-                photo=photo.file_id,
-                caption=admin_text,
-                parse_mode="HTML",
-                reply_markup=get_admin_payment_keyboard(user_id, amount)
-            )
-            
-        except Exception as e:
-            print(f"❌ Ошибка отправки админу {admin_id}: {e}")
+    admin_text = (
+        "🎯 <b>Новый запрос на пополнение</b>\n\n"
+        f"👤 <b>Пользователь:</b> {user_data.get('first_name', 'Неизвестно')}\n"
+        f"🆔 <b>ID:</b> {user_id}\n"
+        f"💰 <b>Сумма:</b> {amount}₽\n"
+        f"📅 <b>Время:</b> {message.date.strftime('%d.%m.%Y %H:%M')}\n"
+    )
+    
+    if user_data.get('username'):
+        admin_text += f"📱 <b>Username:</b> @{user_data.get('username')}\n"
+        
+    admin_text += f"\n💳 <b>Текущий баланс:</b> {user_data.get('balance', 0)}₽"
+    
+    # Ставим в очередь отправки всем админам
+    photo = message.photo[-1]
+    for admin_id in admins:
+        notifier.send_photo(
+            int(admin_id),
+            photo.file_id,
+            caption=admin_text,
+            parse_mode="HTML",
+            reply_markup=get_admin_payment_keyboard(user_id, amount),
+            dedup_key=f"payment_request:{message.chat.id}:{message.message_id}:{admin_id}"
+        )
     
     await state.clear()
 
@@ -131,31 +129,27 @@ async def approve_payment_handler(callback: CallbackQuery):
         
         new_balance = firebase_db.update_balance(str(user_id), amount)
         
-        try:
-            await callback.bot.send_message(
-                user_id,
-                f"✅ <b>Баланс пополнен на {amount}₽</b>\n"
-                f"💳 Новый баланс: {new_balance}₽",
-                parse_mode="HTML"
-            )
-        except:
-            pass
+        notifier.send_message(
+            user_id,
+            f"✅ <b>Баланс пополнен на {amount}₽</b>\n"
+            f"💳 Новый баланс: {new_balance}₽",
+            parse_mode="HTML",
+            dedup_key=f"{payment_key}:user"
+        )
         
         # Уведомляем всех админов об одобрении
         admins = firebase_db.get_all_admins()
         for admin_id in admins:
-            try:
-                await callback.bot.send_message(
-                    admin_id,
-                    f"✅ <b>Платеж одобрен</b>\n\n"
-                    f"👤 Пользователь: {user_data.get('first_name', 'Неизвестно')}\n"
-                    f"🆔 ID: {user_id}\n"
-                    f"💰 Сумма: {amount}₽\n"
-                    f"💳 Новый баланс: {new_balance}₽",
-                    parse_mode="HTML"
-                )
-            except:
-                pass
+            notifier.send_message(
+                admin_id,
+                f"✅ <b>Платеж одобрен</b>\n\n"
+                f"👤 Пользователь: {user_data.get('first_name', 'Неизвестно')}\n"
+                f"🆔 ID: {user_id}\n"
+                f"💰 Сумма: {amount}₽\n"
+                f"💳 Новый баланс: {new_balance}₽",
+                parse_mode="HTML",
+                dedup_key=f"{payment_key}:{admin_id}"
+            )
         
         await callback.message.edit_text(
             f"✅ <b>Платеж подтвержден</b>\n\n"
@@ -194,28 +188,24 @@ async def reject_payment_handler(callback: CallbackQuery):
             await callback.answer("❌ Пользователь не найден", show_alert=True)
             return
         
-        try:
-            await callback.bot.send_message(
-                user_id,
-                f"❌ Запрос на пополнение {amount}₽ отклонен"
-            )
-        except:
-            pass
+        notifier.send_message(
+            user_id,
+            f"❌ Запрос на пополнение {amount}₽ отклонен",
+            dedup_key=f"{payment_key}:user"
+        )
         
         # Уведомляем всех админов об отклонении
         admins = firebase_db.get_all_admins()
         for admin_id in admins:
-            try:
-                await callback.bot.send_message(
-                    admin_id,
-                    f"❌ <b>Платеж отклонен</b>\n\n"
-                    f"👤 Пользователь: {user_data.get('first_name', 'Неизвестно')}\n"
-                    f"🆔 ID: {user_id}\n"
-                    f"💰 Сумма: {amount}₽",
-                    parse_mode="HTML"
-                )
-            except:
-                pass
+            notifier.send_message(
+                admin_id,
+                f"❌ <b>Платеж отклонен</b>\n\n"
+                f"👤 Пользователь: {user_data.get('first_name', 'Неизвестно')}\n"
+                f"🆔 ID: {user_id}\n"
+                f"💰 Сумма: {amount}₽",
+                parse_mode="HTML",
+                dedup_key=f"{payment_key}:{admin_id}"
+            )
         
         await callback.message.edit_text(f"❌ Платеж пользователя {user_id} отклонен")
         await callback.answer("❌ Платеж отклонен")
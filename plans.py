@@ -0,0 +1,32 @@
+from config import HOSTING_PLANS, LIMITS_DEFAULT_CPU, LIMITS_DEFAULT_OPEN_FILES
+
+_SIZE_UNITS = {
+    'B': 1,
+    'KB': 1024,
+    'MB': 1024 ** 2,
+    'GB': 1024 ** 3
+}
+
+def parse_size(value) -> int:
+    """Размер из тарифа ("250 MB", "2 GB") в байтах"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    number, _, unit = str(value).strip().partition(' ')
+    return int(float(number) * _SIZE_UNITS.get(unit.strip().upper() or 'B', 1))
+
+def get_plan_by_name(plan_name: str) -> dict:
+    """Тариф по названию из hosting_plan пользователя.
+
+    Хостинг из промокода хранится с произвольным названием - для него берем базовый тариф."""
+    for plan in HOSTING_PLANS.values():
+        if plan['name'] == plan_name:
+            return plan
+    return next(iter(HOSTING_PLANS.values()))
+
+def get_plan_limits(plan: dict) -> dict:
+    """Лимиты процесса скрипта по тарифу: память (байт), CPU (% одного ядра), открытые файлы"""
+    return {
+        'memory': parse_size(plan['ram']),
+        'cpu': int(str(plan.get('cpu', LIMITS_DEFAULT_CPU)).rstrip('%')),
+        'open_files': int(plan.get('open_files', LIMITS_DEFAULT_OPEN_FILES))
+    }
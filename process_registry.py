@@ -0,0 +1,104 @@
+import asyncio
+import json
+import os
+import threading
+import psutil
+from config import PROCESS_REGISTRY_PATH, PROCESS_POLL_INTERVAL
+
+# Код завершения процесса, который был запущен до рестарта бота: он уже не наш
+# потомок, и настоящий код получить нельзя
+UNKNOWN_EXIT_CODE = -1
+
+class ProcessRegistry:
+    """Реестр запущенных скриптов на диске: logs/processes.json.
+
+    {user_id: {'pid', 'create_time', 'cmdline', 'script_path', 'python_version',
+    'log_quota', 'started_at'}} - по нему после рестарта бота находим пережившие
+    его процессы. Все методы синхронные - вызывать через asyncio.to_thread.
+    """
+
+    def __init__(self, path=PROCESS_REGISTRY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save(self, entries):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def add(self, user_id, entry):
+        with self._lock:
+            entries = self.load()
+            entries[str(user_id)] = entry
+            self._save(entries)
+
+    def remove(self, user_id, pid=None):
+        """Убрать запись (только если она относится к процессу pid, когда он указан)"""
+        with self._lock:
+            entries = self.load()
+            entry = entries.get(str(user_id))
+            if entry is None or (pid is not None and entry.get('pid') != pid):
+                return
+            entries.pop(str(user_id))
+            self._save(entries)
+
+class AttachedProcess:
+    """Процесс скрипта, переживший рестарт бота.
+
+    Повторяет ту часть интерфейса asyncio.subprocess.Process, которой пользуется
+    ScriptRunner (pid, returncode, terminate, kill, wait). Процесс не наш потомок,
+    поэтому завершение отслеживается опросом psutil, а код завершения неизвестен.
+    """
+
+    def __init__(self, pid, process=None):
+        self.pid = pid
+        self._process = process
+        self.returncode = None if process is not None else UNKNOWN_EXIT_CODE
+
+    @classmethod
+    def find(cls, entry):
+        """Процесс из записи реестра, если он еще жив (сверяем время создания - pid мог быть переиспользован)"""
+        try:
+            process = psutil.Process(entry['pid'])
+            if abs(process.create_time() - entry['create_time']) > 1:
+                return None
+            if process.status() == psutil.STATUS_ZOMBIE:
+                return None
+            return cls(entry['pid'], process)
+        except (psutil.NoSuchProcess, psutil.AccessDenied, KeyError):
+            return None
+
+    def _is_alive(self):
+        try:
+            return self._process.is_running() and self._process.status() != psutil.STATUS_ZOMBIE
+        except psutil.NoSuchProcess:
+            return False
+
+    def terminate(self):
+        try:
+            self._process.terminate()
+        except psutil.NoSuchProcess:
+            raise ProcessLookupError(self.pid)
+
+    def kill(self):
+        try:
+            self._process.kill()
+        except psutil.NoSuchProcess:
+            raise ProcessLookupError(self.pid)
+
+    async def wait(self):
+        while self.returncode is None:
+            if not self._is_alive():
+                self.returncode = UNKNOWN_EXIT_CODE
+                break
+            await asyncio.sleep(PROCESS_POLL_INTERVAL)
+        return self.returncode
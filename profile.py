@@ -2,7 +2,7 @@ from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
-from firebase_db import firebase_db
+from firebase_db import async_firebase_db
 from keyboards import get_profile_keyboard, get_python_version_keyboard, get_main_keyboard
 
 router = Router()
@@ -10,7 +10,7 @@ router = Router()
 @router.message(F.text == "👤 Профиль")
 async def profile_handler(message: Message):
     user_id = message.from_user.id
-    user_data = firebase_db.get_user(user_id)
+    user_data = await async_firebase_db.get_user(user_id)
     
     if not user_data:
         await message.answer("Пользователь не найден")
@@ -52,7 +52,7 @@ async def set_python_version_callback(callback: CallbackQuery):
     version = callback.data.replace("python_", "")
     user_id = callback.from_user.id
     
-    firebase_db.update_user(user_id, {'python_version': version})
+    await async_firebase_db.update_user(user_id, {'python_version': version})
     
     await callback.message.edit_text(f"✅ Версия Python изменена на {version}")
     await callback.answer()
\ No newline at end of file
@@ -3,7 +3,7 @@ from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from firebase_db import firebase_db
+from firebase_db import async_firebase_db
 from keyboards import get_profile_keyboard, get_main_keyboard, get_cancel_keyboard
 
 router = Router()
@@ -29,11 +29,11 @@ async def process_promo_code(message: Message, state: FSMContext):
     user_id = message.from_user.id
     promo_code = message.text.strip().upper()
     
-    success, result_message = firebase_db.use_promo_code(promo_code, str(user_id))
+    success, result_message = await async_firebase_db.use_promo_code(promo_code, str(user_id))
     
     if success:
         # Получаем обновленные данные пользователя
-        user_data = firebase_db.get_user(str(user_id))
+        user_data = await async_firebase_db.get_user(str(user_id))
         
         # Если активирован хостинг, меняем клавиатуру
         if "хостинг" in result_message.lower():
@@ -0,0 +1,239 @@
+import asyncio
+import os
+import resource
+import signal
+import time
+import psutil
+from config import (
+    LIMITS_ENABLED, LIMITS_CGROUP_ROOT, LIMITS_AS_MULTIPLIER, LIMITS_WATCHDOG_INTERVAL,
+    LIMITS_THROTTLE_REPORT_INTERVAL, LIMITS_CPU_GRACE_SAMPLES
+)
+
+class ResourceLimits:
+    """Ограничение ресурсов скриптов по тарифу.
+
+    Если доступна делегированная ветка cgroup v2 (LIMITS_CGROUP_ROOT), каждый скрипт
+    запускается в своей группе user_<id> с memory.max и cpu.max - ядро само убивает
+    при нехватке памяти и троттлит CPU. Иначе в дочернем процессе до exec ставятся
+    RLIMIT_AS и RLIMIT_NOFILE, а память и CPU сторожит watchdog по замерам мониторинга.
+    RLIMIT_CPU не используется: он ограничивает суммарное время CPU и убивал бы
+    долго работающих ботов, поэтому без cgroup CPU ограничивается понижением приоритета.
+    """
+
+    def __init__(self, cgroup_root=LIMITS_CGROUP_ROOT, enabled=LIMITS_ENABLED):
+        self.enabled = enabled
+        self.cgroup_root = cgroup_root
+        self.cgroup_enabled = enabled and self._init_cgroup_root()
+        self._applied = {}     # user_id -> (pid, лимиты) запущенного скрипта
+        self._counters = {}    # user_id -> {'oom_kill', 'nr_throttled', 'throttled_usec'}
+        self._throttle_reported = {}
+        self._cpu_over = {}    # без cgroup: замеров подряд выше лимита CPU
+        self._killed = set()   # без cgroup: убиты watchdog за превышение памяти
+
+    # ===== CGROUP =====
+
+    def _init_cgroup_root(self):
+        """Проверить ветку cgroup v2 и включить в ней контроллеры memory и cpu"""
+        subtree_control = os.path.join(self.cgroup_root, 'cgroup.subtree_control')
+        if not os.path.exists(subtree_control) or not os.access(subtree_control, os.W_OK):
+            print(f"ℹ️ cgroup v2 ({self.cgroup_root}) недоступна - лимиты через rlimit")
+            return False
+        try:
+            with open(subtree_control, 'r') as f:
+                enabled = f.read().split()
+            missing = [name for name in ('memory', 'cpu') if name not in enabled]
+            if missing:
+                with open(subtree_control, 'w') as f:
+                    f.write(' '.join(f'+{name}' for name in missing))
+        except OSError as e:
+            print(f"⚠️ Не удалось включить контроллеры cgroup: {e} - лимиты через rlimit")
+            return False
+        print(f"🧱 Лимиты ресурсов через cgroup v2: {self.cgroup_root}")
+        return True
+
+    def _cgroup_path(self, user_id):
+        return os.path.join(self.cgroup_root, f"user_{user_id}")
+
+    @staticmethod
+    def _write(path, value):
+        with open(path, 'w') as f:
+            f.write(value)
+
+    def _setup_cgroup(self, user_id, limits):
+        path = self._cgroup_path(user_id)
+        os.makedirs(path, exist_ok=True)
+        self._write(os.path.join(path, 'memory.max'), str(limits['memory']))
+        swap_max = os.path.join(path, 'memory.swap.max')
+        if os.path.exists(swap_max):
+            self._write(swap_max, '0')
+        self._write(os.path.join(path, 'cpu.max'), f"{limits['cpu'] * 1000} 100000")
+        return os.path.join(path, 'cgroup.procs')
+
+    @staticmethod
+    def _read_keyed(path):
+        """Файл вида 'ключ значение' построчно (memory.events, cpu.stat)"""
+        values = {}
+        try:
+            with open(path, 'r') as f:
+                for line in f:
+                    key, _, value = line.partition(' ')
+                    values[key] = int(value)
+        except (OSError, ValueError):
+            pass
+        return values
+
+    def _read_counters(self, user_id):
+        path = self._cgroup_path(user_id)
+        events = self._read_keyed(os.path.join(path, 'memory.events'))
+        cpu_stat = self._read_keyed(os.path.join(path, 'cpu.stat'))
+        return {
+            'oom_kill': events.get('oom_kill', 0),
+            'nr_throttled': cpu_stat.get('nr_throttled', 0),
+            'throttled_usec': cpu_stat.get('throttled_usec', 0)
+        }
+
+    # ===== ЗАПУСК =====
+
+    def prepare(self, user_id, limits):
+        """Подготовить лимиты перед запуском. Возвращает preexec_fn для дочернего процесса (или None)"""
+        if not self.enabled or not limits:
+            return None
+
+        cgroup_procs = None
+        if self.cgroup_enabled:
+            try:
+                cgroup_procs = self._setup_cgroup(user_id, limits)
+            except OSError as e:
+                print(f"⚠️ Не удалось настроить cgroup пользователя {user_id}: {e} - лимиты через rlimit")
+        address_space = limits['memory'] * LIMITS_AS_MULTIPLIER
+        open_files = limits['open_files']
+
+        def apply_limits():
+            # Выполняется в дочернем процессе между fork и exec
+            if cgroup_procs:
+                with open(cgroup_procs, 'w') as f:
+                    f.write('0')
+            else:
+                resource.setrlimit(resource.RLIMIT_AS, (address_space, address_space))
+            resource.setrlimit(resource.RLIMIT_NOFILE, (open_files, open_files))
+
+        return apply_limits
+
+    def adopt(self, user_id, pid, limits):
+        """Начать следить за лимитами процесса (в том числе подключенного заново после рестарта)"""
+        if not self.enabled or not limits:
+            return
+        self._applied[user_id] = (pid, limits)
+        self._counters[user_id] = self._read_counters(user_id) if self.cgroup_enabled else {}
+        self._cpu_over.pop(user_id, None)
+        self._killed.discard(user_id)
+
+    def release(self, user_id, pid):
+        """Процесс завершился: вернуть неотчитанные события лимитов и убрать cgroup"""
+        applied = self._applied.get(user_id)
+        if applied is None or applied[0] != pid:
+            return []  # пользователь уже запустил новый процесс
+        self._applied.pop(user_id)
+        limits = applied[1]
+        events = self._collect(user_id, limits) if self.cgroup_enabled else []
+        if user_id in self._killed:
+            self._killed.discard(user_id)
+            events.append(('oom', self._oom_text(limits)))
+        self._counters.pop(user_id, None)
+        self._cpu_over.pop(user_id, None)
+        if self.cgroup_enabled:
+            try:
+                os.rmdir(self._cgroup_path(user_id))
+            except OSError:
+                pass  # в группе остались процессы - удалим при следующем запуске
+        return events
+
+    # ===== WATCHDOG =====
+
+    @staticmethod
+    def _oom_text(limits):
+        return f"OOM: процесс убит - превышен лимит памяти тарифа ({limits['memory'] // (1024 * 1024)} MB)"
+
+    def _collect(self, user_id, limits):
+        """События cgroup с прошлой проверки: [(вид, текст), ...]"""
+        previous = self._counters.get(user_id, {})
+        current = self._read_counters(user_id)
+        self._counters[user_id] = current
+        events = []
+
+        oom_kills = current['oom_kill'] - previous.get('oom_kill', 0)
+        if oom_kills > 0:
+            events.append(('oom', self._oom_text(limits)))
+
+        throttled_usec = current['throttled_usec'] - previous.get('throttled_usec', 0)
+        now = time.time()
+        if throttled_usec > 0 and now - self._throttle_reported.get(user_id, 0) >= LIMITS_THROTTLE_REPORT_INTERVAL:
+            self._throttle_reported[user_id] = now
+            events.append((
+                'throttled',
+                f"CPU ограничен до {limits['cpu']}% тарифа: "
+                f"{current['nr_throttled'] - previous.get('nr_throttled', 0)} раз, "
+                f"{throttled_usec / 1_000_000:.1f} сек ожидания"
+            ))
+        return events
+
+    def _check_sample(self, user_id, limits, process, sample):
+        """Без cgroup: сверить замер мониторинга с лимитами тарифа"""
+        events = []
+        if sample.rss > limits['memory'] and user_id not in self._killed:
+            self._killed.add(user_id)
+            try:
+                os.kill(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            return events
+
+        if sample.cpu > limits['cpu']:
+            over = self._cpu_over.get(user_id, 0) + 1
+            self._cpu_over[user_id] = over
+            if over == LIMITS_CPU_GRACE_SAMPLES:
+                try:
+                    psutil.Process(process.pid).nice(19)
+                except psutil.Error:
+                    pass
+                now = time.time()
+                if now - self._throttle_reported.get(user_id, 0) >= LIMITS_THROTTLE_REPORT_INTERVAL:
+                    self._throttle_reported[user_id] = now
+                    events.append((
+                        'throttled',
+                        f"CPU {sample.cpu:.0f}% при лимите тарифа {limits['cpu']}% - приоритет процесса понижен"
+                    ))
+        else:
+            self._cpu_over.pop(user_id, None)
+        return events
+
+    def check(self, processes, get_sample):
+        """Проверить все запущенные скрипты. Возвращает {user_id: [(вид, текст), ...]}"""
+        report = {}
+        for user_id, process in list(processes.items()):
+            applied = self._applied.get(user_id)
+            if applied is None or applied[0] != process.pid or process.returncode is not None:
+                continue
+            limits = applied[1]
+            if self.cgroup_enabled:
+                events = self._collect(user_id, limits)
+            else:
+                sample = get_sample(user_id)
+                events = self._check_sample(user_id, limits, process, sample) if sample else []
+            if events:
+                report[user_id] = events
+        return report
+
+    async def start_watchdog(self, get_processes, get_sample, report):
+        """Фоновая проверка OOM и троттлинга: report(user_id, вид, текст)"""
+        if not self.enabled:
+            return
+        while True:
+            await asyncio.sleep(LIMITS_WATCHDOG_INTERVAL)
+            try:
+                found = await asyncio.to_thread(self.check, get_processes(), get_sample)
+                for user_id, events in found.items():
+                    for kind, text in events:
+                        await report(user_id, kind, text)
+            except Exception as e:
+                print(f"❌ Ошибка проверки лимитов ресурсов: {e}")
@@ -0,0 +1,105 @@
+import asyncio
+import time
+from collections import deque, namedtuple
+import psutil
+from config import RESOURCE_SAMPLE_INTERVAL, RESOURCE_HISTORY_SIZE
+
+ResourceSample = namedtuple('ResourceSample', ['time', 'cpu', 'rss', 'fds', 'threads'])
+
+SPARKLINE_CHARS = "▁▂▃▄▅▆▇█"
+
+class ResourceMonitor:
+    """Фоновый сбор ресурсов запущенных скриптов.
+
+    Каждые RESOURCE_SAMPLE_INTERVAL секунд снимает CPU, RSS, открытые дескрипторы и
+    потоки процесса пользователя вместе с дочерними процессами и складывает в
+    кольцевой буфер, поэтому обработчики отвечают мгновенно из кэша.
+    """
+
+    def __init__(self, get_processes, interval=RESOURCE_SAMPLE_INTERVAL, history_size=RESOURCE_HISTORY_SIZE):
+        self._get_processes = get_processes
+        self.interval = interval
+        self.history_size = history_size
+        self._history = {}    # user_id -> deque[ResourceSample]
+        self._tracked = {}    # user_id -> {pid: psutil.Process}
+
+    # ===== СБОР =====
+
+    def _sample_user(self, user_id, pid):
+        tracked = self._tracked.get(user_id, {})
+        try:
+            root = tracked.get(pid) or psutil.Process(pid)
+            processes = [root] + root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            self._tracked.pop(user_id, None)
+            return None
+
+        cpu = 0.0
+        rss = fds = threads = 0
+        current = {}
+        for process in processes:
+            # Используем тот же объект Process, иначе cpu_percent не с чем сравнить
+            process = tracked.get(process.pid, process)
+            try:
+                with process.oneshot():
+                    cpu += process.cpu_percent(None)
+                    rss += process.memory_info().rss
+                    threads += process.num_threads()
+                    if hasattr(process, 'num_fds'):
+                        fds += process.num_fds()
+                current[process.pid] = process
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+
+        self._tracked[user_id] = current
+        return ResourceSample(time.time(), cpu, rss, fds, threads)
+
+    def sample_all(self):
+        """Снять показатели всех запущенных скриптов (выполняется в отдельном потоке)"""
+        running = {
+            user_id: process.pid
+            for user_id, process in list(self._get_processes().items())
+            if process.returncode is None
+        }
+
+        for user_id, pid in running.items():
+            sample = self._sample_user(user_id, pid)
+            if sample:
+                history = self._history.get(user_id)
+                if history is None:
+                    history = self._history[user_id] = deque(maxlen=self.history_size)
+                history.append(sample)
+
+        for user_id in list(self._tracked):
+            if user_id not in running:
+                self._tracked.pop(user_id, None)
+                self._history.pop(user_id, None)
+
+    async def start_sampler(self):
+        """Фоновая задача сбора ресурсов"""
+        print(f"📈 Мониторинг ресурсов запущен (каждые {self.interval} сек)")
+        while True:
+            try:
+                await asyncio.to_thread(self.sample_all)
+            except Exception as e:
+                print(f"❌ Ошибка мониторинга ресурсов: {e}")
+            await asyncio.sleep(self.interval)
+
+    # ===== ЧТЕНИЕ =====
+
+    def get_latest(self, user_id):
+        history = self._history.get(user_id)
+        return history[-1] if history else None
+
+    def get_history(self, user_id):
+        return list(self._history.get(user_id, ()))
+
+    @staticmethod
+    def sparkline(values, max_value=None):
+        """Мини-график из символов ▁▂▃▄▅▆▇█"""
+        values = list(values)
+        if not values:
+            return ""
+        top = max_value or max(values) or 1
+        last = len(SPARKLINE_CHARS) - 1
+        return "".join(SPARKLINE_CHARS[min(last, int(value / top * last))] for value in values)
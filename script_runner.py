@@ -1,26 +1,61 @@
 import asyncio
+import ctypes
 import os
 import psutil
-import aiofiles
 from typing import Optional
 import subprocess
 import signal
+import time
 from datetime import datetime
+from config import (
+    RESOURCE_SPARKLINE_POINTS, LOG_QUEUE_SIZE, LOG_FLUSH_BYTES, LOG_FLUSH_INTERVAL, LOG_READ_MAX_BYTES,
+    LOG_TAIL_LINES, LOG_PAGE_BYTES, LOG_ERROR_TAIL_LINES, CAPTURE_READ_BYTES, CAPTURE_POLL_INTERVAL,
+    CAPTURE_RECLAIM_BYTES
+)
+from utils.resource_monitor import ResourceMonitor
+from utils.log_store import log_manager, UserLogStore
+from utils.process_registry import ProcessRegistry, AttachedProcess
+from utils.resource_limits import ResourceLimits
+from utils.venv_manager import venv_manager
+
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+
+try:
+    _fallocate = ctypes.CDLL(None, use_errno=True).fallocate
+    _fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong]
+except (OSError, AttributeError):
+    _fallocate = None
+
+def punch_hole(fd: int, length: int) -> bool:
+    """Освободить место под первыми length байтами файла, не меняя его размер (Linux).
+
+    Процесс продолжает дописывать файл в режиме append, ничего не теряется: дыра
+    читается нулями, но читатель туда уже не возвращается. False - не поддерживается."""
+    if _fallocate is None:
+        return False
+    return _fallocate(fd, FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE, 0, length) == 0
 
 class ScriptRunner:
     def __init__(self):
         self.running_processes = {}
+        self.resource_monitor = ResourceMonitor(lambda: self.running_processes)
+        self._line_subscribers = {}  # user_id -> set(callback(lines, finished))
+        self._exit_listeners = []    # callback(user_id, returncode, stop_requested, uptime)
+        self._stop_requested = set()  # процессы, остановленные по запросу
+        self.started_at = {}         # user_id -> time.time() запуска текущего процесса
+        self.registry = ProcessRegistry()
+        self.limits = ResourceLimits()
+        self._log_queues = {}        # user_id -> очередь писателя логов текущего процесса
     
-    def get_python_executable(self, python_version: str) -> str:
-        """Get the correct Python executable based on version"""
-        if python_version.startswith('3.'):
-            return "python3"
-        elif python_version in ["python3", "python"]:
-            return python_version
-        else:
-            return "python3"
+    async def get_python_executable(self, user_id: int, python_version: str) -> str:
+        """Get the Python executable of the user's virtualenv for the version"""
+        if python_version in ["python3", "python"]:
+            python_version = "3"
+        return await venv_manager.get_launch_python(user_id, python_version)
     
-    async def start_script(self, user_id: int, script_path: str, python_version: str = "3.9"):
+    async def start_script(self, user_id: int, script_path: str, python_version: str = "3.9",
+                           log_quota: Optional[str] = None, limits: Optional[dict] = None):
         """Start Python script for real - УМНЫЕ ЛОГИ"""
         try:
             print(f"🚀 START_SCRIPT called with:")
@@ -37,16 +72,12 @@ class ScriptRunner:
                 print(f"❌ {error_msg}")
                 return False, error_msg
             
-            python_executable = self.get_python_executable(python_version)
+            python_executable = await self.get_python_executable(user_id, python_version)
             print(f"🔧 Используем Python: {python_executable}")
             
-            logs_dir = f"logs/user_{user_id}"
-            os.makedirs(logs_dir, exist_ok=True)
-            
-            log_file = f"{logs_dir}/script.log"
-            
-            if os.path.exists(log_file):
-                os.remove(log_file)
+            # Прошлый запуск уходит в архив логов, новый пишется в свежий сегмент
+            log_store = log_manager.get_store(user_id, log_quota)
+            generation = await asyncio.to_thread(log_store.open)
             
             script_dir = os.path.dirname(script_path)
             
@@ -55,19 +86,52 @@ class ScriptRunner:
             print(f"   📁 Директория: {script_dir}")
             print(f"   🐍 Python: {python_executable}")
             print(f"   ✅ Файл существует: {os.path.exists(script_path)}")
-            print(f"   📝 Логи: {log_file}")
-            
-            process = await asyncio.create_subprocess_exec(
-                python_executable, script_path,
-                cwd=script_dir,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                stdin=asyncio.subprocess.PIPE
-            )
+            print(f"   📝 Логи: {log_store.active_path}")
             
+            # Вывод идет в файлы, а не в пайпы: скрипт переживает рестарт бота,
+            # и после него чтение продолжается с сохраненной позиции. Каждый запуск
+            # пишет в новый файл: прежний удаляется, а не обнуляется, поэтому
+            # случайно переживший остановку процесс не испортит вывод нового
+            for name in ('stdout', 'stderr'):
+                try:
+                    os.remove(log_store.capture_paths[name])
+                except FileNotFoundError:
+                    pass
+            capture_files = [open(log_store.capture_paths[name], 'ab') for name in ('stdout', 'stderr')]
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    python_executable, script_path,
+                    cwd=script_dir,
+                    stdout=capture_files[0],
+                    stderr=capture_files[1],
+                    stdin=asyncio.subprocess.DEVNULL,
+                    start_new_session=True,
+                    preexec_fn=self.limits.prepare(user_id, limits)
+                )
+            finally:
+                for capture_file in capture_files:
+                    capture_file.close()
+            
+            self.limits.adopt(user_id, process.pid, limits)
+            started_at = time.time()
             self.running_processes[user_id] = process
+            self.started_at[user_id] = started_at
+            try:
+                create_time = psutil.Process(process.pid).create_time()
+            except psutil.NoSuchProcess:
+                create_time = started_at
+            await asyncio.to_thread(self.registry.add, user_id, {
+                'pid': process.pid,
+                'create_time': create_time,
+                'cmdline': [python_executable, script_path],
+                'script_path': script_path,
+                'python_version': python_version,
+                'log_quota': log_quota,
+                'limits': limits,
+                'started_at': started_at
+            })
             
-            asyncio.create_task(self._log_output(user_id, process, log_file))
+            asyncio.create_task(self._log_output(user_id, process, log_store, generation, started_at))
             
             return True, "Скрипт запущен успешно"
             
@@ -80,6 +144,8 @@ class ScriptRunner:
         """Stop running script"""
         if user_id in self.running_processes:
             process = self.running_processes[user_id]
+            # Остановка по запросу - слушатели выхода не должны считать ее падением
+            self._stop_requested.add(process)
             try:
                 print(f"🛑 Останавливаем скрипт пользователя {user_id}")
                 process.terminate()
@@ -97,6 +163,36 @@ class ScriptRunner:
             return True
         return False
     
+    async def load_registry(self) -> dict:
+        """Скрипты, запущенные до рестарта бота: {user_id: запись реестра}"""
+        entries = await asyncio.to_thread(self.registry.load)
+        return {int(key) if key.isdigit() else key: entry for key, entry in entries.items()}
+    
+    async def reattach(self, entries: dict) -> dict:
+        """Подключиться к скриптам из реестра после рестарта бота.
+        
+        Живые процессы снова попадают в running_processes, их вывод дочитывается
+        с сохраненных позиций. У завершившихся за время рестарта дочитывается остаток
+        вывода и срабатывают обработчики завершения. Возвращает {user_id: жив ли процесс}"""
+        alive = {}
+        for user_id, entry in entries.items():
+            process = AttachedProcess.find(entry) or AttachedProcess(entry.get('pid'))
+            started_at = entry.get('started_at') or time.time()
+            log_store = log_manager.get_store(user_id, entry.get('log_quota'))
+            capture_offsets = await asyncio.to_thread(log_store.resume)
+            generation = log_store.generation
+            
+            alive[user_id] = process.returncode is None
+            if alive[user_id]:
+                self.running_processes[user_id] = process
+                self.started_at[user_id] = started_at
+                self.limits.adopt(user_id, process.pid, entry.get('limits'))
+            asyncio.create_task(self._log_output(user_id, process, log_store, generation, started_at, capture_offsets))
+        
+        if alive:
+            print(f"🔌 Подключено к работающим скриптам: {sum(alive.values())} из {len(alive)}")
+        return alive
+    
     def _is_error_message(self, line: str) -> bool:
         """Определяем, является ли сообщение настоящей ошибкой"""
         line_lower = line.lower()
@@ -126,72 +222,275 @@ class ScriptRunner:
         
         return False
     
-    async def _log_output(self, user_id: int, process, log_file: str):
-        """Log script output to single file - УМНЫЕ ЛОГИ"""
+    def subscribe(self, user_id: int, callback):
+        """Подписаться на новые строки лога: callback(lines: list[str], finished: bool)"""
+        self._line_subscribers.setdefault(user_id, set()).add(callback)
+    
+    def unsubscribe(self, user_id: int, callback):
+        subscribers = self._line_subscribers.get(user_id)
+        if subscribers:
+            subscribers.discard(callback)
+            if not subscribers:
+                self._line_subscribers.pop(user_id, None)
+    
+    def _publish(self, user_id: int, lines, finished: bool = False):
+        for callback in list(self._line_subscribers.get(user_id, ())):
+            try:
+                callback(lines, finished)
+            except Exception as e:
+                print(f"❌ Ошибка подписчика логов пользователя {user_id}: {e}")
+    
+    async def _follow_capture(self, path: str, stream_name: str, offset: int,
+                              queue: asyncio.Queue, exited: asyncio.Event):
+        """Дочитывать capture-файл процесса построчно и передавать строки писателю.
+        
+        Новые данные проверяются раз в CAPTURE_POLL_INTERVAL, после завершения процесса
+        файл дочитывается до конца. Файл, в который еще пишет процесс, не обрезается
+        (все, что процесс допишет между чтением и обрезкой, пропало бы): место под
+        каждыми дочитанными CAPTURE_RECLAIM_BYTES освобождается дырой (punch_hole),
+        а новый файл начинается при следующем запуске скрипта."""
         try:
-            async with aiofiles.open(log_file, 'w', encoding='utf-8') as log:
-                start_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                await log.write(f"=== СКРИПТ ЗАПУСКАЕТЬСЯ  ===\n")
-                await log.write(f"Время: {start_time}\n")
-                await log.write(f"Пользователь: {user_id}\n")
-                await log.write("=" * 40 + "\n\n")
-                await log.flush()
+            # На запись - только ради punch_hole: дыра пробивается в этом же файле,
+            # даже если следующий запуск уже создал новый по тому же пути
+            capture = open(path, 'r+b')
+        except FileNotFoundError:
+            return
+        with capture:
+            if offset > os.fstat(capture.fileno()).st_size:
+                offset = 0  # файл обнулили после сохранения позиции
+            capture.seek(offset)
+            pending = b""
+            reclaim = True
+            reclaimed = 0
+            while True:
+                done = exited.is_set()
+                data = capture.read(CAPTURE_READ_BYTES)
+                if data:
+                    received_at = time.time()
+                    position = offset - len(pending)
+                    offset += len(data)
+                    lines = (pending + data).split(b"\n")
+                    pending = lines.pop()
+                    for line in lines:
+                        position += len(line) + 1
+                        # Очередь ограничена: если писатель не успевает, тормозим только этот скрипт
+                        await queue.put((stream_name, received_at, line, position))
+                    if len(pending) > CAPTURE_READ_BYTES:
+                        # Очень длинная строка без перевода - отдаем как есть
+                        await queue.put((stream_name, received_at, pending, offset))
+                        pending = b""
+                    continue
+                if done:
+                    break
+                if reclaim and offset - reclaimed >= CAPTURE_RECLAIM_BYTES:
+                    reclaimed = offset - offset % 4096
+                    reclaim = await asyncio.to_thread(punch_hole, capture.fileno(), reclaimed)
+                await asyncio.sleep(CAPTURE_POLL_INTERVAL)
+            if pending:
+                await queue.put((stream_name, time.time(), pending, offset))
+    
+    def _classify_line(self, stream_name: str, line: str) -> str:
+        """Важность строки: info, warning или error (вычисляется один раз при записи)"""
+        if stream_name == 'stdout':
+            return 'info'
+        if stream_name == 'limits':
+            return 'error' if line.startswith('OOM') else 'warning'
+        # stderr - проверяем настоящие ли это ошибки
+        if self._is_error_message(line):
+            return 'error'
+        if 'warning' in line.lower():
+            return 'warning'
+        return 'info'
+    
+    def _format_line(self, stream_name: str, timestamp: str, data: bytes):
+        """Строка лога в байтах, ее текст и важность"""
+        line = data.decode('utf-8', errors='ignore').strip()
+        if not line:  # Не пишем пустые строки
+            return b"", line, None
+        severity = self._classify_line(stream_name, line)
+        if stream_name == 'stdout':
+            return f"[{timestamp}] {line}\n".encode('utf-8'), line, severity
+        if stream_name == 'limits':
+            tag = "ERROR" if severity == 'error' else "LIMIT"
+            return f"[{timestamp}] [{tag}] {line}\n".encode('utf-8'), line, severity
+        if severity == 'error':
+            return f"[{timestamp}] [ERROR] {line}\n".encode('utf-8'), line, severity
+        return f"[{timestamp}] [INFO] {line}\n".encode('utf-8'), line, severity
+    
+    def add_exit_listener(self, listener):
+        """Подписаться на завершение скриптов: listener(user_id, returncode, stop_requested, uptime)"""
+        self._exit_listeners.append(listener)
+    
+    def _handle_exit(self, user_id: int, process, started_at: float):
+        """Убрать завершившийся процесс из running_processes и оповестить слушателей"""
+        if self.running_processes.get(user_id) is process:
+            self.running_processes.pop(user_id, None)
+        if self.started_at.get(user_id) == started_at:
+            self.started_at.pop(user_id, None)
+        stop_requested = process in self._stop_requested
+        self._stop_requested.discard(process)
+        uptime = time.time() - started_at
+        
+        for listener in self._exit_listeners:
+            try:
+                listener(user_id, process.returncode, stop_requested, uptime)
+            except Exception as e:
+                print(f"❌ Ошибка обработчика завершения скрипта пользователя {user_id}: {e}")
+    
+    async def _log_output(self, user_id: int, process, log_store: UserLogStore, generation: int,
+                          started_at: float, capture_offsets: Optional[dict] = None):
+        """Log script output to rotating log store - УМНЫЕ ЛОГИ.
+        
+        stdout и stderr читаются независимыми задачами в общую очередь, а писатель
+        сбрасывает строки в лог пачками - по LOG_FLUSH_BYTES или раз в LOG_FLUSH_INTERVAL.
+        generation - номер запуска в хранилище логов: хранилище общее для всех запусков
+        пользователя, и запись/закрытие после нового запуска не должны задеть его сегмент.
+        capture_offsets - позиции, с которых продолжить чтение после рестарта бота."""
+        resumed = capture_offsets is not None
+        capture_offsets = dict(capture_offsets or {})
+        queue = asyncio.Queue(maxsize=LOG_QUEUE_SIZE)
+        self._log_queues[user_id] = queue
+        exited = asyncio.Event()
+        readers = [
+            asyncio.create_task(self._follow_capture(
+                log_store.capture_paths[stream_name], stream_name,
+                capture_offsets.get(stream_name, 0), queue, exited
+            ))
+            for stream_name in ('stdout', 'stderr')
+        ]
+        
+        async def finish():
+            await process.wait()
+            exited.set()
+            await asyncio.gather(*readers, return_exceptions=True)
+            await queue.put(None)
+        
+        finisher = asyncio.create_task(finish())
+        loop = asyncio.get_running_loop()
+        detached = False
+        
+        try:
+            start_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            header = (
+                f"=== СКРИПТ ЗАПУСКАЕТЬСЯ  ===\n"
+                f"Время: {start_time}\n"
+                f"Пользователь: {user_id}\n"
+                + "=" * 40 + "\n\n"
+            )
+            if resumed:
+                header = f"\n=== ХОСТИНГ ПЕРЕЗАПУЩЕН, ЛОГИ ПРОДОЛЖАЮТСЯ ({start_time}) ===\n\n"
+            await asyncio.to_thread(log_store.write, header.encode('utf-8'), generation=generation)
+            
+            cached_second = None
+            timestamp = ""
+            finished = False
+            lines_written = 0
+            
+            while not finished:
+                item = await queue.get()
+                if item is None:
+                    break
+                
+                buffer = []
+                buffer_size = 0
+                records = []
+                deadline = loop.time() + LOG_FLUSH_INTERVAL
                 
                 while True:
-                    # Read stdout - обычные сообщения
-                    try:
-                        stdout = await asyncio.wait_for(process.stdout.readline(), timeout=1.0)
-                        if stdout:
-                            line = stdout.decode('utf-8', errors='ignore').strip()
-                            if line:  # Не пишем пустые строки
-                                timestamp = datetime.now().strftime("%H:%M:%S")
-                                await log.write(f"[{timestamp}] {line}\n")
-                                await log.flush()
-                                print(f"[USER {user_id} STDOUT] {line}")
-                    except asyncio.TimeoutError:
-                        pass
+                    stream_name, received_at, data, capture_offset = item
+                    if capture_offset is not None:
+                        capture_offsets[stream_name] = capture_offset
+                    second = int(received_at)
+                    if second != cached_second:
+                        cached_second = second
+                        timestamp = datetime.fromtimestamp(second).strftime("%H:%M:%S")
+                    line, text, severity = self._format_line(stream_name, timestamp, data)
+                    if line:
+                        records.append((buffer_size, received_at, stream_name, severity, text))
+                        buffer.append(line)
+                        buffer_size += len(line)
                     
-                    # Read stderr - проверяем настоящие ли это ошибки
-                    try:
-                        stderr = await asyncio.wait_for(process.stderr.readline(), timeout=1.0)
-                        if stderr:
-                            line = stderr.decode('utf-8', errors='ignore').strip()
-                            if line:  # Не пишем пустые строки
-                                timestamp = datetime.now().strftime("%H:%M:%S")
-                                
-                                # Определяем тип сообщения
-                                if self._is_error_message(line):
-                                    await log.write(f"[{timestamp}] [ERROR] {line}\n")
-                                    print(f"[USER {user_id} STDERR] ❌ {line}")
-                                else:
-                                    await log.write(f"[{timestamp}] [INFO] {line}\n")
-                                    print(f"[USER {user_id} STDERR] ℹ️ {line}")
-                                
-                                await log.flush()
-                    except asyncio.TimeoutError:
-                        pass
-                    
-                    # Check if process ended
-                    if process.returncode is not None:
-                        end_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                        await log.write(f"\n" + "=" * 40 + "\n")
-                        await log.write(f"=== СКРИПТ ЗАВЕРШЕН ===\n")
-                        await log.write(f"Время: {end_time}\n")
-                        await log.write(f"Код завершения: {process.returncode}\n")
-                        
-                        # Добавляем информацию о результате
-                        if process.returncode == 0:
-                            await log.write(f"Результат: УСПЕШНО ✅\n")
-                        else:
-                            await log.write(f"Результат: ОШИБКА ❌ (код: {process.returncode})\n")
-                        
-                        await log.write("=" * 40 + "\n")
-                        await log.flush()
-                        print(f"✅ Скрипт пользователя {user_id} завершен с кодом: {process.returncode}")
+                    if buffer_size >= LOG_FLUSH_BYTES:
+                        break
+                    if not queue.empty():
+                        item = queue.get_nowait()
+                    else:
+                        remaining = deadline - loop.time()
+                        if remaining <= 0:
+                            break
+                        try:
+                            item = await asyncio.wait_for(queue.get(), timeout=remaining)
+                        except asyncio.TimeoutError:
+                            break
+                    if item is None:
+                        finished = True
                         break
+                
+                if buffer:
+                    if user_id in self._line_subscribers:
+                        self._publish(user_id, [line.decode('utf-8', errors='ignore') for line in buffer])
+                    await asyncio.to_thread(log_store.write, b"".join(buffer), records, dict(capture_offsets), generation)
+                    lines_written += len(buffer)
+            
+            end_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            footer = (
+                f"\n" + "=" * 40 + "\n"
+                f"=== СКРИПТ ЗАВЕРШЕН ===\n"
+                f"Время: {end_time}\n"
+                f"Код завершения: {process.returncode}\n"
+            )
+            
+            # Добавляем информацию о результате
+            if process.returncode == 0:
+                footer += f"Результат: УСПЕШНО ✅\n"
+            else:
+                footer += f"Результат: ОШИБКА ❌ (код: {process.returncode})\n"
+            
+            for kind, text in await asyncio.to_thread(self.limits.release, user_id, process.pid):
+                footer += f"Причина: {text}\n"
+                await asyncio.to_thread(log_store.record_limit, kind)
+            
+            footer += "=" * 40 + "\n"
+            await asyncio.to_thread(log_store.write, footer.encode('utf-8'), generation=generation)
+            await asyncio.to_thread(log_store.record_exit, process.returncode, generation)
+            self._publish(user_id, [f"=== СКРИПТ ЗАВЕРШЕН (код: {process.returncode}) ===\n"], finished=True)
+            print(f"✅ Скрипт пользователя {user_id} завершен с кодом: {process.returncode} "
+                  f"(строк в логе: {lines_written})")
                         
+        except asyncio.CancelledError:
+            # Бот останавливается - скрипт продолжает работать, после рестарта подключимся заново
+            detached = True
+            raise
         except Exception as e:
             print(f"❌ Ошибка логирования для пользователя {user_id}: {e}")
+        finally:
+            if self._log_queues.get(user_id) is queue:
+                self._log_queues.pop(user_id, None)
+            await asyncio.to_thread(log_store.close, generation)
+            for task in readers + [finisher]:
+                task.cancel()
+            if not detached:
+                if process.returncode is None:
+                    # Логирование упало раньше процесса - завершение все равно нужно отследить
+                    await process.wait()
+                await asyncio.to_thread(self.registry.remove, user_id, process.pid)
+                self._handle_exit(user_id, process, started_at)
+    
+    async def report_limit_event(self, user_id: int, kind: str, text: str):
+        """Записать событие лимита ресурсов (OOM, троттлинг) в лог и статистику пользователя"""
+        queue = self._log_queues.get(user_id)
+        if queue is not None:
+            await queue.put(('limits', time.time(), text.encode('utf-8'), None))
+        await asyncio.to_thread(log_manager.get_store(user_id).record_limit, kind)
+        print(f"🧱 Пользователь {user_id}: {text}")
+    
+    async def start_limits_watchdog(self):
+        """Фоновая проверка OOM и троттлинга запущенных скриптов"""
+        await self.limits.start_watchdog(
+            lambda: self.running_processes,
+            self.resource_monitor.get_latest,
+            self.report_limit_event
+        )
     
     def is_script_running(self, user_id: int) -> bool:
         """Check if script is running"""
@@ -210,39 +509,50 @@ class ScriptRunner:
                 return f"stopped (code: {process.returncode})"
         return "stopped"
     
-    def get_resource_usage(self, user_id: int) -> dict:
-        """Get resource usage for user"""
-        cpu_percent = psutil.cpu_percent(interval=1)
-        memory = psutil.virtual_memory()
+    def get_resource_usage(self, user_id: int, ram_limit: Optional[int] = None) -> dict:
+        """Get resource usage for user script from the background sampler (no blocking)"""
+        sample = self.resource_monitor.get_latest(user_id)
+        history = self.resource_monitor.get_history(user_id)[-RESOURCE_SPARKLINE_POINTS:]
+        ram_total = ram_limit or psutil.virtual_memory().total
         
         return {
-            "cpu": f"{cpu_percent}%",
-            "ram_used": f"{memory.used / (1024 * 1024):.1f} MB",
-            "ram_total": f"{memory.total / (1024 * 1024):.1f} MB",
-            "storage_used": "0 GB",
-            "storage_total": "2 GB"
+            "cpu": f"{sample.cpu:.1f}%" if sample else "0%",
+            "ram_used": f"{(sample.rss if sample else 0) / (1024 * 1024):.1f} MB",
+            "ram_total": f"{ram_total / (1024 * 1024):.0f} MB",
+            "fds": sample.fds if sample else 0,
+            "threads": sample.threads if sample else 0,
+            "cpu_history": ResourceMonitor.sparkline([s.cpu for s in history], max_value=100),
+            "ram_history": ResourceMonitor.sparkline([s.rss for s in history], max_value=ram_total)
         }
     
-    async def get_logs(self, user_id: int) -> Optional[str]:
-        """Get script logs"""
-        log_file = f"logs/user_{user_id}/script.log"
-        if os.path.exists(log_file):
-            async with aiofiles.open(log_file, 'r', encoding='utf-8') as f:
-                return await f.read()
-        return None
-    
-    async def get_errors(self, user_id: int) -> Optional[str]:
-        """Get only error logs"""
-        log_file = f"logs/user_{user_id}/script.log"
-        if os.path.exists(log_file):
-            async with aiofiles.open(log_file, 'r', encoding='utf-8') as f:
-                content = await f.read()
-                # Фильтруем только строки с ошибками
-                error_lines = []
-                for line in content.split('\n'):
-                    if '[ERROR]' in line:
-                        error_lines.append(line)
-                return '\n'.join(error_lines) if error_lines else None
-        return None
+    async def get_logs(self, user_id: int, max_bytes: int = LOG_READ_MAX_BYTES) -> Optional[str]:
+        """Get the newest script logs (at most max_bytes)"""
+        log_store = log_manager.get_store(user_id)
+        logs = await asyncio.to_thread(log_store.read_tail, max_bytes)
+        return logs or None
+    
+    async def get_errors(self, user_id: int, limit: int = LOG_ERROR_TAIL_LINES) -> Optional[str]:
+        """Get only error logs (the newest `limit` lines from the error index)"""
+        log_store = log_manager.get_store(user_id)
+        error_lines = await asyncio.to_thread(log_store.read_errors, limit)
+        return '\n'.join(error_lines) if error_lines else None
+    
+    async def get_error_count(self, user_id: int) -> int:
+        """Количество строк с ошибками в логах пользователя"""
+        return await asyncio.to_thread(log_manager.get_store(user_id).error_count)
+    
+    async def get_log_stats(self, user_id: int) -> dict:
+        """Счетчики строк по важности, последняя ошибка и завершения скрипта"""
+        return await asyncio.to_thread(log_manager.get_store(user_id).get_stats)
+    
+    async def get_log_tail(self, user_id: int, lines: int = LOG_TAIL_LINES):
+        """Последние строки лога: (текст, курсор более старой страницы или None)"""
+        log_store = log_manager.get_store(user_id)
+        return await asyncio.to_thread(log_store.read_tail_lines, lines, LOG_PAGE_BYTES)
+    
+    async def get_log_page(self, user_id: int, cursor: Optional[int], max_bytes: int = LOG_PAGE_BYTES):
+        """Страница лога, заканчивающаяся на cursor: (текст, курсор следующей страницы или None)"""
+        log_store = log_manager.get_store(user_id)
+        return await asyncio.to_thread(log_store.read_before, cursor, max_bytes)
 
 script_runner = ScriptRunner()
\ No newline at end of file
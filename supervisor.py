@@ -0,0 +1,214 @@
+import asyncio
+import time
+from collections import deque
+from firebase_db import firebase_db, async_firebase_db
+from config import (
+    SUPERVISOR_DEFAULT_POLICY, SUPERVISOR_BACKOFF_BASE, SUPERVISOR_BACKOFF_MAX,
+    SUPERVISOR_STABLE_UPTIME, SUPERVISOR_MAX_RESTARTS, SUPERVISOR_CRASH_WINDOW
+)
+from utils.script_runner import script_runner
+from utils.notifier import notifier
+
+class ScriptSupervisor:
+    """Надзор за скриптами пользователей.
+
+    Завершившийся скрипт перезапускается по политике пользователя (restart_policy):
+    never - не перезапускать, on-failure - только при ненулевом коде, always - всегда.
+    Задержка растет экспоненциально и сбрасывается, если скрипт проработал
+    SUPERVISOR_STABLE_UPTIME. Больше SUPERVISOR_MAX_RESTARTS падений за
+    SUPERVISOR_CRASH_WINDOW - скрипт в карантине до ручного запуска.
+    Статус и счетчики аптайма пишутся отложенно (stage_user_update): частые
+    смены статуса склеиваются в окне FIREBASE_COALESCE_WINDOW.
+    """
+
+    NEVER = 'never'
+    ON_FAILURE = 'on-failure'
+    ALWAYS = 'always'
+    POLICIES = (NEVER, ON_FAILURE, ALWAYS)
+
+    def __init__(self, runner):
+        self.runner = runner
+        self._specs = {}          # user_id -> параметры запуска под надзором
+        self._crashes = {}        # user_id -> deque(время падения)
+        self._attempts = {}       # user_id -> перезапусков подряд (для задержки)
+        self._restart_tasks = {}  # user_id -> отложенный перезапуск
+        self._uptime_total = {}
+        runner.add_exit_listener(self._on_exit)
+
+    @classmethod
+    def normalize_policy(cls, policy):
+        return policy if policy in cls.POLICIES else SUPERVISOR_DEFAULT_POLICY
+
+    # ===== ЗАПУСК И ОСТАНОВКА =====
+
+    async def start(self, user_id, script_path, python_version="3.9", log_quota=None, limits=None):
+        """Запустить скрипт под надзором. Возвращает (success, message) как start_script"""
+        self.cancel_restart(user_id)
+        user_data = await async_firebase_db.get_user(user_id) or {}
+
+        success, result = await self.runner.start_script(user_id, script_path, python_version,
+                                                         log_quota=log_quota, limits=limits)
+        if not success:
+            self._specs.pop(user_id, None)
+            return success, result
+
+        self._specs[user_id] = {
+            'script_path': script_path,
+            'python_version': python_version,
+            'log_quota': log_quota,
+            'limits': limits,
+            'policy': self.normalize_policy(user_data.get('restart_policy')),
+            'restarts': 0
+        }
+        self._crashes.pop(user_id, None)
+        self._attempts.pop(user_id, None)
+        self._uptime_total[user_id] = user_data.get('script_uptime_total', 0)
+        self._stage(user_id, {
+            'script_status': 'running',
+            'script_restarts': 0,
+            'script_started_at': int(time.time())
+        })
+        return success, result
+
+    async def stop(self, user_id, status='stopped'):
+        """Остановить скрипт и снять его с надзора (в том числе отменить ожидающий перезапуск)"""
+        self._specs.pop(user_id, None)
+        cancelled = self.cancel_restart(user_id)
+        stopped = await self.runner.stop_script(user_id)
+        self._stage(user_id, {'script_status': status})
+        return stopped or cancelled
+
+    async def recover(self):
+        """После рестарта бота вернуть скрипты из реестра ScriptRunner под надзор.
+
+        Живые процессы подключаются заново, завершившиеся за время рестарта
+        обрабатываются по политике как обычное падение. Статусы пишутся одной пачкой."""
+        entries = await self.runner.load_registry()
+        if not entries:
+            return
+
+        users = await asyncio.gather(*(async_firebase_db.get_user(user_id) for user_id in entries))
+        for (user_id, entry), user_data in zip(entries.items(), users):
+            user_data = user_data or {}
+            self._specs[user_id] = {
+                'script_path': entry['script_path'],
+                'python_version': entry['python_version'],
+                'log_quota': entry.get('log_quota'),
+                'limits': entry.get('limits'),
+                'policy': self.normalize_policy(user_data.get('restart_policy')),
+                'restarts': user_data.get('script_restarts', 0)
+            }
+            self._uptime_total[user_id] = user_data.get('script_uptime_total', 0)
+
+        alive = await self.runner.reattach(entries)
+        for user_id, is_alive in alive.items():
+            if is_alive:
+                self._stage(user_id, {'script_status': 'running'})
+        await async_firebase_db.flush_staged()
+
+    def cancel_restart(self, user_id):
+        task = self._restart_tasks.pop(user_id, None)
+        if task and not task.done():
+            task.cancel()
+            return True
+        return False
+
+    def is_restart_pending(self, user_id):
+        task = self._restart_tasks.get(user_id)
+        return task is not None and not task.done()
+
+    # ===== ПЕРЕЗАПУСК =====
+
+    def _on_exit(self, user_id, returncode, stop_requested, uptime):
+        """Слушатель ScriptRunner: решить, перезапускать ли завершившийся скрипт"""
+        self._stage(user_id, {'script_last_exit_code': returncode})
+        if user_id in self._uptime_total:
+            self._uptime_total[user_id] += int(uptime)
+            self._stage(user_id, {'script_uptime_total': self._uptime_total[user_id]})
+
+        spec = self._specs.get(user_id)
+        if stop_requested:
+            # Статус уже записал stop()
+            return
+        if spec is None:
+            self._stage(user_id, {'script_status': 'stopped'})
+            return
+
+        policy = spec['policy']
+        if policy == self.NEVER or (policy == self.ON_FAILURE and returncode == 0):
+            self._specs.pop(user_id, None)
+            self._stage(user_id, {'script_status': 'stopped' if returncode == 0 else 'crashed'})
+            return
+
+        now = time.time()
+        if uptime >= SUPERVISOR_STABLE_UPTIME:
+            self._attempts.pop(user_id, None)
+
+        crashes = self._crashes.setdefault(user_id, deque())
+        crashes.append(now)
+        while crashes and crashes[0] < now - SUPERVISOR_CRASH_WINDOW:
+            crashes.popleft()
+
+        if len(crashes) > SUPERVISOR_MAX_RESTARTS:
+            self._quarantine(user_id, returncode, len(crashes))
+            return
+
+        attempt = self._attempts.get(user_id, 0)
+        self._attempts[user_id] = attempt + 1
+        delay = min(SUPERVISOR_BACKOFF_BASE * 2 ** attempt, SUPERVISOR_BACKOFF_MAX)
+        print(f"🔁 Скрипт пользователя {user_id} завершился с кодом {returncode}, "
+              f"перезапуск через {delay} сек")
+        self._stage(user_id, {'script_status': 'restarting'})
+        self._restart_tasks[user_id] = asyncio.create_task(self._restart_later(user_id, delay))
+
+    async def _restart_later(self, user_id, delay):
+        await asyncio.sleep(delay)
+        self._restart_tasks.pop(user_id, None)
+        spec = self._specs.get(user_id)
+        if spec is None or self.runner.is_script_running(user_id):
+            return
+
+        success, result = await self.runner.start_script(
+            user_id, spec['script_path'], spec['python_version'],
+            log_quota=spec['log_quota'], limits=spec['limits']
+        )
+        if not success:
+            self._specs.pop(user_id, None)
+            self._stage(user_id, {'script_status': 'crashed'})
+            notifier.send_message(
+                user_id,
+                f"❌ Не удалось перезапустить ваш скрипт: {result}\n\n"
+                f"Проверьте файлы и запустите его вручную."
+            )
+            return
+
+        spec['restarts'] += 1
+        print(f"✅ Скрипт пользователя {user_id} перезапущен (перезапуск #{spec['restarts']})")
+        self._stage(user_id, {
+            'script_status': 'running',
+            'script_restarts': spec['restarts'],
+            'script_started_at': int(time.time())
+        })
+
+    def _quarantine(self, user_id, returncode, crashes):
+        self._specs.pop(user_id, None)
+        self._attempts.pop(user_id, None)
+        self._crashes.pop(user_id, None)
+        self._stage(user_id, {'script_status': 'crashed'})
+        print(f"🚫 Скрипт пользователя {user_id} падает в цикле ({crashes} раз), автоперезапуск отключен")
+        notifier.send_message(
+            user_id,
+            f"🚫 Ваш скрипт падает слишком часто\n\n"
+            f"Завершений за {SUPERVISOR_CRASH_WINDOW // 60} мин: {crashes}\n"
+            f"Последний код завершения: {returncode}\n\n"
+            f"Автоперезапуск отключен. Проверьте ошибки в меню \"📋 Логи\" "
+            f"и запустите скрипт вручную."
+        )
+
+    # ===== ЗАПИСЬ В БАЗУ =====
+
+    @staticmethod
+    def _stage(user_id, updates):
+        firebase_db.stage_user_update(user_id, updates)
+
+supervisor = ScriptSupervisor(script_runner)
@@ -3,7 +3,7 @@ from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from firebase_db import firebase_db
+from firebase_db import firebase_db, async_firebase_db
 from keyboards import (
     get_templates_keyboard, 
     get_template_settings_keyboard,
@@ -11,9 +11,12 @@ from keyboards import (
     get_main_keyboard
 )
 from config import BOT_TEMPLATES
+from utils.deployer import deployer
+from utils.file_manifest import file_manifest
 import os
 import json
 import shutil
+import asyncio
 from datetime import datetime
 
 router = Router()
@@ -48,37 +51,43 @@ def save_template_config(user_id: int, template_type: str, config: dict):
     config_file = get_template_config_file(user_id, template_type)
     with open(config_file, 'w', encoding='utf-8') as f:
         json.dump(config, f, ensure_ascii=False, indent=2)
+    file_manifest.update_file(user_id, os.path.basename(config_file))
 
 def copy_template_files(template_type: str, user_id: int, config: dict):
     template_folder = f"templates/{template_type}"
-    user_folder = f"user_files/{user_id}"
     
     if not os.path.exists(template_folder):
         return False
     
-    if os.path.exists(user_folder):
-        shutil.rmtree(user_folder)
-    os.makedirs(user_folder, exist_ok=True)
+    # Собираем шаблон в отдельной папке и подменяем файлы пользователя целиком
+    staging_folder = deployer.create_staging(user_id)
     
     try:
         for item in os.listdir(template_folder):
             source_path = os.path.join(template_folder, item)
-            dest_path = os.path.join(user_folder, item)
+            dest_path = os.path.join(staging_folder, item)
             
             if os.path.isfile(source_path):
                 shutil.copy2(source_path, dest_path)
         
         # Сохраняем конфиг в основной файл конфигурации
-        config_file_path = os.path.join(user_folder, "config.json")
+        config_file_path = os.path.join(staging_folder, "config.json")
         with open(config_file_path, 'w', encoding='utf-8') as f:
             json.dump(config, f, ensure_ascii=False, indent=2)
         
+        deployer.commit(user_id, staging_folder)
         return True
         
     except Exception as e:
+        deployer.discard(staging_folder)
         print(f"❌ Ошибка копирования файлов шаблона: {e}")
         return False
 
+def revert_template_files(user_id: int):
+    """Отменить установку шаблона: вернуть прежние файлы, а если их не было - убрать установленные"""
+    if not deployer.rollback(user_id):
+        deployer.remove(user_id)
+
 def has_active_hosting(user_data) -> bool:
     """Проверить активный хостинг"""
     hosting_plan = user_data.get('hosting_plan')
@@ -600,7 +609,7 @@ async def process_template_install_with_token(message: Message, state: FSMContex
     user_id = message.from_user.id
     
     # Проверяем наличие активного хостинга перед установкой
-    user_data = firebase_db.get_user(str(user_id)) or {}
+    user_data = await async_firebase_db.get_user(str(user_id)) or {}
     if not has_active_hosting(user_data):
         await message.answer(
             "❌ <b>Установка отменена!</b>\n\n"
@@ -619,22 +628,21 @@ async def process_template_install_with_token(message: Message, state: FSMContex
     
     # Устанавливаем шаблон
     template = BOT_TEMPLATES[template_type]
-    new_balance = firebase_db.update_balance(str(user_id), -template['price'])
-    
-    success = copy_template_files(template_type, user_id, config)
+    success = await asyncio.to_thread(copy_template_files, template_type, user_id, config)
     
     if not success:
-        firebase_db.update_balance(str(user_id), template['price'])
         await message.answer("❌ Ошибка при копировании файлов шаблона")
         await state.clear()
         return
     
     # Подсчитываем файлы
-    user_folder = f"user_files/{user_id}"
-    file_count = len([f for f in os.listdir(user_folder) if os.path.isfile(os.path.join(user_folder, f))])
+    file_count = file_manifest.files_count(user_id)
     
-    # Обновляем данные пользователя
-    firebase_db.update_user(str(user_id), {
+    # Списание и данные пользователя - одной записью. Файлы к этому моменту уже
+    # выложены: если запись не прошла, откатываем их, иначе шаблон достался бы бесплатно
+    batch = firebase_db.batch()
+    new_balance = await async_firebase_db.batch_add_balance(batch, str(user_id), -template['price'])
+    batch.update_user(str(user_id), {
         'has_files': True,
         'files_count': file_count,
         'main_file': 'main.py',
@@ -642,6 +650,11 @@ async def process_template_install_with_token(message: Message, state: FSMContex
         'is_template': True,  # Помечаем что установлен шаблон
         'template_type': template_type  # Сохраняем тип шаблона
     })
+    if not await async_firebase_db.commit(batch):
+        await asyncio.to_thread(revert_template_files, user_id)
+        await message.answer("❌ Ошибка при сохранении данных шаблона")
+        await state.clear()
+        return
     
     success_text = f"""✅ <b>Шаблон установлен!</b>
 
@@ -660,7 +673,7 @@ async def install_template(callback: CallbackQuery, template_type: str, user_id:
     template = BOT_TEMPLATES[template_type]
     
     # Проверяем наличие активного хостинга перед установкой
-    user_data = firebase_db.get_user(str(user_id)) or {}
+    user_data = await async_firebase_db.get_user(str(user_id)) or {}
     if not has_active_hosting(user_data):
         await callback.answer(
             "❌ Вы не можете установить шаблон так как у вас нет активного хостинга", 
@@ -682,21 +695,20 @@ async def install_template(callback: CallbackQuery, template_type: str, user_id:
         await callback.answer(f"❌ Папка шаблона не найдена по пути: {template_folder}", show_alert=True)
         return
     
-    new_balance = firebase_db.update_balance(str(user_id), -template['price'])
-    
-    success = copy_template_files(template_type, user_id, config)
+    success = await asyncio.to_thread(copy_template_files, template_type, user_id, config)
     
     if not success:
-        firebase_db.update_balance(str(user_id), template['price'])
         await callback.answer("❌ Ошибка при копировании файлов шаблона", show_alert=True)
         return
     
     # Подсчитываем файлы
-    user_folder = f"user_files/{user_id}"
-    file_count = len([f for f in os.listdir(user_folder) if os.path.isfile(os.path.join(user_folder, f))])
+    file_count = file_manifest.files_count(user_id)
     
-    # Обновляем данные пользователя
-    firebase_db.update_user(str(user_id), {
+    # Списание и данные пользователя - одной записью. Файлы к этому моменту уже
+    # выложены: если запись не прошла, откатываем их, иначе шаблон достался бы бесплатно
+    batch = firebase_db.batch()
+    new_balance = await async_firebase_db.batch_add_balance(batch, str(user_id), -template['price'])
+    batch.update_user(str(user_id), {
         'has_files': True,
         'files_count': file_count,
         'main_file': 'main.py',
@@ -704,6 +716,10 @@ async def install_template(callback: CallbackQuery, template_type: str, user_id:
         'is_template': True,  # Помечаем что установлен шаблон
         'template_type': template_type  # Сохраняем тип шаблона
     })
+    if not await async_firebase_db.commit(batch):
+        await asyncio.to_thread(revert_template_files, user_id)
+        await callback.answer("❌ Ошибка при сохранении данных шаблона", show_alert=True)
+        return
     
     success_text = f"""✅ <b>Шаблон установлен!</b>
 
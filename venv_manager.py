@@ -0,0 +1,215 @@
+import asyncio
+import glob
+import json
+import os
+import shutil
+import time
+from config import (
+    VENV_ROOT, VENV_PIP_CACHE, VENV_CREATE_TIMEOUT, VENV_LEGACY_PYTHON, VENV_MIGRATION_RETRY
+)
+
+# Отметка в окружении: библиотеки пользователя в нем установлены (перенос не нужен)
+MIGRATED_MARKER = ".libraries_migrated"
+
+class VenvManager:
+    """Отдельное виртуальное окружение на пользователя и версию Python.
+
+    venvs/<user_id>/py<версия> создается без pip (доли секунды), а pip попадает в него
+    жесткими ссылками из базового окружения venvs/.base/py<версия>, которое
+    создается один раз на версию. Все установки идут через общий кэш pip
+    (VENV_PIP_CACHE), поэтому одинаковые пакеты скачиваются и собираются один раз.
+
+    До окружений библиотеки ставились в общий интерпретатор (VENV_LEGACY_PYTHON).
+    Если у пользователя есть libraries.json или requirements.txt, новое окружение
+    сначала пустое: слушатели переноса (add_migration_listener) переустанавливают
+    в него библиотеки, а скрипт до отметки MIGRATED_MARKER запускается по-старому.
+    """
+
+    def __init__(self, root=VENV_ROOT, pip_cache=VENV_PIP_CACHE):
+        self.root = root
+        self.base_root = os.path.join(root, '.base')
+        self.pip_cache = pip_cache
+        self._locks = {}
+        self._migration_listeners = []
+        self._migration_requested = {}  # (user_id, версия) -> когда запрошен перенос
+
+    def _lock(self, key):
+        return self._locks.setdefault(key, asyncio.Lock())
+
+    # ===== ПУТИ =====
+
+    @staticmethod
+    def get_interpreter(python_version: str) -> str:
+        """Системный интерпретатор для версии ("3.11" -> python3.11), иначе python3"""
+        if python_version and python_version.startswith('3.'):
+            interpreter = shutil.which(f"python{python_version}")
+            if interpreter:
+                return interpreter
+            print(f"⚠️ Python {python_version} не установлен на сервере - используем python3")
+        return shutil.which("python3") or "python3"
+
+    def get_venv_path(self, user_id, python_version: str) -> str:
+        return os.path.join(self.root, str(user_id), f"py{python_version}")
+
+    @staticmethod
+    def get_python(venv_path: str) -> str:
+        return os.path.abspath(os.path.join(venv_path, 'bin', 'python'))
+
+    @staticmethod
+    def site_packages(venv_path: str):
+        paths = glob.glob(os.path.join(venv_path, 'lib', 'python*', 'site-packages'))
+        return paths[0] if paths else None
+
+    def pip_env(self) -> dict:
+        """Окружение для pip: общий кэш загрузок и колес, без проверки версии pip"""
+        env = dict(os.environ)
+        env['PIP_CACHE_DIR'] = os.path.abspath(self.pip_cache)
+        env['PIP_DISABLE_PIP_VERSION_CHECK'] = '1'
+        return env
+
+    # ===== СОЗДАНИЕ =====
+
+    async def _run(self, *args):
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=self.pip_env()
+        )
+        try:
+            _, stderr = await asyncio.wait_for(process.communicate(), timeout=VENV_CREATE_TIMEOUT)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise RuntimeError(f"Превышено время выполнения: {' '.join(args[:3])}")
+        if process.returncode != 0:
+            raise RuntimeError(stderr.decode('utf-8', errors='ignore').strip()[-1000:])
+
+    async def ensure_base(self, python_version: str) -> str:
+        """Базовое окружение с pip для версии (создается один раз)"""
+        base_path = os.path.join(self.base_root, f"py{python_version}")
+        async with self._lock(f"base:{python_version}"):
+            if not os.path.exists(self.get_python(base_path)):
+                print(f"🐍 Создаю базовое окружение Python {python_version}")
+                tmp_path = f"{base_path}.tmp"
+                await asyncio.to_thread(shutil.rmtree, tmp_path, True)
+                await self._run(self.get_interpreter(python_version), '-m', 'venv', tmp_path)
+                os.replace(tmp_path, base_path)
+        return base_path
+
+    @staticmethod
+    def _link_tree(source: str, destination: str):
+        """Скопировать дерево жесткими ссылками (копированием, если ссылки невозможны)"""
+        for root, dirs, files in os.walk(source):
+            if '__pycache__' in dirs:
+                dirs.remove('__pycache__')
+            target_dir = os.path.join(destination, os.path.relpath(root, source))
+            os.makedirs(target_dir, exist_ok=True)
+            for name in files:
+                target = os.path.join(target_dir, name)
+                if os.path.exists(target):
+                    continue
+                try:
+                    os.link(os.path.join(root, name), target)
+                except OSError:
+                    shutil.copy2(os.path.join(root, name), target)
+
+    async def ensure(self, user_id, python_version: str) -> str:
+        """Окружение пользователя (создается при первом обращении). Возвращает путь"""
+        venv_path = self.get_venv_path(user_id, python_version)
+        if os.path.exists(self.get_python(venv_path)):
+            return venv_path
+
+        async with self._lock(f"{user_id}:{python_version}"):
+            if os.path.exists(self.get_python(venv_path)):
+                return venv_path
+
+            base_path = await self.ensure_base(python_version)
+            tmp_path = f"{venv_path}.tmp"
+            await asyncio.to_thread(shutil.rmtree, tmp_path, True)
+            await self._run(self.get_interpreter(python_version), '-m', 'venv', '--without-pip', tmp_path)
+
+            base_site = self.site_packages(base_path)
+            user_site = self.site_packages(tmp_path)
+            if base_site and user_site:
+                await asyncio.to_thread(self._link_tree, base_site, user_site)
+            legacy = self.has_legacy_packages(user_id)
+            if not legacy:
+                open(os.path.join(tmp_path, MIGRATED_MARKER), 'w').close()
+            os.replace(tmp_path, venv_path)
+            print(f"🐍 Окружение пользователя {user_id} (Python {python_version}) создано")
+
+        if legacy:
+            await self._request_migration(user_id, python_version)
+        return venv_path
+
+    async def get_python_for_user(self, user_id, python_version: str) -> str:
+        """Интерпретатор окружения пользователя (окружение создается при необходимости)"""
+        return self.get_python(await self.ensure(user_id, python_version))
+
+    async def pip_command(self, user_id, python_version: str, *args) -> list:
+        """Команда pip внутри окружения пользователя"""
+        return [await self.get_python_for_user(user_id, python_version), '-m', 'pip', *args]
+
+    async def get_launch_python(self, user_id, python_version: str) -> str:
+        """Интерпретатор для запуска скрипта: окружение пользователя, а пока библиотеки
+        не перенесены в него - общий интерпретатор, в котором они были установлены"""
+        venv_path = await self.ensure(user_id, python_version)
+        if self.is_migrated(venv_path):
+            return self.get_python(venv_path)
+        if not self.has_legacy_packages(user_id):
+            self.mark_migrated(user_id, python_version)
+            return self.get_python(venv_path)
+
+        await self._request_migration(user_id, python_version)
+        print(f"⚠️ Библиотеки пользователя {user_id} еще не перенесены в окружение - запуск в {VENV_LEGACY_PYTHON}")
+        return shutil.which(VENV_LEGACY_PYTHON) or VENV_LEGACY_PYTHON
+
+    # ===== ПЕРЕНОС СТАРЫХ УСТАНОВОК =====
+
+    def add_migration_listener(self, callback):
+        """callback(user_id, python_version) - корутина, которая ставит библиотеки
+        пользователя в окружение и по успеху вызывает mark_migrated"""
+        self._migration_listeners.append(callback)
+
+    @staticmethod
+    def has_legacy_packages(user_id) -> bool:
+        """Есть ли у пользователя библиотеки, установленные до окружений"""
+        user_folder = os.path.join('user_files', str(user_id))
+        if os.path.exists(os.path.join(user_folder, 'requirements.txt')):
+            return True
+        try:
+            with open(os.path.join(user_folder, 'libraries.json'), 'r', encoding='utf-8') as f:
+                return bool(json.load(f))
+        except (OSError, json.JSONDecodeError):
+            return False
+
+    @staticmethod
+    def is_migrated(venv_path: str) -> bool:
+        return os.path.exists(os.path.join(venv_path, MIGRATED_MARKER))
+
+    def mark_migrated(self, user_id, python_version: str):
+        """Отметить, что библиотеки пользователя установлены в окружение"""
+        open(os.path.join(self.get_venv_path(user_id, python_version), MIGRATED_MARKER), 'w').close()
+        self._migration_requested.pop((str(user_id), python_version), None)
+
+    async def _request_migration(self, user_id, python_version: str):
+        """Запросить перенос библиотек (не чаще раза в VENV_MIGRATION_RETRY)"""
+        key = (str(user_id), python_version)
+        requested_at = self._migration_requested.get(key)
+        if requested_at is not None and time.time() - requested_at < VENV_MIGRATION_RETRY:
+            return
+        self._migration_requested[key] = time.time()
+        for listener in self._migration_listeners:
+            try:
+                await listener(user_id, python_version)
+            except Exception as e:
+                print(f"❌ Ошибка запуска переноса библиотек пользователя {user_id}: {e}")
+
+    # ===== УДАЛЕНИЕ =====
+
+    async def remove(self, user_id):
+        """Удалить все окружения пользователя"""
+        await asyncio.to_thread(shutil.rmtree, os.path.join(self.root, str(user_id)), True)
+
+venv_manager = VenvManager()
@@ -0,0 +1,167 @@
+import asyncio
+import glob
+import html
+import json
+import os
+import re
+import shutil
+import signal
+from collections import Counter
+from config import (
+    WHEELHOUSE_ROOT, WHEELHOUSE_BUILD_TIMEOUT, WHEELHOUSE_MIN_USERS, WHEELHOUSE_MAX_PACKAGES
+)
+from utils.venv_manager import venv_manager
+
+_NAME_RE = re.compile(r'^\s*([A-Za-z0-9][A-Za-z0-9._-]*)')
+
+def canonical_name(name: str) -> str:
+    """Имя пакета в каноническом виде (PEP 503)"""
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+def requirement_name(requirement: str):
+    """Имя пакета из строки требования ("requests>=2" -> "requests") или None"""
+    match = _NAME_RE.match(requirement)
+    return canonical_name(match.group(1)) if match else None
+
+class Wheelhouse:
+    """Локальное зеркало колес для установки библиотек.
+
+    venvs/.wheelhouse/wheels - готовые колеса популярных пакетов (pip wheel собирает
+    их один раз вместе с зависимостями), venvs/.wheelhouse/simple - индекс в формате
+    PEP 503 поверх того же каталога. Установка сначала идет только из локальных
+    колес (--no-index), если все нужные пакеты там есть, и с PyPI - при промахе;
+    --find-links добавляется всегда, так что найденное локально не скачивается.
+    """
+
+    def __init__(self, root=WHEELHOUSE_ROOT):
+        self.root = root
+        self.wheel_dir = os.path.join(root, 'wheels')
+        self.index_dir = os.path.join(root, 'simple')
+        self._names = set()
+        self._names_mtime = None
+        self._warm_lock = asyncio.Lock()
+
+    # ===== ПОИСК =====
+
+    def available(self):
+        """Канонические имена пакетов, для которых есть колеса (перечитывается при изменении каталога)"""
+        try:
+            mtime = os.path.getmtime(self.wheel_dir)
+        except OSError:
+            return set()
+        if mtime != self._names_mtime:
+            self._names = {
+                canonical_name(os.path.basename(path).split('-', 1)[0])
+                for path in glob.glob(os.path.join(self.wheel_dir, '*.whl'))
+            }
+            self._names_mtime = mtime
+        return self._names
+
+    def has_all(self, names) -> bool:
+        """Есть ли колеса для всех пакетов (пустой список или неизвестное имя - нет)"""
+        names = list(names or [])
+        available = self.available()
+        return bool(names) and all(name and name in available for name in names)
+
+    def install_args(self, offline=False) -> list:
+        """Аргументы pip install: локальные колеса, при offline - только они"""
+        if not self.available():
+            return []
+        args = ['--find-links', os.path.abspath(self.wheel_dir)]
+        if offline:
+            args.insert(0, '--no-index')
+        return args
+
+    # ===== ПРОГРЕВ =====
+
+    @staticmethod
+    def collect_popular(min_users=WHEELHOUSE_MIN_USERS, limit=WHEELHOUSE_MAX_PACKAGES):
+        """Популярные библиотеки по libraries.json всех пользователей: [(имя, пользователей), ...]"""
+        counter = Counter()
+        for path in glob.glob(os.path.join('user_files', '*', 'libraries.json')):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    libraries = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                continue
+            counter.update({requirement_name(library) for library in libraries} - {None})
+        return [(name, users) for name, users in counter.most_common(limit) if users >= min_users]
+
+    @staticmethod
+    def python_versions():
+        """Версии Python, для которых уже создавались окружения пользователей"""
+        versions = {
+            os.path.basename(path)[2:]
+            for path in glob.glob(os.path.join(venv_manager.base_root, 'py*'))
+            if not path.endswith('.tmp')
+        }
+        return sorted(versions) or ['3.9']
+
+    async def _build_wheel(self, python, package):
+        process = await asyncio.create_subprocess_exec(
+            python, '-m', 'pip', 'wheel', '--progress-bar', 'off',
+            '--wheel-dir', self.wheel_dir, '--find-links', self.wheel_dir, package,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+            env=venv_manager.pip_env(),
+            start_new_session=True
+        )
+        try:
+            _, stderr = await asyncio.wait_for(process.communicate(), timeout=WHEELHOUSE_BUILD_TIMEOUT)
+        except asyncio.TimeoutError:
+            os.killpg(process.pid, signal.SIGKILL)
+            await process.wait()
+            return "превышено время сборки"
+        if process.returncode != 0:
+            lines = stderr.decode('utf-8', errors='ignore').strip().splitlines()
+            return lines[-1] if lines else "ошибка pip"
+        return None
+
+    async def warm(self, packages, python_versions=None):
+        """Собрать колеса пакетов (с зависимостями) для каждой версии Python.
+
+        Возвращает (собрано, {пакет: ошибка})."""
+        async with self._warm_lock:
+            os.makedirs(self.wheel_dir, exist_ok=True)
+            built = 0
+            failed = {}
+            for python_version in python_versions or self.python_versions():
+                python = venv_manager.get_python(await venv_manager.ensure_base(python_version))
+                for package in packages:
+                    error = await self._build_wheel(python, package)
+                    if error:
+                        failed[f"{package} (Python {python_version})"] = error
+                    else:
+                        built += 1
+            await asyncio.to_thread(self.write_index)
+            print(f"🛞 Wheelhouse прогрет: собрано {built}, ошибок {len(failed)}")
+            return built, failed
+
+    def write_index(self):
+        """Пересоздать simple-индекс (PEP 503) по каталогу колес"""
+        projects = {}
+        for path in sorted(glob.glob(os.path.join(self.wheel_dir, '*.whl'))):
+            filename = os.path.basename(path)
+            projects.setdefault(canonical_name(filename.split('-', 1)[0]), []).append(filename)
+
+        tmp_dir = f"{self.index_dir}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for project, filenames in projects.items():
+            os.makedirs(os.path.join(tmp_dir, project), exist_ok=True)
+            links = "\n".join(
+                f'<a href="../../wheels/{html.escape(name)}">{html.escape(name)}</a><br>' for name in filenames
+            )
+            with open(os.path.join(tmp_dir, project, 'index.html'), 'w', encoding='utf-8') as f:
+                f.write(f"<!DOCTYPE html>\n<html><body>\n{links}\n</body></html>\n")
+        with open(os.path.join(tmp_dir, 'index.html'), 'w', encoding='utf-8') as f:
+            links = "\n".join(f'<a href="{project}/">{project}</a><br>' for project in sorted(projects))
+            f.write(f"<!DOCTYPE html>\n<html><body>\n{links}\n</body></html>\n")
+
+        old_dir = f"{self.index_dir}.old"
+        if os.path.exists(self.index_dir):
+            os.replace(self.index_dir, old_dir)
+        os.replace(tmp_dir, self.index_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+wheelhouse = Wheelhouse()